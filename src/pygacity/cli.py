@@ -7,7 +7,9 @@ import shutil
 
 import argparse as ap
 
-from .generate.build import build, answerset_subcommand
+from .generate.build import build, answers, answerset_subcommand
+from .generate.grade import grade_subcommand
+from .generate.validate import validate_subcommand
 from .util.pdfutils import combine_pdfs
 from .util.stringthings import oxford, banner
 
@@ -35,10 +37,22 @@ def cli():
             func = build,
             help = 'build document',
             ),
+        'answers': dict(
+            func = answers,
+            help = 'generate the answer set by running only the pycode of each serial, without typesetting',
+        ),
         'answerset' : dict(
             func = answerset_subcommand,
             help = 'remake answer set document from a previous build',
         ),
+        'grade': dict(
+            func = grade_subcommand,
+            help = 'grade a CSV file of responses against the answer set of a previous build',
+        ),
+        'validate': dict(
+            func = validate_subcommand,
+            help = "run a problem's pycode over the space of states it can pick, to find where it fails",
+        ),
         'combine': dict(
             func = combine_pdfs,
             help = 'combine PDFs',
@@ -94,6 +108,12 @@ def cli():
         default=False,
         action=ap.BooleanOptionalAction,
         help='completely remove old save dir and build new exams')
+    command_parsers['build'].add_argument(
+        '--resume',
+        type=bool,
+        default=False,
+        action=ap.BooleanOptionalAction,
+        help='finish a build that stopped partway, skipping serials already built')
     command_parsers['build'].add_argument(
         '-s',
         '--solutions',
@@ -102,11 +122,180 @@ def cli():
         action=ap.BooleanOptionalAction,
         help='build solutions document(s)')
     command_parsers['build'].add_argument(
+        '--cache',
+        type=bool,
+        default=True,
+        action=ap.BooleanOptionalAction,
+        help='reuse documents whose inputs are unchanged since the last build (with --overwrite)')
+    command_parsers['build'].add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help='number of worker processes used to build serials in parallel')
+    command_parsers['build'].add_argument(
+        '--scratch-dir',
+        type=str,
+        default=None,
+        help='directory in which per-serial scratch directories are made (default: the build directory); e.g., /dev/shm')
+    command_parsers['build'].add_argument(
+        '--precompile-preamble',
+        type=bool,
+        default=True,
+        action=ap.BooleanOptionalAction,
+        help='dump the document class and preamble into a pdflatex format once and load it for every document')
+    command_parsers['build'].add_argument(
+        '--executor',
+        type=str,
+        default=None,
+        choices=['pythontex', 'pygacity'],
+        help='what runs the pycode in documents: pythontex (default) or pygacity itself, before pdflatex')
+    command_parsers['build'].add_argument(
+        '--forkserver',
+        type=bool,
+        default=False,
+        action=ap.BooleanOptionalAction,
+        help='run pythontex code in processes forked from an interpreter with common modules already imported (not on Windows)')
+    command_parsers['build'].add_argument(
+        '--canary',
+        type=bool,
+        default=True,
+        action=ap.BooleanOptionalAction,
+        help='build the first serial alone and stop at its first error before building the others')
+    command_parsers['build'].add_argument(
+        '--unique-picks',
+        type=bool,
+        default=False,
+        action=ap.BooleanOptionalAction,
+        help='give each serial its own variant of the values its pycode picks, as long as there are enough of them')
+    command_parsers['build'].add_argument(
+        'f',
+        help='mandatory YAML input file')
+    command_parsers['answers'].add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help='number of worker processes used to run serials in parallel')
+    command_parsers['answers'].add_argument(
+        '--unique-picks',
+        type=bool,
+        default=False,
+        action=ap.BooleanOptionalAction,
+        help='give each serial its own variant of the values its pycode picks, as long as there are enough of them')
+    command_parsers['answers'].add_argument(
+        '--serials-per-document',
+        type=int,
+        default=None,
+        help='divide the answer set into documents of this many serials each, compiled in parallel')
+    command_parsers['answers'].add_argument(
         'f',
         help='mandatory YAML input file')
+    command_parsers['answerset'].add_argument(
+        '--serials',
+        type=int,
+        default=None,
+        nargs='+',
+        help='space-separated serials whose answers are included (default: all serials of the previous build)')
+    command_parsers['answerset'].add_argument(
+        '--serials-per-document',
+        type=int,
+        default=None,
+        help='divide the answer set into documents of this many serials each, compiled in parallel')
+    command_parsers['answerset'].add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=None,
+        help='number of answer set documents compiled at once (with --serials-per-document)')
     command_parsers['answerset'].add_argument(
         'f',
         help='mandatory YAML input file used in a previous build to generate the answer set')
+    command_parsers['grade'].add_argument(
+        '-r',
+        '--responses',
+        type=str,
+        required=True,
+        help='CSV file of responses: one row per student, with a "serial" column and one column per answer')
+    command_parsers['grade'].add_argument(
+        '-o',
+        '--output',
+        type=str,
+        default=None,
+        help='CSV file of scores to write (default: <responses>-scores.csv)')
+    command_parsers['grade'].add_argument(
+        '--rtol',
+        type=float,
+        default=None,
+        help='relative tolerance of numerical answers (default: 0.01, or grading: rtol in the config)')
+    command_parsers['grade'].add_argument(
+        '--atol',
+        type=float,
+        default=None,
+        help='absolute tolerance of numerical answers (default: 0, or grading: atol in the config)')
+    command_parsers['grade'].add_argument(
+        'f',
+        help='mandatory YAML input file used in a previous build')
+    command_parsers['validate'].add_argument(
+        '-p',
+        '--pythontex',
+        type=str,
+        default=['setup'],
+        nargs='+',
+        help='pythontex files whose code runs before the problem\'s (default: setup)')
+    command_parsers['validate'].add_argument(
+        '-m',
+        '--method',
+        type=str,
+        default='grid',
+        choices=['grid', 'lhs', 'sobol'],
+        help='visit every combination of picked values (grid) or sample the space (lhs or sobol; needs --samples)')
+    command_parsers['validate'].add_argument(
+        '-n',
+        '--samples',
+        type=int,
+        default=None,
+        help='number of states sampled by lhs or sobol')
+    command_parsers['validate'].add_argument(
+        '--intervals',
+        type=int,
+        default=10,
+        help='number of values at which a "between" range without its own intervals is stepped (default: 10)')
+    command_parsers['validate'].add_argument(
+        '--seed',
+        type=int,
+        default=None,
+        help='seed of the lhs or sobol sampler')
+    command_parsers['validate'].add_argument(
+        '--serial',
+        type=int,
+        default=1,
+        help='serial the problem\'s code is run as (default: 1)')
+    command_parsers['validate'].add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=None,
+        help='number of points computed at once (default: one per CPU)')
+    command_parsers['validate'].add_argument(
+        '--timeout',
+        type=float,
+        default=60.0,
+        help='seconds after which the computation of a point is stopped and counted as failed (default: 60)')
+    command_parsers['validate'].add_argument(
+        '--bins',
+        type=int,
+        default=10,
+        help='number of ranges into which the values of a finely stepped entry are grouped in the report (default: 10)')
+    command_parsers['validate'].add_argument(
+        '-o',
+        '--output',
+        type=str,
+        default=None,
+        help='CSV file of the result of every point (default: <problem>-validation.csv)')
+    command_parsers['validate'].add_argument(
+        'problem',
+        help='LaTeX source of the problem (or a .py or .pycode file of its code)')
     command_parsers['combine'].add_argument(
         '-i',
         '--input-pdfs',
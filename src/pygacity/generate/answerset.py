@@ -1,9 +1,13 @@
 # Author: Cameron F. Abrams, <cfa22@drexel.edu>
+from __future__ import annotations
+import io
 import yaml
 import os
 from collections import UserList
+import numpy as np
 import pandas as pd
 import logging
+from typing import TextIO
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +18,10 @@ class AnswerSet:
         self.dumpname = f'answers-{serial:08d}.yaml'
         self.D = {}
         self.first_index = None
+        # digest of the states the serial's pycode picked (see Picker.digest), if known
+        self.picks: str = None
+        # number of serials the picks can tell apart (see Picker.variants), if known
+        self.variants: int = None
 
     @classmethod
     def from_yaml(cls, filename, delete=False):
@@ -105,96 +113,88 @@ class AnswerSuperSet(UserList):
             data.append(AnswerSet.from_yaml(f, delete=delete))
         return cls(initial=data)
 
-    def to_latex(self):
-        result = ''
+    def to_latex(self, rows_per_table: int = None):
+        result = io.StringIO()
+        self.write_latex(result, rows_per_table=rows_per_table)
+        return result.getvalue()
+
+    def write_latex(self, f: TextIO, rows_per_table: int = None):
+        """
+        Writes the answer tables to f, one group at a time; if rows_per_table
+        is given, each group's table is written as a sequence of tables of
+        at most that many rows, so that neither this process nor pdflatex
+        ever holds a whole long table
+        """
         for group_name, group_data in self.groups.items():
             df = group_data['df']
             formatters = group_data.get('formatters', None)
-            logger.debug(f'AnswerSuperSet.to_latex group "{group_name}" with formatters: {formatters}')
-            result += df.to_latex(formatters=formatters, index=False, longtable=True)#,header=self.headings)
-        return result
-    
+            logger.debug(f'AnswerSuperSet.write_latex group "{group_name}" with formatters: {formatters}')
+            step = rows_per_table or max(len(df), 1)
+            for start in range(0, max(len(df), 1), step):
+                f.write(df.iloc[start:start + step].to_latex(formatters=formatters, index=False, longtable=True))
+
+    @staticmethod
+    def structure(answers: AnswerSet) -> int:
+        """
+        Returns a hash of the index structure of an answer set: its indices, in
+        order, and the number of answers registered under each
+        """
+        return hash(tuple((index, len(AL)) for index, AL in answers.D.items()))
+
     def _check_congruency(self):
-        if len(self)>0:
-            indices=list(self.data[0].D.keys())
-            for l in self.data[1:]:
-                test_indices=list(l.D.keys())
-                check=all([x==y for x,y in zip(indices,test_indices)])
-                if not check:
-                    return False
-            for i in indices:
-                ilen=len(self.data[0].D[i])
-                for l in self.data[1:]:
-                    test_ilen=len(l.D[i])
-                    check=ilen==test_ilen
-                    if not check:
-                        return False
-        return True
-    
+        return len(set(self.structure(x) for x in self.data)) <= 1
+
     def _make_dfs(self):
-        # to do: groupify
-        serials = [x.serial for x in self.data]
-        # logger.debug(serials)
-        # self.headings = ['serials']
-        # keys = ['serials']
-        values = {'serials': serials}
-        pattern = self.data[0]  # keys in first AnswerSet form the pattern all sets follow
         self.formatters = {}
         self.groups = {}
+        self.schema = pd.DataFrame(columns=['key', 'index', 'label', 'units', 'group', 'formatter'])
+        self.serials = np.array([], dtype=int)
+        self.values = np.empty((0, 0), dtype=object)
+        if len(self.data) == 0:
+            return
+        # the schema -- one column per answer -- comes from the first answer
+        # set; the others have the same structure
+        pattern = self.data[0]
         # keys in D may be prepended with a common prefix; remove it
         common_prefix = os.path.commonprefix([str(x) for x in pattern.D.keys()])
         logger.debug(f'Overall common prefix: "{common_prefix}"')
-        for dataset in self.data:
-            new_dataset_D = {}
-            for index in dataset.D.keys():
-                new_index = str(index)[len(common_prefix):]
-                new_dataset_D[new_index] = dataset.D[index]
-            dataset.D = new_dataset_D
+        keys, indices, labels, units, groups, formatters = [], [], [], [], [], []
         for index, AL in pattern.D.items():
-            index_pref = f'{index}-'
-            if len(serials) == 1:
-                index_pref = ''
+            index_pref = f'{str(index)[len(common_prefix):]}-' if len(self.data) > 1 else ''
             for a in AL:
                 key = f'{index_pref}{a["label"]}'
-                if 'units' in a and a['units']:
+                if a.get('units', None):
                     key += f' ({a["units"]})'
-                group = a.get('group', None)
-                if group:
-                    if group not in self.groups:
-                        self.groups[group] = dict(formatters={}, df=None, values={'serials': serials})
-                    self.groups[group]['values'][key] = []
-                    if 'formatter' in a:
-                        self.groups[group]['formatters'][key] = a['formatter']
-                else:
-                    values[key] = []
-                    if 'formatter' in a:
-                        self.formatters[key] = a['formatter']
-        # logger.debug(values)
-        for inst in self.data:
-            for index, AL in inst.D.items():
-                index_pref = f'{index}-'
-                if len(serials) == 1:
-                    index_pref = ''
-                for a in AL:
-                    key = f'{index_pref}{a["label"]}'
-                    if 'units' in a and a['units']:
-                        key += f' ({a["units"]})'
-                    group = a.get('group', None)
-                    if group:
-                        self.groups[group]['values'][key].append(a['value'])
-                    else:
-                        values[key].append(a['value'])
-        # logger.debug(values)
-        if not self.groups:
-            DF = pd.DataFrame(values)
-            DF.sort_values(by='serials', inplace=True)
-            self.groups['base'] = dict(formatters=self.formatters, df=DF)
+                keys.append(key)
+                indices.append(str(index)[len(common_prefix):])
+                labels.append(a.get('label', None))
+                units.append(a.get('units', None))
+                groups.append(a.get('group', None))
+                formatters.append(a.get('formatter', None))
+        # one row of values per answer set, sorted by serial
+        serials = np.array([x.serial for x in self.data])
+        order = np.argsort(serials, kind='stable')
+        nvalues = len(self.data) * len(keys)
+        try:
+            values = np.fromiter((a['value'] for x in self.data for AL in x.D.values() for a in AL),
+                                 dtype=object, count=nvalues).reshape(len(self.data), len(keys))[order]
+        except ValueError as e:
+            raise ValueError(f'Answer sets do not all have the {len(keys)} answers of serial {pattern.serial}') from e
+        # the columns, and the values of every serial in them, are kept for
+        # consumers other than the tables (e.g., grading)
+        self.schema = pd.DataFrame(dict(key=keys, index=indices, label=labels, units=units,
+                                        group=groups, formatter=formatters))
+        self.serials = serials[order]
+        self.values = values
+        self.formatters = {k: f for k, f, g in zip(keys, formatters, groups) if not g}
+        group_names = [g for g in dict.fromkeys(groups) if g]
+        if not group_names:
+            columns = {'base': np.arange(len(keys))}
         else:
-            for gname, gdata in self.groups.items():
-                logger.debug(f'Building DataFrame for group {gname} with values: {gdata["values"]}')
-                DF = pd.DataFrame(gdata['values'])
-                DF.sort_values(by='serials', inplace=True)
-                self.groups[gname]['df'] = DF
-        # print(self.DF)
-
-
+            columns = {g: np.flatnonzero([x == g for x in groups]) for g in group_names}
+        for gname, cols in columns.items():
+            DF = pd.DataFrame(values[:, cols], columns=[keys[i] for i in cols]).infer_objects()
+            DF.insert(0, 'serials', serials[order])
+            gformatters = {keys[i]: formatters[i] for i in cols}
+            logger.debug(f'Built DataFrame for group {gname} with {len(cols)} column(s)')
+            self.groups[gname] = dict(formatters=gformatters, df=DF)
@@ -0,0 +1,180 @@
+# Author: Cameron F. Abrams, <cfa22@drexel.edu>
+from __future__ import annotations
+import hashlib
+import logging
+import pickle
+import sqlite3
+
+from pathlib import Path
+
+from .answerset import AnswerSet
+
+logger = logging.getLogger(__name__)
+
+class AnswerStore:
+    """
+    An SQLite database of the answers of every serial of a build, indexed by
+    serial and question index.  Any number of processes may add answer sets
+    to the store at the same time; each serial's answers are replaced whole.
+
+    Attributes
+    ----------
+    path: Path
+        the database file (by default, answers.db in the pickle cache)
+
+    timeout: float
+        seconds a writer waits for another to finish before giving up
+    """
+    timeout: float = 60.0
+    # name of the store in a build's pickle cache
+    name: str = 'answers.db'
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=self.timeout)
+        # readers do not block writers (or each other) in write-ahead-log mode
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS answers (
+                                       serial INTEGER NOT NULL,
+                                       ordinal INTEGER NOT NULL,
+                                       idx NOT NULL,
+                                       element INTEGER NOT NULL,
+                                       label, value BLOB, units, formatter, grp,
+                                       PRIMARY KEY (serial, ordinal, element))''')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS answers_idx ON answers (idx, serial)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS picks (serial INTEGER PRIMARY KEY, digest TEXT, variants TEXT)')
+            # stores made before variants were recorded
+            if 'variants' not in [row[1] for row in self.connection.execute('PRAGMA table_info(picks)')]:
+                self.connection.execute('ALTER TABLE picks ADD COLUMN variants TEXT')
+
+    def put(self, answers: AnswerSet):
+        """
+        Stores the answers of one serial, replacing any stored before
+        """
+        rows = []
+        for ordinal, (index, AL) in enumerate(answers.D.items()):
+            for element, a in enumerate(AL):
+                rows.append((answers.serial, ordinal, index, element, a.get('label', None),
+                             pickle.dumps(a.get('value', None), protocol=pickle.HIGHEST_PROTOCOL),
+                             a.get('units', None), a.get('formatter', None), a.get('group', None)))
+        with self.connection:
+            self.connection.execute('DELETE FROM answers WHERE serial = ?', (answers.serial,))
+            self.connection.executemany('INSERT INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            # the number of variants may be too large for an SQLite integer
+            variants = getattr(answers, 'variants', None)
+            self.connection.execute('INSERT OR REPLACE INTO picks (serial, digest, variants) VALUES (?, ?, ?)',
+                                    (answers.serial, getattr(answers, 'picks', None),
+                                     str(variants) if variants is not None else None))
+        logger.debug(f'Stored {len(rows)} answer(s) for serial {answers.serial} in {self.path.as_posix()}')
+
+    def ingest(self, pfile: str | Path) -> int | None:
+        """
+        Stores the AnswerSet pickled in pfile and removes the file; returns
+        its serial
+        """
+        pfile = Path(pfile)
+        with pfile.open('rb') as f:
+            obj = pickle.load(f)
+        if not isinstance(obj, AnswerSet):
+            logger.debug(f'Unrecognized object type {type(obj)} in pickle file {pfile.as_posix()}')
+            return None
+        self.put(obj)
+        pfile.unlink()
+        return obj.serial
+
+    def get(self, serial: int) -> AnswerSet | None:
+        """
+        Returns the answers of one serial, or None if none are stored
+        """
+        R = self.answersets([serial])
+        return R[0] if R else None
+
+    def answersets(self, serials: list[int] = None) -> list[AnswerSet]:
+        """
+        Returns the answer sets of serials (default: all), in order of serial
+        """
+        query = 'SELECT serial, idx, label, value, units, formatter, grp FROM answers'
+        params = []
+        if serials is not None:
+            params = [int(s) for s in serials]
+            query += f' WHERE serial IN ({", ".join("?" * len(params))})'
+        query += ' ORDER BY serial, ordinal, element'
+        result: dict[int, AnswerSet] = {}
+        for serial, index, label, value, units, formatter, group in self.connection.execute(query, params):
+            if serial not in result:
+                result[serial] = AnswerSet(serial)
+            result[serial].register(index, label=label, value=pickle.loads(value),
+                                    units=units, formatter=formatter, group=group)
+        for serial, digest, variants in self.connection.execute('SELECT serial, digest, variants FROM picks'):
+            if serial in result:
+                result[serial].picks = digest
+                result[serial].variants = int(variants) if variants is not None else None
+        return list(result.values())
+
+    def digests(self, serials: list[int] = None) -> dict[int, str]:
+        """
+        Returns a hash of the answers of each of serials (default: all) and
+        of the states their pycode picked; two serials have the same hash
+        only if both are the same
+        """
+        query = 'SELECT serial, idx, label, value, units FROM answers'
+        params = []
+        if serials is not None:
+            params = [int(s) for s in serials]
+            query += f' WHERE serial IN ({", ".join("?" * len(params))})'
+        query += ' ORDER BY serial, ordinal, element'
+        hashes = {}
+        for serial, index, label, value, units in self.connection.execute(query, params):
+            if serial not in hashes:
+                hashes[serial] = hashlib.sha256()
+            hashes[serial].update(repr((index, label, units)).encode())
+            hashes[serial].update(value)
+        for serial, digest in self.connection.execute('SELECT serial, digest FROM picks'):
+            if serial in hashes and digest:
+                hashes[serial].update(digest.encode())
+        return {serial: h.hexdigest() for serial, h in hashes.items()}
+
+    def variants(self, serials: list[int] = None) -> dict[int, int | None]:
+        """
+        Returns the number of variants the picks of each of serials (default:
+        all) allow (see Picker.variants), or None where there is no limit
+        or it is not known
+        """
+        query = 'SELECT serial, variants FROM picks'
+        params = []
+        if serials is not None:
+            params = [int(s) for s in serials]
+            query += f' WHERE serial IN ({", ".join("?" * len(params))})'
+        return {serial: int(v) if v is not None else None for serial, v in self.connection.execute(query, params)}
+
+    def serials(self) -> list[int]:
+        return [row[0] for row in self.connection.execute('SELECT DISTINCT serial FROM answers ORDER BY serial')]
+
+    def remove(self, serials: list[int]):
+        """
+        Removes the answers of the given serials
+        """
+        with self.connection:
+            self.connection.executemany('DELETE FROM answers WHERE serial = ?', [(int(s),) for s in serials])
+            self.connection.executemany('DELETE FROM picks WHERE serial = ?', [(int(s),) for s in serials])
+
+    def retain(self, serials: list[int]):
+        """
+        Removes the answers of any serial not in serials
+        """
+        stale = set(self.serials()) - set(int(s) for s in serials)
+        self.remove(stale)
+        if stale:
+            logger.debug(f'Removed answers of {len(stale)} serial(s) no longer built')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -4,13 +4,18 @@ import logging
 import os
 import re
 
-from copy import deepcopy
+from collections import ChainMap
+from functools import lru_cache
 from importlib.resources import files
 from pathlib import Path
 from shutil import copy2
+from typing import NamedTuple
 
 logger = logging.getLogger(__name__)
 
+# as when sources were scanned a line at a time, a match may not span lines
+GRAPHICS_RE = re.compile(r'\\includegraphics(?:\[[^\]\n]*\])?\{([^\}\n]+)\}')
+
 def path_resolver(filename: str, search_paths: list[Path] = [], ext: str ='') -> Path:
     local_filename = filename if filename.endswith(ext) else filename + ext
     # check local directory first
@@ -27,6 +32,49 @@ def path_resolver(filename: str, search_paths: list[Path] = [], ext: str ='') ->
         raise FileNotFoundError((f'Could not locate source file {local_filename} in cwd ({os.getcwd()}) '
                                  f'or search path {spm}.'))
 
+class ParsedSource(NamedTuple):
+    """
+    What a block needs from its text, which is the same for every block
+    with that text
+    """
+    template: tuple[str, ...]
+    keys: tuple[str, ...]
+    graphics: tuple[str, ...]
+    has_pycode: bool
+
+# contents of source files, by resolved path, with their modification times
+_source_cache: dict[str, tuple[int, str]] = {}
+
+def read_source(path: Path) -> str:
+    """
+    Returns the contents of the file at path, reading it only if it is new or
+    has changed since it was last read by this process
+    """
+    resolved = Path(path).resolve().as_posix()
+    mtime = os.stat(resolved).st_mtime_ns
+    cached = _source_cache.get(resolved, None)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(resolved, 'r') as f:
+        text = f.read()
+    _source_cache[resolved] = (mtime, text)
+    return text
+
+@lru_cache(maxsize=1024)
+def parse_source(text: str, delimiters: tuple[str, str] = ('<<<', '>>>')) -> ParsedSource:
+    """
+    Locates the substitution slots, substitution keys and embedded graphics
+    of a block's text
+    """
+    left, right = [re.escape(x) for x in delimiters]
+    key_re = re.compile(rf'{left}[^\S\n]*([A-Za-z0-9_-]+)[^\S\n]*{right}')
+    # a slot's key holds no space or angle bracket, so a stray left delimiter
+    # earlier on a line does not swallow the text up to the next slot
+    return ParsedSource(template=tuple(re.split(rf'{left}([^<>\s]+?){right}', text)),
+                        keys=tuple(dict.fromkeys(key_re.findall(text))),
+                        graphics=tuple(dict.fromkeys(GRAPHICS_RE.findall(text))),
+                        has_pycode=r'\begin{pycode}' in text)
+
 class LatexCompoundBlock:
     resources_root: Path = files('pygacity') / 'resources'
     templates_dir: Path = resources_root / 'templates'
@@ -54,6 +102,8 @@ class LatexCompoundBlock:
         self.sourcepath = None
         self.config_path = Path(self.config_filename) if self.config_filename else None
         self.processedcontents: str = ''
+        # textcontents split at its substitution slots: text, key, text, key, ..., text
+        self.template: tuple[str, ...] = ('',)
         self.has_pycode: bool = False
         self.embedded_graphics: list[str | Path] = []
 
@@ -74,36 +124,32 @@ class LatexCompoundBlock:
                 raise ValueError('Block cannot specify "pythontex" files along with "text" content or a "source" file.')
 
     def load(self) -> LatexCompoundBlock:
+        # source files are read, and texts parsed, once per process no matter
+        # how many documents use them
         if self.sourcename:
             self.sourcepath = path_resolver(self.sourcename, search_paths=[self.templates_dir])
-            with open(self.sourcepath, 'r') as f:
-                self.textcontents = f.read()
+            self.textcontents = read_source(self.sourcepath)
         elif len(self.pythontex) > 0:
             self.textcontents = r'\begin{pycode}' + '\n'
             for ptfile in self.pythontex:
                 ptpath = path_resolver(ptfile, search_paths=[LatexCompoundBlock.pythontex_dir], ext='.pycode')
-                with open(ptpath, 'r') as f:
-                    self.textcontents += f.read() + '\n\n'
+                self.textcontents += read_source(ptpath) + '\n\n'
             self.textcontents += r'\end{pycode}' + '\n'
-        self.has_pycode = r'\begin{pycode}' in self.textcontents or self.has_pycode
-        # check contents for substitution keys and embedded graphics files
-        KEY_RE = re.compile(rf'{self.substitution_delimiters[0]}\s*([A-Za-z0-9_-]+)\s*{self.substitution_delimiters[1]}')
-        for line in self.textcontents.split('\n'):
-            keys = set(KEY_RE.findall(line))
-            for key in keys:
-                if not key in self.substitution_map:
-                    self.substitution_map[key] = None
-            # check for embedded graphics
-            GRAPHICS_RE = re.compile(r'\\includegraphics(?:\[[^\]]*\])?\{([^\}]+)\}')
-            graphics_files = GRAPHICS_RE.findall(line)
-            for gf in graphics_files:
-                if gf not in self.embedded_graphics:
-                    self.embedded_graphics.append(gf)
-        self.processedcontents = self.textcontents[:]
+        parsed = parse_source(self.textcontents, tuple(self.substitution_delimiters))
+        self.has_pycode = parsed.has_pycode or self.has_pycode
+        for key in parsed.keys:
+            if not key in self.substitution_map:
+                self.substitution_map[key] = None
+        for gf in parsed.graphics:
+            if gf not in self.embedded_graphics:
+                self.embedded_graphics.append(gf)
+        self.processedcontents = self.textcontents
+        self.template = parsed.template
         if self.config_path:
             if not self.config_path.exists():
                 raise FileNotFoundError(f'Configuration file {self.config_path.as_posix()} does not exist.')
-            self.substitution_map['config'] = self.config_path.as_posix()
+            # absolute, since pycode may run in a directory other than the current one
+            self.substitution_map['config'] = self.config_path.resolve().as_posix()
         if self.points:
             self.substitution_map['points'] = self.points
         if self.group:
@@ -119,22 +165,36 @@ class LatexCompoundBlock:
         return self
 
     def substitute(self, super_substitutions: dict = {}, match_all: bool = True):
-        self.processedcontents = self.textcontents[:]
-        substitutions = deepcopy(super_substitutions)
-        logger.debug(f'block at idx {self.idx} incoming substitutions: {substitutions}')
-        logger.debug(f'block at idx {self.idx} own substitution_map: {self.substitution_map}')
-        substitutions.update({k: v for k, v in self.substitution_map.items() if v is not None})
-        logger.debug(f'block at idx {self.idx} substitutions: {substitutions}')
-        # apply substitutions to the contents
-        for key, value in substitutions.items():
-            if value is not None:
-                self.processedcontents = self.processedcontents.replace(f'{self.substitution_delimiters[0]}{key}{self.substitution_delimiters[1]}', str(value))
-            elif match_all:
-                raise KeyError(f'Substitution key {key} has no associated value for text {self.textcontents[:30]}...')
+        """
+        Fills the substitution slots of this block and its children with
+        values from the block's own substitution map or, failing that, from
+        super_substitutions; slots with no value are left as they are
+        """
+        # the block's own values shadow those it inherits; nothing is copied
+        substitutions = ChainMap({k: v for k, v in self.substitution_map.items() if v is not None}, super_substitutions)
+        logger.debug(f'block at idx {self.idx} own substitutions: {substitutions.maps[0]}')
+        if match_all:
+            for key, value in substitutions.items():
+                if value is None:
+                    raise KeyError(f'Substitution key {key} has no associated value for text {self.textcontents[:30]}...')
+        if len(self.template) == 1:
+            self.processedcontents = self.textcontents
+        else:
+            parts = list(self.template)
+            for i in range(1, len(parts), 2):
+                value = substitutions.get(parts[i], None)
+                parts[i] = str(value) if value is not None else f'{self.substitution_delimiters[0]}{parts[i]}{self.substitution_delimiters[1]}'
+            self.processedcontents = ''.join(parts)
         # apply substitutions to children
         for child in self.children:
             child.substitute(super_substitutions=substitutions, match_all=match_all)
 
+    def referenced_configs(self) -> list[Path]:
+        config_paths = [self.config_path] if self.config_path else []
+        for child in self.children:
+            config_paths.extend(child.referenced_configs())
+        return config_paths
+
     def copy_referenced_configs(self, output_dir: str):
         config_paths = []
         if self.config_path and self.config_path.exists():
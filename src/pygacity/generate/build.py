@@ -1,18 +1,28 @@
 # Author: Cameron F. Abrams, <cfa22@drexel.edu>
 from copy import deepcopy
+import asyncio
 import logging
 import os
 import pickle
 import stat
 import random
-from shutil import rmtree
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from shutil import copy2, copytree, rmtree
 from pathlib import Path
 from .answerset import AnswerSet, AnswerSuperSet
+from .answerstore import AnswerStore
+from .buildcache import BuildCache, visible_source
 from .config import Config
 from .document import Document
+from .manifest import BuildManifest
+from .pycode import PycodeExecutor
 from ..util.stringthings import chmod_recursive
 from ..util.collectors import FileCollector
-from ..util.texutils import LatexBuilder
+from ..util.forkserver import DEFAULT_PRELOAD, ForkServer
+from ..util.texformat import PreambleFormat
+from ..util.texlog import LatexLog, pythontex_errors
+from ..util.texutils import LatexBuilder, SharedPythontex
 from pathlib import Path
 from importlib.resources import files
 
@@ -21,6 +31,9 @@ logger = logging.getLogger(__name__)
 logging.getLogger("ycleptic").setLevel(logging.WARNING)
 logging.getLogger("matplotlib").setLevel(logging.WARNING)
 
+# extensions tried, in order, for \includegraphics arguments given without one
+GRAPHICS_EXTENSIONS = ['.pdf', '.png', '.jpg', '.jpeg', '.eps']
+
 def build(args):
     FC = FileCollector()
     if hasattr(args, 'f') and args.f:
@@ -40,37 +53,36 @@ def build(args):
         random.seed(seed)
         logger.info(f'Setting random seed to {seed}.')
 
+    use_cache = getattr(args, 'cache', True)
+    resume = getattr(args, 'resume', False)
     build_path: Path = Path(config.build_specs['paths']['build-dir'])
+    pickle_cache = build_path / config.pickle_cache_name
     if not build_path.exists():
         build_path.mkdir(parents=True, exist_ok=True)
+        resume = False
     else:
-        if args.overwrite:
+        if resume:
+            if not (build_path / BuildManifest.name).exists():
+                raise Exception(f'Build directory "{build_path.as_posix()}" has no unfinished build to resume.')
+            logger.info(f'Resuming the build in {build_path.as_posix()}')
+        elif args.overwrite:
             permissions = stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR
             chmod_recursive(build_path, permissions)
-            rmtree(build_path)
-            build_path.mkdir(parents=True, exist_ok=True)
+            if use_cache and pickle_cache.exists():
+                # keep the build cache; everything else is rebuilt or restored from it
+                clean_build_path(build_path, pickle_cache)
+            else:
+                rmtree(build_path)
+                build_path.mkdir(parents=True, exist_ok=True)
         else:
-            raise Exception(f'Build directory "{build_path.as_posix()}" already exists and "--overwrite" was not specified.')
+            raise Exception(f'Build directory "{build_path.as_posix()}" already exists and neither "--overwrite" nor "--resume" was specified.')
 
-    pickle_cache = build_path / config.pickle_cache_name
     if not pickle_cache.exists():
         pickle_cache.mkdir(parents=True, exist_ok=True)
+    cache = BuildCache(pickle_cache) if use_cache else None
 
-    base_builder = LatexBuilder(config.build_specs, 
-                                 searchdirs = [config.autoprob_package_dir])
     base_doc = Document(config.document_specs)
     logger.debug(f'base_doc has {len(base_doc.blocks)} blocks')
-    if args.solutions:
-        solution_build_specs = deepcopy(config.build_specs)
-        # solution_build_specs['output-name'] = config.build_specs.get('output-name', 'document') + '_soln'
-        solution_build_specs['job-name'] = config.build_specs.get('job-name', 'document') + '_soln'
-        soln_builder = LatexBuilder(solution_build_specs,
-                                    searchdirs = [config.autoprob_package_dir])
-        
-        solution_document_specs = deepcopy(config.document_specs)
-        solution_document_specs['class']['options'].append('solutions')
-        solution_doc = Document(solution_document_specs)
-        logger.debug(f'solution_doc has {len(solution_doc.blocks)} blocks')
 
     if build_path != Path.cwd():
         # find any configs referenced in document blocks and copy them to output_dir
@@ -83,6 +95,154 @@ def build(args):
                 else:
                     FC.append(file_or_files_or_none)
 
+    formats = {}
+    if getattr(args, 'precompile_preamble', True) and config.build_specs.get('precompile-preamble', True):
+        formats = dump_formats(config, args.solutions, pickle_cache / 'formats')
+
+    # the manifest records each serial as it is completed; a resumed build
+    # takes its serials and scratch directory from it and skips the serials
+    # whose products are all still in place
+    manifest = BuildManifest(build_path)
+    signature = BuildManifest.signature(config.document_specs, config.build_specs, args.solutions)
+    completed = {}
+    if resume:
+        if manifest.header.get('signature', None) != signature:
+            raise Exception(f'The build in "{build_path.as_posix()}" was started with a different configuration; use "--overwrite".')
+        serials = manifest.header['serials']
+        scratch_root = Path(manifest.header['scratch'])
+        scratch_root.mkdir(parents=True, exist_ok=True)
+        completed = manifest.completed(build_path)
+        logger.info(f'{len(completed)} of {len(serials)} serial(s) already built')
+    else:
+        serials = resolve_serials(config)
+        # each serial is compiled in its own subdirectory of a scratch directory,
+        # which may be placed on a fast local filesystem (e.g., tmpfs)
+        scratch_parent = getattr(args, 'scratch_dir', None) or config.build_specs['paths'].get('scratch-dir', build_path)
+        Path(scratch_parent).mkdir(parents=True, exist_ok=True)
+        scratch_root = Path(tempfile.mkdtemp(prefix=f'{config.build_specs.get("job-name", "document")}-scratch-', dir=scratch_parent))
+        manifest.start(signature, serials, scratch_root)
+    logger.debug(f'Staging serials in scratch directory {scratch_root.as_posix()}')
+
+    jobs = getattr(args, 'jobs', 1) or 1
+    buildfiles_FC = FileCollector()
+    solnbuildfiles_FC = FileCollector()
+    pycode_executor = getattr(args, 'executor', None) or config.build_specs.get('executor', 'pythontex')
+    forkserver = None
+    if pycode_executor == 'pythontex' and (getattr(args, 'forkserver', False) or config.build_specs.get('forkserver', False)):
+        if ForkServer.available():
+            forkserver = ForkServer(config.build_specs.get('forkserver-preload', DEFAULT_PRELOAD))
+            forkserver.start()
+            logger.info(f'Running pythontex code in a fork server')
+        else:
+            logger.warning(f'A fork server is not available on this platform; running pythontex code as usual')
+    unique = getattr(args, 'unique_picks', False) or config.build_specs.get('unique-picks', False)
+    initargs = (config.document_specs, config.build_specs, [config.autoprob_package_dir], args.solutions,
+                scratch_root, pickle_cache, use_cache, formats,
+                forkserver.interpreter_command() if forkserver else None, pycode_executor,
+                ordinals(serials) if unique else {})
+    results = []
+    for serial in serials:
+        if serial in completed:
+            results.append(completed[serial])
+            _collect_serial_result(results[-1], len(results) - 1, len(serials), build_path, FC, buildfiles_FC, solnbuildfiles_FC)
+        elif (scratch_root / f'{serial}').exists():
+            # left by a build that stopped while this serial was compiled
+            rmtree(scratch_root / f'{serial}')
+    remaining = [serial for serial in serials if serial not in completed]
+    # unless told otherwise, the first serial is built alone, so that an
+    # error common to all serials stops the build before the rest are started
+    canary = len(remaining) > 1 and getattr(args, 'canary', True) and config.build_specs.get('canary', True)
+    try:
+        if canary:
+            _init_worker(*initargs)
+            expects_answers = any(Path(name).stem == 'teardown' for block in base_doc.blocks for name in block.pythontex)
+            results.append(_build_canary(remaining[0], expects_answers))
+            manifest.record(results[-1])
+            _collect_serial_result(results[-1], len(results) - 1, len(serials), build_path, FC, buildfiles_FC, solnbuildfiles_FC)
+            remaining = remaining[1:]
+        if jobs > 1 and len(remaining) > 1:
+            logger.info(f'Building {len(remaining)} serials using {jobs} worker processes')
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=initargs) as executor:
+                futures = {executor.submit(_build_serial, serial): serial for serial in remaining}
+                # serials already submitted are built anyway, so those that
+                # succeed are recorded even if another fails
+                error = None
+                for future in as_completed(futures):
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        logger.error(f'serial # {futures[future]} failed: {e}')
+                        error = error or e
+                        continue
+                    manifest.record(results[-1])
+                    _collect_serial_result(results[-1], len(results) - 1, len(serials), build_path, FC, buildfiles_FC, solnbuildfiles_FC)
+            if error:
+                raise error
+        else:
+            if not canary:
+                _init_worker(*initargs)
+            for serial in remaining:
+                results.append(_build_serial(serial))
+                manifest.record(results[-1])
+                _collect_serial_result(results[-1], len(results) - 1, len(serials), build_path, FC, buildfiles_FC, solnbuildfiles_FC)
+    finally:
+        if forkserver:
+            forkserver.stop()
+
+    if cache:
+        for result in results:
+            for kind, key, names in result['cache_entries']:
+                cache.record(kind, result['serial'], key, names)
+        cache.prune()
+        cache.prune_pythontex([job for result in results for job in result['jobs']])
+        cache.save()
+        ncached = sum(len(result['cached']) for result in results)
+        logger.info(f'Reused {ncached} of {sum(len(result["jobs"]) for result in results)} document(s) from the build cache')
+
+    with AnswerStore(pickle_cache / AnswerStore.name) as store:
+        store.retain(serials)
+        report_duplicates({result['serial']: result['fragments'] for result in results}, store.digests(serials))
+        report_variants(len(serials), store.variants(serials), unique)
+
+    if pickle_cache.exists():
+        # there may be a pickle file for each serial that holds a FileCollector instance
+        commonFC = FileCollector()
+        for pfile in pickle_cache.glob('pythontex*.pkl'):
+            with pfile.open('rb') as f:
+                obj = pickle.load(f)
+            if isinstance(obj, FileCollector):
+                for item in obj.data:
+                    commonFC.append(build_path / item)
+            else:
+                logger.debug(f'Unrecognized object type {type(obj)} in pickle file {pfile.as_posix()}')
+            logger.debug(f'Removing pickle cache file {pfile.as_posix()}')
+            pfile.unlink()
+        
+        archive_path = build_path / 'common_files_from_pickle_cache'
+        common_archive = commonFC.archive(archive_path, delete=True)
+        logger.info(f'Archived common files from pickle cache to {common_archive.absolute().relative_to(Path.cwd()).as_posix()}')
+        logger.debug(f'Retaining pickle cache at {pickle_cache.as_posix()}')
+        for tex_file in answerset(config, fmt=formats.get('base', None), serials=serials,
+                                  jobs=jobs if jobs > 1 else None):
+            FC.append(tex_file)
+
+    for f in FC.data:
+        logger.debug(f'Generated file: {f.absolute().relative_to(Path.cwd()).as_posix()}')
+    tex_archive = FC.archive(build_path / 'tex_artifacts', delete=True)
+    logger.info(f'Archived TeX artifacts to {tex_archive.absolute().relative_to(Path.cwd()).as_posix()}')
+    buildfiles_archive = buildfiles_FC.archive(build_path / 'buildfiles', delete=True)
+    logger.info(f'Archived build files to {buildfiles_archive.absolute().relative_to(Path.cwd()).as_posix()}')
+    if args.solutions:
+        solnbuildfiles_archive = solnbuildfiles_FC.archive(build_path / 'solnbuildfiles', delete=True)
+        logger.info(f'Archived solution build files to {solnbuildfiles_archive.absolute().relative_to(Path.cwd()).as_posix()}')
+    rmtree(scratch_root)
+    logger.debug(f'Removed scratch directory {scratch_root.as_posix()}')
+    manifest.remove()
+
+def resolve_serials(config: Config) -> list[int]:
+    """
+    Returns the list of serial numbers to build, as specified by the build specs
+    """
     if config.build_specs.get('copies', 1) > 1:
         if config.build_specs.get('serials', None):
             # check for explict serials
@@ -110,85 +270,507 @@ def build(args):
             serials = [int(x) for x in config.build_specs['serials']]
         else:
             serials = [0]
+    return serials
 
-    for i, serial in enumerate(serials):
-        outer_substitutions = dict(serial=serial)
-        base_doc.make_substitutions(outer_substitutions)
-        base_builder.build_document(base_doc)
-        FC.append(f'{base_builder.working_job_name}.tex')
-        logger.info(f'serial # {serial} ({i+1}/{len(serials)}) => {build_path.absolute().relative_to(Path.cwd()).as_posix()}/{base_builder.working_job_name}.pdf')
-        if args.solutions:
-            solution_doc.make_substitutions(outer_substitutions)
-            soln_builder.build_document(solution_doc)
-            FC.append(f'{soln_builder.working_job_name}.tex')
-            logger.info(f'serial # {serial} ({i+1}/{len(serials)}) => {build_path.absolute().relative_to(Path.cwd()).as_posix()}/{soln_builder.working_job_name}.pdf')
+def solution_document_specs(document_specs: dict) -> dict:
+    specs = deepcopy(document_specs)
+    specs['class']['options'].append('solutions')
+    return specs
 
-    if pickle_cache.exists():
-        # there may be a pickle file for each serial that holds a FileCollector instance
-        commonFC = FileCollector()
-        for pfile in pickle_cache.glob('pythontex*.pkl'):
-            with pfile.open('rb') as f:
-                obj = pickle.load(f)
-            if isinstance(obj, FileCollector):
-                for item in obj.data:
-                    commonFC.append(build_path / item)
-            else:
-                logger.debug(f'Unrecognized object type {type(obj)} in pickle file {pfile.as_posix()}')
-            logger.debug(f'Removing pickle cache file {pfile.as_posix()}')
+def dump_formats(config: Config, solutions: bool, format_dir: Path) -> dict[str, Path]:
+    """
+    Dumps (or finds already dumped) a precompiled format for the header of
+    each document kind; returns the paths of the formats available, by kind.
+    Formats in format_dir that are no longer used are removed.
+    """
+    kinds = {'base': config.document_specs}
+    if solutions:
+        kinds['soln'] = solution_document_specs(config.document_specs)
+    formats = {}
+    for kind, document_specs in kinds.items():
+        fmt = PreambleFormat(Document(document_specs), format_dir,
+                             pdflatex=config.build_specs['paths']['pdflatex'],
+                             searchdirs=[config.autoprob_package_dir])
+        if fmt.build():
+            formats[kind] = fmt.path
+    PreambleFormat.prune(format_dir, keep=list(formats.values()))
+    return formats
+
+# Per-process build state.  Each worker process (or the main process, for
+# serial builds) owns its own builders and documents, so substitution state
+# and working job names are never shared between concurrently built serials.
+_worker_state: dict = {}
+
+def _init_worker(document_specs: dict, build_specs: dict, searchdirs: list, solutions: bool,
+                 scratch_root: Path, pickle_cache: Path, use_cache: bool = True, formats: dict = {},
+                 interpreter: str = None, pycode_executor: str = 'pythontex', ordinals: dict = {}):
+    _worker_state.clear()
+    _worker_state['ordinals'] = ordinals
+    _worker_state['build_path'] = Path(build_specs['paths']['build-dir'])
+    _worker_state['scratch_root'] = Path(scratch_root)
+    _worker_state['pickle_cache'] = Path(pickle_cache)
+    _worker_state['cache'] = BuildCache(pickle_cache) if use_cache else None
+    _worker_state['answer_store'] = AnswerStore(Path(pickle_cache) / AnswerStore.name)
+    # class files are not part of the rendered source but do affect the output
+    _worker_state['class_files'] = [f for d in searchdirs for f in Path(d).glob('*.cls')]
+    _worker_state['base_builder'] = LatexBuilder(build_specs, searchdirs=searchdirs)
+    _worker_state['base_builder'].format = formats.get('base', None)
+    _worker_state['base_builder'].interpreter = interpreter
+    if pycode_executor == 'pygacity':
+        _worker_state['base_builder'].executor = PycodeExecutor()
+    _worker_state['base_doc'] = Document(document_specs)
+    _worker_state['kinds'] = ['base']
+    _worker_state['concurrent_commands'] = build_specs.get('concurrent-commands', 2)
+    _worker_state['share_pythontex'] = build_specs.get('share-pythontex', True)
+    if solutions:
+        solution_build_specs = deepcopy(build_specs)
+        solution_build_specs['job-name'] = build_specs.get('job-name', 'document') + '_soln'
+        _worker_state['soln_builder'] = LatexBuilder(solution_build_specs, searchdirs=searchdirs)
+        _worker_state['soln_builder'].format = formats.get('soln', None)
+        _worker_state['soln_builder'].interpreter = interpreter
+        if pycode_executor == 'pygacity':
+            _worker_state['soln_builder'].executor = PycodeExecutor()
+        _worker_state['soln_doc'] = Document(solution_document_specs(document_specs))
+        _worker_state['kinds'].append('soln')
+
+def _build_serial(serial: int) -> dict:
+    """
+    Builds the base (and, if requested, solution) document for one serial
+    using the calling process's builders, or restores them from the build
+    cache if their inputs are unchanged; returns the names of the files
+    generated so the caller can collect them.  The document kinds are
+    compiled concurrently, with at most ``concurrent-commands`` (build spec;
+    default 2) commands running at once, and share one pythontex run where
+    their pythontex code is the same (unless ``share-pythontex`` is False).
+    """
+    return asyncio.run(_build_serial_async(serial))
+
+def _build_canary(serial: int, expects_answers: bool) -> dict:
+    """
+    Builds one serial with the calling process's builders and checks that
+    every document compiled without errors and, if expects_answers, that its
+    answers were stored; raises an Exception with the first error found and
+    its location.  The serial's scratch directory is left for inspection.
+    """
+    logger.info(f'Building serial # {serial} alone to check for errors')
+    try:
+        result = _build_serial(serial)
+    except Exception as e:
+        problem = canary_problem(serial, None, expects_answers) or str(e)
+        raise Exception(f'Build of serial # {serial} failed: {problem}') from e
+    problem = canary_problem(serial, result, expects_answers)
+    if problem:
+        raise Exception(f'Build of serial # {serial} failed: {problem}')
+    return result
+
+def canary_problem(serial: int, result: dict | None, expects_answers: bool) -> str:
+    """
+    Returns the first error in the pdflatex logs and pythontex output of the
+    documents of serial just built in this process, or a description of a
+    missing product; empty if there is none.  result is None if the build
+    raised.
+    """
+    for kind in _worker_state['kinds']:
+        builder: LatexBuilder = _worker_state[f'{kind}_builder']
+        doc: Document = _worker_state[f'{kind}_doc']
+        job_name = builder.working_job_name_for(serial)
+        if result and job_name in result['cached']:
+            continue
+        working_dir: Path = _worker_state['scratch_root'] / f'{serial}' / kind
+        log = LatexLog(working_dir / f'{job_name}.log')
+        if log.errors:
+            f, lineno, _ = log.errors[0]
+            where = ''
+            if Path(f).name == f'{job_name}.tex' and not builder.executor:
+                block = doc.block_at(lineno, precompiled=builder.format is not None)
+                if block is not None:
+                    where = f' in top-level block {doc.blocks.index(block) + 1}'
+                    if block.sourcename:
+                        where += f' ({block.sourcename})'
+            return f'{log.first_error()}{where} (see {working_dir.as_posix()})'
+        errors = pythontex_errors(builder.pythontex_output)
+        if errors:
+            return f'pythontex: {job_name}.tex {errors[0]} (see {working_dir.as_posix()})'
+        if result is None and builder.pythontex_output.strip():
+            return f'pythontex: {builder.pythontex_output.strip().splitlines()[-1]} (see {working_dir.as_posix()})'
+        if log.fatal:
+            return f'pdflatex stopped without output; see {log.path.as_posix()}'
+        if result and not (_worker_state['build_path'] / f'{job_name}.pdf').exists():
+            return f'{job_name}.pdf was not produced (see {working_dir.as_posix()})'
+    if result and expects_answers and _worker_state['answer_store'].get(serial) is None:
+        return f'its pycode did not pickle any answers (see {(_worker_state["scratch_root"] / f"{serial}").as_posix()})'
+    return ''
+
+async def _build_serial_async(serial: int) -> dict:
+    result = dict(serial=serial, tex=[], jobs=[], cached=[], cache_entries=[], buildfiles=[], solnbuildfiles=[],
+                  fragments=[])
+    semaphore = asyncio.Semaphore(_worker_state['concurrent_commands'])
+    shared_pythontex = SharedPythontex() if _worker_state['share_pythontex'] else None
+    # each kind reports into its own dict; they are merged in a fixed order
+    # regardless of which kind finished first
+    kind_results = [dict(tex=[], jobs=[], cached=[], cache_entries=[], buildfiles=[], solnbuildfiles=[], fragments=[])
+                    for kind in _worker_state['kinds']]
+    # a failing kind does not cancel the other, which may be starting a
+    # process (asyncio cannot always cancel that cleanly); the first error
+    # is raised once both are done
+    outcomes = await asyncio.gather(*[_build_kind(kind, serial, kind_result, semaphore, shared_pythontex)
+                                      for kind, kind_result in zip(_worker_state['kinds'], kind_results)],
+                                    return_exceptions=True)
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            raise outcome
+    for kind_result in kind_results:
+        for k, v in kind_result.items():
+            result[k].extend(v)
+    # both kinds pickle the same answers; they are stored once both are done,
+    # and a serial that no longer pickles any keeps none from an earlier build
+    pfile = _worker_state['pickle_cache'] / f'answers-{serial}.pkl'
+    if pfile.exists():
+        _worker_state['answer_store'].ingest(pfile)
+    else:
+        _worker_state['answer_store'].remove([serial])
+    return result
+
+async def _build_kind(kind: str, serial: int, result: dict, semaphore: asyncio.Semaphore,
+                      shared_pythontex: SharedPythontex = None):
+    build_path: Path = _worker_state['build_path']
+    pickle_cache: Path = _worker_state['pickle_cache']
+    cache: BuildCache = _worker_state['cache']
+    builder: LatexBuilder = _worker_state[f'{kind}_builder']
+    doc: Document = _worker_state[f'{kind}_doc']
+    outer_substitutions = dict(serial=serial, pickle_cache=pickle_cache.resolve().as_posix(),
+                               ordinal=_worker_state['ordinals'].get(serial, 'None'))
+    # each kind has its own directory, since both run the same pycode and
+    # write the same relative files
+    working_dir: Path = _worker_state['scratch_root'] / f'{serial}' / kind
+    stage_graphics(doc, working_dir)
+    if kind == 'base':
+        # with the per-serial values left in their slots, blocks whose text
+        # does not otherwise depend on the serial hash alike in every serial
+        doc.make_substitutions({k: f'<<<{k}>>>' for k in outer_substitutions})
+        result['fragments'] = doc.fragment_hashes()
+    doc.make_substitutions(outer_substitutions)
+    job_name = builder.working_job_name_for(serial)
+    result['jobs'].append(job_name)
+    result['tex'].append(str(working_dir / f'{job_name}.tex'))
+    # products of this document kind and serial, by their names in a cache entry
+    products = {'document.pdf': build_path / f'{job_name}.pdf',
+                'answers.pkl': pickle_cache / f'answers-{serial}.pkl',
+                'pythontex.pkl': pickle_cache / f'pythontex-{serial}.pkl'}
+    key = None
+    if cache:
+        key = BuildCache.key(visible_source(doc.source(), showsolutions=(kind == 'soln')),
+                             doc.referenced_files() + _worker_state['class_files'])
+        entry_dir = cache.lookup(kind, serial, key)
+        if entry_dir:
+            BuildCache.restore(entry_dir, products | {'files': build_path})
+            working_dir.mkdir(parents=True, exist_ok=True)
+            doc.write_source(local_output_name=(working_dir / job_name).as_posix())
+            result['cached'].append(job_name)
+            logger.debug(f'Restored {job_name} from build cache entry {key}')
+            return
+    if cache and doc.has_pycode and not builder.executor and cache.restore_pythontex(job_name, working_dir, pickle_cache):
+        # pythontex only re-executes sessions whose code has changed; the
+        # files and pickles their code wrote last time stand in for the rest
+        logger.debug(f'Restored pythontex output of {job_name} from the build cache')
+    await builder.build_document_async(doc, working_dir=working_dir, semaphore=semaphore,
+                                       shared_pythontex=shared_pythontex)
+    result['buildfiles' if kind == 'base' else 'solnbuildfiles'] = [str(f) for f in builder.FC.data]
+    builder.FC.clear()
+    registered = retrieve_pythontex_files(products['pythontex.pkl'], working_dir, build_path)
+    if cache:
+        if doc.has_pycode and not builder.executor:
+            cache.save_pythontex(job_name, working_dir, registered,
+                                 [products['answers.pkl'], products['pythontex.pkl']])
+        products.update({f'files/{item}': build_path / item for item in registered})
+        cache.store(key, products)
+        result['cache_entries'].append((kind, key, [name for name, path in products.items() if path.exists()]))
+
+def ordinals(serials: list[int]) -> dict[int, int]:
+    """
+    Returns the position of each serial among serials, which, with unique
+    picks, chooses the variant of the values its pycode picks (see Picker)
+    """
+    return {serial: i for i, serial in enumerate(serials)}
+
+def report_variants(copies: int, variants: dict[int, int | None], unique: bool = False) -> int | None:
+    """
+    Warns if more serials are built than the picks of their pycode allow
+    variants of (see Picker.variants), so that some serials must pick the
+    same values as others; without unique picks, also says when serials
+    are likely to pick alike by chance.  Returns the number of variants, or
+    None if it is unlimited or unknown
+    """
+    known = [v for v in variants.values() if v is not None]
+    if not known:
+        return None
+    n = min(known)
+    if copies > n:
+        logger.warning(f'The pycode picks allow only {n} variant(s) for {copies} serials; '
+                       f'at least {copies - n} serial(s) repeat the picks of another')
+    elif not unique and copies > 1:
+        pairs = copies * (copies - 1) / (2 * n)
+        if pairs >= 0.5:
+            logger.info(f'The pycode picks allow {n} variants for {copies} serials; about {pairs:.1f} pair(s) of serials '
+                        f'are expected to pick alike (unique picks give each serial its own variant)')
+    return n
+
+def report_duplicates(fragments: dict[int, list[str]], answer_digests: dict[int, str] = {}) -> list[list[int]]:
+    """
+    Logs how many distinct texts each top-level block has across serials,
+    given the fragment hashes of each serial's base document, and warns of
+    serials that duplicate one another: their text is the same apart from
+    the serial itself, and their pycode picked the same states and
+    registered the same answers.
+    Returns the groups of duplicate serials.
+    """
+    if len(fragments) < 2:
+        return []
+    nblocks = max(len(f) for f in fragments.values())
+    varying = []
+    for i in range(nblocks):
+        distinct = len(set(f[i] for f in fragments.values() if i < len(f)))
+        if distinct > 1:
+            varying.append(f'{i+1} ({distinct})')
+    logger.info(f'{nblocks - len(varying)} of {nblocks} top-level block(s) have the same text in all {len(fragments)} serials')
+    if varying:
+        logger.debug(f'Top-level blocks whose text varies (number of distinct texts): {", ".join(varying)}')
+    groups: dict[tuple, list[int]] = {}
+    for serial, hashes in fragments.items():
+        groups.setdefault((tuple(hashes), answer_digests.get(serial, None)), []).append(serial)
+    duplicates = [sorted(g) for g in groups.values() if len(g) > 1]
+    for g in duplicates:
+        logger.warning(f'Serials {", ".join(str(s) for s in g)} have the same text, picks and answers')
+    return duplicates
+
+def stage_graphics(document: Document, working_dir: Path):
+    """
+    Copies graphics files embedded in the document's source into working_dir,
+    keeping their relative paths, so that they are found when the document is
+    compiled there
+    """
+    for gf in document.embedded_graphics:
+        gpath = Path(gf)
+        if gpath.is_absolute() or '..' in gpath.parts:
+            # TeX still finds these through TEXINPUTS
+            continue
+        for candidate in [gpath] + [gpath.with_name(gpath.name + ext) for ext in GRAPHICS_EXTENSIONS]:
+            if candidate.is_file():
+                dest = working_dir / candidate
+                if not dest.exists():
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+                    copy2(candidate, dest)
+                    logger.debug(f'Staged graphics file {candidate.as_posix()} in {working_dir.as_posix()}')
+                break
+
+def retrieve_pythontex_files(pfile: Path, working_dir: Path, build_path: Path):
+    """
+    Copies the files registered by a serial's pycode in its pickled
+    FileCollector out of working_dir and into the build directory; returns
+    the registered (relative) paths
+    """
+    registered = []
+    if not pfile.exists():
+        return registered
+    with pfile.open('rb') as f:
+        obj = pickle.load(f)
+    if not isinstance(obj, FileCollector):
+        return registered
+    for item in obj.data:
+        registered.append(item)
+        src = working_dir / item
+        dest = build_path / item
+        if src.is_dir():
+            copytree(src, dest, dirs_exist_ok=True)
+        elif src.is_file():
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            copy2(src, dest)
+        else:
+            logger.debug(f'File {src.as_posix()} registered by pycode was not found')
+    return registered
+
+def _collect_serial_result(result: dict, i: int, nserials: int, build_path: Path,
+                           FC: FileCollector, buildfiles_FC: FileCollector, solnbuildfiles_FC: FileCollector):
+    for f in result['tex']:
+        FC.append(f)
+    for f in result['buildfiles']:
+        buildfiles_FC.append(f)
+    for f in result['solnbuildfiles']:
+        solnbuildfiles_FC.append(f)
+    for job in result['jobs']:
+        cached = ' (cached)' if job in result['cached'] else ''
+        logger.info(f'serial # {result["serial"]} ({i+1}/{nserials}) => {build_path.absolute().relative_to(Path.cwd()).as_posix()}/{job}.pdf{cached}')
+
+def clean_build_path(build_path: Path, pickle_cache: Path):
+    """
+    Empties build_path except for the persistent part of the pickle cache;
+    per-build pickles are removed so stale serials cannot leak into the answer set
+    """
+    for p in build_path.iterdir():
+        if p.resolve() == pickle_cache.resolve():
+            continue
+        if p.is_dir():
+            rmtree(p)
+        else:
+            p.unlink()
+    for pattern in ['answers*.pkl', 'pythontex*.pkl']:
+        for pfile in pickle_cache.glob(pattern):
             pfile.unlink()
-        
-        archive_path = build_path / 'common_files_from_pickle_cache'
-        common_archive = commonFC.archive(archive_path, delete=True)
-        logger.info(f'Archived common files from pickle cache to {common_archive.absolute().relative_to(Path.cwd()).as_posix()}')
-        logger.debug(f'Retaining pickle cache at {pickle_cache.as_posix()}')
-        FC.append(answerset(config))
 
-    for f in FC.data:
-        logger.debug(f'Generated file: {f.absolute().relative_to(Path.cwd()).as_posix()}')
-    tex_archive = FC.archive(build_path / 'tex_artifacts', delete=True)
-    logger.info(f'Archived TeX artifacts to {tex_archive.absolute().relative_to(Path.cwd()).as_posix()}')
-    buildfiles_archive = base_builder.FC.archive(build_path / 'buildfiles', delete=True)
-    logger.info(f'Archived build files to {buildfiles_archive.absolute().relative_to(Path.cwd()).as_posix()}')
-    if args.solutions:
-        solnbuildfiles_archive = soln_builder.FC.archive(build_path / 'solnbuildfiles', delete=True)
-        logger.info(f'Archived solution build files to {solnbuildfiles_archive.absolute().relative_to(Path.cwd()).as_posix()}')
+def answerset(config: Config = None, fmt: Path = None, serials: list[int] = None,
+              serials_per_document: int = None, jobs: int = None) -> list[Path]:
+    """
+    Builds the answer set document from the answers of serials (default: all
+    serials) in the answer store; returns the paths of the sources written.
 
-def answerset(config: Config = None) -> str:
+    The answer tables are written to their own source, read by the document
+    with ``\\input``, in tables of at most ``answer-rows-per-table`` (build
+    spec; default 40) rows.  If serials_per_document (or the build spec
+    ``answer-serials-per-document``) is given, the answer set is divided
+    into documents of that many serials each, which are compiled
+    concurrently by up to jobs (default: ``concurrent-commands``) commands.
+    """
     build_path: Path = Path(config.build_specs['paths']['build-dir'])
     pickle_cache = build_path / config.pickle_cache_name
     if not pickle_cache.exists():
         raise Exception(f'No cache found -- cannot build answer set')
-    AnswerSets: list[AnswerSet] = []
-    for pfile in pickle_cache.glob('answer*.pkl'):
-        with pfile.open('rb') as f:
-            obj = pickle.load(f)
-        AnswerSets.append(obj)
-    AS = AnswerSuperSet(initial=AnswerSets)
-
-    answer_buildspecs = {'job-name': config.build_specs.get('answer-name', 'answerset'),
-                         'paths': config.build_specs['paths']}
-    AnswerSetBuilder = LatexBuilder(answer_buildspecs,
-                                    searchdirs = [config.autoprob_package_dir])
-    
-    answer_docspecs = deepcopy(config.document_specs) 
-    answer_docspecs['structure'] = [] 
-    answer_docspecs['structure'].append(deepcopy(config.document_specs['structure'][0]))
-    answer_docspecs['structure'].append({'text': AS.to_latex()})
-    answer_docspecs['structure'].append(deepcopy(config.document_specs['structure'][-1]))
-    AnswerSetDoc = Document(answer_docspecs)
-    AnswerSetDoc.make_substitutions(dict(serial='Answer Set'))
-    AnswerSetBuilder.build_document(AnswerSetDoc)
-    logger.info(f'Combined answer set => {build_path.absolute().relative_to(Path.cwd()).as_posix()}/{AnswerSetBuilder.working_job_name}.pdf')
-    answerset_archive = AnswerSetBuilder.FC.archive(build_path / 'answerset_buildfiles', delete=True)
+    with AnswerStore(pickle_cache / AnswerStore.name) as store:
+        # answers pickled by builds made before there was a store
+        for pfile in pickle_cache.glob('answers-*.pkl'):
+            store.ingest(pfile)
+        AnswerSets: list[AnswerSet] = store.answersets(serials)
+    if not AnswerSets:
+        raise Exception(f'No answers found in {pickle_cache.as_posix()} -- cannot build answer set')
+
+    per_document = serials_per_document or config.build_specs.get('answer-serials-per-document', None) or len(AnswerSets)
+    parts = [AnswerSets[i:i + per_document] for i in range(0, len(AnswerSets), per_document)]
+    answer_name = config.build_specs.get('answer-name', 'answerset')
+    rows_per_table = config.build_specs.get('answer-rows-per-table', 40)
+    builders: list[LatexBuilder] = []
+    documents: list[Document] = []
+    for k, part in enumerate(parts):
+        job_name = answer_name if len(parts) == 1 else f'{answer_name}-{k+1}'
+        answer_buildspecs = {'job-name': job_name,
+                             'paths': config.build_specs['paths'],
+                             'command-timeout': config.build_specs.get('command-timeout', None)}
+        AnswerSetBuilder = LatexBuilder(answer_buildspecs,
+                                        searchdirs = [config.autoprob_package_dir])
+        # the answer set document has the same header as the base documents
+        AnswerSetBuilder.format = fmt
+        table = build_path / f'{job_name}-table.tex'
+        with table.open('w') as f:
+            AnswerSuperSet(initial=part).write_latex(f, rows_per_table=rows_per_table)
+        AnswerSetBuilder.FC.append(table)
+
+        answer_docspecs = deepcopy(config.document_specs) 
+        answer_docspecs['structure'] = [] 
+        answer_docspecs['structure'].append(deepcopy(config.document_specs['structure'][0]))
+        answer_docspecs['structure'].append({'text': f'\\input{{{table.name}}}'})
+        answer_docspecs['structure'].append(deepcopy(config.document_specs['structure'][-1]))
+        AnswerSetDoc = Document(answer_docspecs)
+        AnswerSetDoc.make_substitutions(dict(serial='Answer Set' if len(parts) == 1 else f'Answer Set {k+1}/{len(parts)}'))
+        builders.append(AnswerSetBuilder)
+        documents.append(AnswerSetDoc)
+
+    async def build_documents():
+        semaphore = asyncio.Semaphore(jobs or config.build_specs.get('concurrent-commands', 2))
+        await asyncio.gather(*[builder.build_document_async(doc, semaphore=semaphore)
+                               for builder, doc in zip(builders, documents)])
+    asyncio.run(build_documents())
+
+    answer_FC = FileCollector()
+    for AnswerSetBuilder, part in zip(builders, parts):
+        logger.info(f'{"Combined answer set" if len(parts) == 1 else f"Answer set for serials {part[0].serial}-{part[-1].serial}"} '
+                    f'=> {build_path.absolute().relative_to(Path.cwd()).as_posix()}/{AnswerSetBuilder.working_job_name}.pdf')
+        for item in AnswerSetBuilder.FC.data:
+            answer_FC.append(item)
+    answerset_archive = answer_FC.archive(build_path / 'answerset_buildfiles', delete=True)
     logger.info(f'Archived answer set build files to {answerset_archive.absolute().relative_to(Path.cwd()).as_posix()}')
-    return Path.cwd() / f'{AnswerSetBuilder.working_job_name}.tex'
+    return [AnswerSetBuilder.working_dir / f'{AnswerSetBuilder.working_job_name}.tex' for AnswerSetBuilder in builders]
+
+def answers(args):
+    """
+    Generates the answer set of a multidocument without typesetting any of
+    its documents: only the pycode of each serial's document is run, in
+    parallel across serials, and the answers it pickles are combined into
+    the answer set document
+    """
+    logger.info(f'Generating answers for document(s) specified in {args.f}...')
+    config = Config(args.f)
+    seed = config.build_specs.get('seed', None)
+    if seed is not None:
+        random.seed(seed)
+        logger.info(f'Setting random seed to {seed}.')
+    build_path: Path = Path(config.build_specs['paths']['build-dir'])
+    pickle_cache = build_path / config.pickle_cache_name
+    pickle_cache.mkdir(parents=True, exist_ok=True)
+    # answers pickled by an earlier, unfinished build must not be stored
+    for pattern in ['answers*.pkl', 'pythontex*.pkl']:
+        for pfile in pickle_cache.glob(pattern):
+            pfile.unlink()
+    serials = resolve_serials(config)
+    unique = getattr(args, 'unique_picks', False) or config.build_specs.get('unique-picks', False)
+    positions = ordinals(serials) if unique else {}
+    scratch_root = Path(tempfile.mkdtemp(prefix=f'{config.build_specs.get("job-name", "document")}-answers-', dir=build_path))
+    jobs = getattr(args, 'jobs', 1) or 1
+    try:
+        if jobs > 1 and len(serials) > 1:
+            logger.info(f'Running pycode of {len(serials)} serials using {jobs} worker processes')
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = {executor.submit(_answers_serial, config.document_specs, serial, scratch_root, pickle_cache,
+                                           positions.get(serial, 'None')): serial
+                           for serial in serials}
+                for i, future in enumerate(as_completed(futures)):
+                    future.result()
+                    logger.info(f'serial # {futures[future]} ({i+1}/{len(serials)}) answers generated')
+        else:
+            for i, serial in enumerate(serials):
+                _answers_serial(config.document_specs, serial, scratch_root, pickle_cache, positions.get(serial, 'None'))
+                logger.info(f'serial # {serial} ({i+1}/{len(serials)}) answers generated')
+    finally:
+        rmtree(scratch_root)
+    # files registered by pycode are only wanted with the documents
+    for pfile in pickle_cache.glob('pythontex*.pkl'):
+        pfile.unlink()
+    with AnswerStore(pickle_cache / AnswerStore.name) as store:
+        store.retain(serials)
+        report_variants(len(serials), store.variants(serials), unique)
+    for tex_file in answerset(config, serials=serials, serials_per_document=getattr(args, 'serials_per_document', None),
+                              jobs=jobs if jobs > 1 else None):
+        os.remove(tex_file)
+
+def _answers_serial(document_specs: dict, serial: int, scratch_root: Path, pickle_cache: Path, ordinal='None'):
+    """
+    Runs the pycode in the document for one serial, which pickles the
+    serial's AnswerSet into pickle_cache, and adds the answers to the answer
+    store there
+    """
+    doc = Document(document_specs)
+    doc.make_substitutions(dict(serial=serial, pickle_cache=pickle_cache.resolve().as_posix(), ordinal=ordinal))
+    source = doc.source()
+    if not PycodeExecutor.supports(source):
+        logger.warning(f'Document for serial {serial} uses pythontex commands other than pycode, \\py and \\pyc; '
+                       f'only those are run')
+    working_dir = Path(scratch_root) / f'{serial}'
+    working_dir.mkdir(parents=True, exist_ok=True)
+    PycodeExecutor().execute(source, working_dir)
+    pfile = pickle_cache / f'answers-{serial}.pkl'
+    with AnswerStore(pickle_cache / AnswerStore.name) as store:
+        if not pfile.exists():
+            logger.warning(f'The pycode for serial {serial} did not pickle an answer set')
+            store.remove([serial])
+            return
+        store.ingest(pfile)
 
 def answerset_subcommand(args):
     logger.info(f'Generating answer set document from previous build specified in {args.f}...')
     config = Config(args.f)
-    tex_file = answerset(config)
-    # remove the tex source
-    os.remove(tex_file)
+    tex_files = answerset(config, serials=getattr(args, 'serials', None),
+                          serials_per_document=getattr(args, 'serials_per_document', None),
+                          jobs=getattr(args, 'jobs', None))
+    # remove the tex sources
+    for tex_file in tex_files:
+        os.remove(tex_file)
 
 def config_singlet(args):
     """
@@ -0,0 +1,253 @@
+# Author: Cameron F. Abrams, <cfa22@drexel.edu>
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import re
+
+from pathlib import Path
+from shutil import copy2, copytree, rmtree
+
+from ..util.stringthings import __pygacity_version__
+
+logger = logging.getLogger(__name__)
+
+# conditionals are tracked so that the branch of \ifshowsolutions a document
+# does not typeset can be left out of its cache key; pycode is never altered
+_PYCODE_RE = re.compile(r'(\\begin\{pycode\}.*?\\end\{pycode\})', re.DOTALL)
+_CONDITIONAL_RE = re.compile(r'(\\newif)?\\(if[A-Za-z]*|else|fi)(?![A-Za-z])')
+# control words beginning with "if" that are not TeX conditionals
+_NOT_CONDITIONALS = {'iff', 'ifthen', 'ifthenelse', 'ifstrequal', 'ifstrempty', 'ifboolexpr', 'ifbool', 'iftoggle'}
+
+def visible_source(source: str, showsolutions: bool) -> str:
+    """
+    Returns source without the branches of \\ifshowsolutions that are not
+    typeset when showsolutions has the given value.  If the conditionals
+    outside pycode cannot be matched up, source is returned unchanged.
+    """
+    segments = _PYCODE_RE.split(source)
+    result = ''
+    for i, segment in enumerate(segments):
+        if i % 2 == 1:
+            result += segment
+            continue
+        stripped = _strip_hidden_branches(segment, showsolutions)
+        if stripped is None:
+            logger.debug('visible_source: unbalanced conditionals; using full source')
+            return source
+        result += stripped
+    return result
+
+def _strip_hidden_branches(text: str, showsolutions: bool) -> str | None:
+    stack = []  # [is \ifshowsolutions, in its true branch] for each open conditional
+    def visible():
+        return all(not is_sol or (in_true == showsolutions) for is_sol, in_true in stack)
+    result = ''
+    pos = 0
+    for m in _CONDITIONAL_RE.finditer(text):
+        if visible():
+            result += text[pos:m.start()]
+        pos = m.end()
+        name = m.group(2)
+        if m.group(1) or name in _NOT_CONDITIONALS:
+            if visible():
+                result += m.group(0)
+            continue
+        if name == 'else':
+            if not stack:
+                return None
+            stack[-1][1] = False
+            is_sol = stack[-1][0]
+        elif name == 'fi':
+            if not stack:
+                return None
+            is_sol = stack.pop()[0]
+        else:
+            is_sol = name == 'ifshowsolutions'
+            if not is_sol and visible():
+                result += m.group(0)
+            stack.append([is_sol, True])
+            continue
+        if not is_sol and visible():
+            result += m.group(0)
+    if stack:
+        return None
+    result += text[pos:]
+    return result
+
+class BuildCache:
+    """
+    A content-addressed store of build products.  Each entry holds the files a
+    single document kind (base or solution) produced for a single serial, and
+    lives in a directory named by the hash of everything that went into
+    building it.  The manifest records which hash each (kind, serial) pair was
+    last built from.
+    """
+    manifest_name: str = 'manifest.json'
+    objects_name: str = 'objects'
+    pythontex_name: str = 'pythontex'
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self.objects = self.root / self.objects_name
+        self.manifest_path = self.root / self.manifest_name
+        self.pythontex = self.root / self.pythontex_name
+        self.manifest: dict = {}
+        if self.manifest_path.exists():
+            with open(self.manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+        logger.debug(f'BuildCache at {self.root.as_posix()} with {len(self.manifest)} manifest entries')
+
+    @staticmethod
+    def entry_name(kind: str, serial: int) -> str:
+        return f'{kind}-{serial}'
+
+    @staticmethod
+    def key(source: str, files: list[str | Path] = []) -> str:
+        """
+        Returns the hash of the rendered source, the contents of any files it
+        depends on, and the pygacity version
+        """
+        h = hashlib.sha256()
+        h.update(__pygacity_version__.encode())
+        h.update(source.encode())
+        for f in sorted(set(Path(x) for x in files)):
+            h.update(f.as_posix().encode())
+            if f.is_file():
+                h.update(f.read_bytes())
+        return h.hexdigest()
+
+    def lookup(self, kind: str, serial: int, key: str) -> Path | None:
+        """
+        Returns the directory of the cached products of (kind, serial) if they
+        were built from inputs hashing to key, otherwise None
+        """
+        entry = self.manifest.get(self.entry_name(kind, serial), None)
+        if entry and entry['key'] == key and (self.objects / key).is_dir():
+            return self.objects / key
+        return None
+
+    def store(self, key: str, files: dict[str, Path]) -> Path:
+        """
+        Copies files (a mapping of names within the entry to source paths) into
+        the entry for key; returns the entry directory
+        """
+        entry_dir = self.objects / key
+        if entry_dir.is_dir():
+            return entry_dir
+        # assemble under a temporary name so a half-written entry is never visible
+        tmp_dir = self.objects / f'.{key}-{os.getpid()}'
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        for name, src in files.items():
+            src = Path(src)
+            dest = tmp_dir / name
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            if src.is_dir():
+                copytree(src, dest, dirs_exist_ok=True)
+            elif src.is_file():
+                copy2(src, dest)
+        try:
+            tmp_dir.rename(entry_dir)
+        except OSError:
+            # another process stored the same entry first
+            rmtree(tmp_dir)
+        return entry_dir
+
+    @staticmethod
+    def restore(entry_dir: Path, destinations: dict[str, Path]) -> list[Path]:
+        """
+        Copies the named files of a cache entry to their destinations; returns
+        the destinations that were restored
+        """
+        restored = []
+        for name, dest in destinations.items():
+            src = entry_dir / name
+            dest = Path(dest)
+            if src.is_dir():
+                copytree(src, dest, dirs_exist_ok=True)
+            elif src.is_file():
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                copy2(src, dest)
+            else:
+                continue
+            restored.append(dest)
+        return restored
+
+    def record(self, kind: str, serial: int, key: str, names: list[str]):
+        self.manifest[self.entry_name(kind, serial)] = dict(key=key, files=names)
+
+    def save(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.manifest_path, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+
+    def prune(self):
+        """
+        Removes entries no longer referenced by the manifest
+        """
+        live = set(entry['key'] for entry in self.manifest.values())
+        if not self.objects.is_dir():
+            return
+        for entry_dir in self.objects.iterdir():
+            if entry_dir.name not in live:
+                rmtree(entry_dir)
+                logger.debug(f'Pruned build cache entry {entry_dir.name}')
+
+    def save_pythontex(self, job_name: str, working_dir: Path, items: list[str | Path], pickles: list[Path]):
+        """
+        Keeps the pythontex output directory of job_name, the files its
+        pycode registered (items, relative to working_dir), and its pickles,
+        so that the next build of the same job can let pythontex reuse the
+        results of code that has not changed
+        """
+        entry_dir = self.pythontex / job_name
+        tmp_dir = self.pythontex / f'.{job_name}-{os.getpid()}'
+        if tmp_dir.exists():
+            rmtree(tmp_dir)
+        for item in [f'pythontex-files-{job_name}'] + [str(x) for x in items]:
+            src = working_dir / item
+            dest = tmp_dir / 'work' / item
+            if src.is_dir():
+                copytree(src, dest, dirs_exist_ok=True)
+            elif src.is_file():
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                copy2(src, dest)
+        for pfile in pickles:
+            if pfile.is_file():
+                (tmp_dir / 'pickles').mkdir(parents=True, exist_ok=True)
+                copy2(pfile, tmp_dir / 'pickles' / pfile.name)
+        if not tmp_dir.exists():
+            return
+        if entry_dir.exists():
+            rmtree(entry_dir)
+        tmp_dir.rename(entry_dir)
+
+    def restore_pythontex(self, job_name: str, working_dir: Path, pickle_cache: Path) -> bool:
+        """
+        Copies the pythontex output kept for job_name into working_dir, and
+        its pickles into pickle_cache unless they are already there (e.g.,
+        written by the other document of the same serial); returns True if
+        anything was restored
+        """
+        entry_dir = self.pythontex / job_name
+        if not entry_dir.is_dir():
+            return False
+        if (entry_dir / 'work').is_dir():
+            copytree(entry_dir / 'work', working_dir, dirs_exist_ok=True)
+        if (entry_dir / 'pickles').is_dir():
+            for pfile in (entry_dir / 'pickles').iterdir():
+                if not (pickle_cache / pfile.name).exists():
+                    copy2(pfile, pickle_cache / pfile.name)
+        return True
+
+    def prune_pythontex(self, job_names: list[str]):
+        """
+        Removes the pythontex output kept for jobs not in job_names
+        """
+        if not self.pythontex.is_dir():
+            return
+        for entry_dir in self.pythontex.iterdir():
+            if entry_dir.name not in job_names:
+                rmtree(entry_dir)
+                logger.debug(f'Pruned pythontex cache entry {entry_dir.name}')
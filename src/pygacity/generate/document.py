@@ -1,4 +1,5 @@
 # Author: Cameron F. Abrams, <cfa22@drexel.edu>
+import hashlib
 import logging
 
 from copy import deepcopy
@@ -28,23 +29,74 @@ class Document:
             self.embedded_graphics.extend(block.embedded_graphics)
             
     def make_substitutions(self, outer_substitutions: dict = {}):
-        self.substitutions.update(deepcopy(outer_substitutions))
+        self.substitutions.update(outer_substitutions)
         logger.debug(f'Document.make_substitutions with substitutions: {self.substitutions}')
         for block in self.blocks:
             block.substitute(super_substitutions=self.substitutions)
 
-    def write_source(self, local_output_name: str  = 'local_document'):
+    def header_source(self) -> str:
+        """
+        Returns the document class line and preamble, which are the same for
+        every serial
+        """
+        class_specs = self.specs.get('class', {})
+        logger.debug(f'Document.header_source with class_specs: {class_specs}')
+        dcoptions = class_specs.get('options', [])
+        classname = class_specs.get('classname', 'article')
+        source = rf'\documentclass[{", ".join(dcoptions)}]{{{classname}}}' + '\n'
+        source += str(self.preamble) + '\n'
+        return source
+
+    def source(self, precompiled: bool = False) -> str:
+        """
+        Returns the complete LaTeX source of the document as currently
+        substituted.  If precompiled, the source is meant to be compiled with a
+        format into which its header has been dumped; everything up to
+        \\endofdump is then skipped, and packages the class could not dump are
+        loaded after it.
+        """
+        source = '% Automatically generated LaTeX source file\n'
+        source += self.header_source()
+        if precompiled:
+            source += r'\endofdump\csname pygacity@deferredpackages\endcsname' + '\n'
+        for block in self.blocks:
+            source += str(block) + '\n'
+        source += '% End of automatically generated LaTeX source file\n'
+        return source
+
+    def block_at(self, lineno: int, precompiled: bool = False) -> LatexCompoundBlock | None:
+        """
+        Returns the top-level block whose text is at line lineno of source(),
+        or None if that line is not in a block
+        """
+        start = 2 + self.header_source().count('\n') + (1 if precompiled else 0)
+        for block in self.blocks:
+            n = (str(block) + '\n').count('\n')
+            if start <= lineno < start + n:
+                return block
+            start += n
+        return None
+
+    def fragment_hashes(self) -> list[str]:
+        """
+        Returns a hash of the text of each top-level block as currently
+        substituted
+        """
+        return [hashlib.sha256(str(block).encode()).hexdigest() for block in self.blocks]
+
+    def referenced_files(self) -> list[Path]:
+        """
+        Returns the config files and embedded graphics files the document's
+        blocks refer to that exist relative to the current directory
+        """
+        files = []
+        for block in self.blocks:
+            files.extend(block.referenced_configs())
+        files.extend([Path(gf) for gf in self.embedded_graphics if Path(gf).is_file()])
+        return files
+
+    def write_source(self, local_output_name: str  = 'local_document', precompiled: bool = False):
         with open(local_output_name + '.tex', 'w') as f:
-            f.write('% Automatically generated LaTeX source file\n')
-            class_specs = self.specs.get('class', {})
-            logger.debug(f'Document.write_source with class_specs: {class_specs}')
-            dcoptions = class_specs.get('options', [])
-            classname = class_specs.get('classname', 'article')
-            f.write(rf'\documentclass[{", ".join(dcoptions)}]{{{classname}}}' + '\n')
-            f.write(str(self.preamble) + '\n')
-            for block in self.blocks:
-                f.write(str(block) + '\n')
-            f.write('% End of automatically generated LaTeX source file\n')
-
-
-   
\ No newline at end of file
+            f.write(self.source(precompiled=precompiled))
+
+
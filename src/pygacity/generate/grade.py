@@ -0,0 +1,115 @@
+# Author: Cameron F. Abrams, <cfa22@drexel.edu>
+from __future__ import annotations
+import logging
+import numbers
+import numpy as np
+import pandas as pd
+
+from pathlib import Path
+
+from .answerset import AnswerSuperSet
+from .answerstore import AnswerStore
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+class Grader:
+    """
+    Grades responses against the answers of an AnswerSuperSet.  Responses
+    are given as a table with one row per student, a column holding the
+    serial of the student's document, and one column per answer named as in
+    the answer set document (e.g., ``3-V (m$^3$)``).
+
+    Numerical answers are correct if within a relative tolerance rtol or an
+    absolute tolerance atol of the reference value (as in numpy.isclose);
+    any other answer must match the reference value as text, ignoring case
+    and surrounding space.  Tolerances and points may be set for individual
+    answers in ``answers``, a dict keyed by column name, answer label, or
+    question index, in that order of precedence, e.g.,
+    ``{'3-V (m$^3$)': {'rtol': 0.05}, 'x': {'atol': 0.01, 'points': 2}}``.
+    """
+    def __init__(self, superset: AnswerSuperSet, rtol: float = 0.01, atol: float = 0.0, answers: dict = {}):
+        schema = superset.schema
+        self.keys = list(schema['key'])
+        self.serials = superset.serials
+        settings = []
+        for key, label, index in zip(schema['key'], schema['label'], schema['index']):
+            settings.append(answers.get(key, answers.get(label, answers.get(index, {}))) or {})
+        self.rtol = np.array([s.get('rtol', rtol) for s in settings], dtype=float)
+        self.atol = np.array([s.get('atol', atol) for s in settings], dtype=float)
+        self.points = np.array([s.get('points', 1) for s in settings], dtype=float)
+        # a column is numerical if all of its values (missing ones aside) are numbers
+        columns = list(zip(*superset.values)) if len(superset.values) else [()] * len(self.keys)
+        self.numeric = np.array([_numeric(column) for column in columns], dtype=bool)
+        values = pd.DataFrame(superset.values)
+        self.reference = values.loc[:, self.numeric].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+        self.reference_text = _normalized(values.loc[:, ~self.numeric])
+
+    def grade(self, responses: pd.DataFrame, serial_column: str = 'serial') -> pd.DataFrame:
+        """
+        Returns responses with each graded answer column replaced by whether it
+        is correct (1 or 0), and columns for the score, the points possible,
+        and the percentage
+        """
+        if serial_column not in responses.columns:
+            raise KeyError(f'Responses have no "{serial_column}" column')
+        graded = np.array([k in responses.columns for k in self.keys], dtype=bool)
+        if not graded.any():
+            raise KeyError(f'No response column matches an answer; expected some of {self.keys}')
+        for k in np.array(self.keys)[~graded]:
+            logger.warning(f'No responses for answer "{k}"; it is not graded')
+        # the row of the reference answers of each response's serial
+        serials = responses[serial_column].to_numpy(dtype=np.int64)
+        rows = np.searchsorted(self.serials, serials).clip(max=max(len(self.serials) - 1, 0))
+        known = self.serials[rows] == serials if len(self.serials) else np.zeros(len(serials), dtype=bool)
+        if not np.all(known):
+            logger.warning(f'No answers for serial(s) {sorted(set(serials[~known]))}; their responses score 0')
+        correct = np.zeros((len(responses), len(self.keys)), dtype=bool)
+        numeric = np.flatnonzero(self.numeric)
+        textual = np.flatnonzero(~self.numeric)
+        cols = numeric[graded[numeric]]
+        if len(cols):
+            given = responses[[self.keys[i] for i in cols]].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+            reference = self.reference[rows][:, graded[numeric]]
+            with np.errstate(invalid='ignore'):
+                correct[:, cols] = np.abs(given - reference) <= self.atol[cols] + self.rtol[cols] * np.abs(reference)
+        cols = textual[graded[textual]]
+        if len(cols):
+            given = _normalized(responses[[self.keys[i] for i in cols]])
+            correct[:, cols] = given == self.reference_text[rows][:, graded[textual]]
+        correct &= known[:, np.newaxis]
+        result = responses.copy()
+        for i in np.flatnonzero(graded):
+            result[self.keys[i]] = correct[:, i].astype(int)
+        result['score'] = correct[:, graded] @ self.points[graded]
+        result['possible'] = self.points[graded].sum()
+        result['percent'] = 100.0 * result['score'] / result['possible']
+        return result
+
+def _numeric(values) -> bool:
+    present = [v for v in values if v is not None and not (isinstance(v, float) and np.isnan(v))]
+    return len(present) > 0 and all(isinstance(v, numbers.Real) and not isinstance(v, bool) for v in present)
+
+def _normalized(frame: pd.DataFrame) -> np.ndarray:
+    return np.char.lower(np.char.strip(frame.fillna('').to_numpy(dtype=str)))
+
+def grade_subcommand(args):
+    logger.info(f'Grading responses in {args.responses} against answers of the build specified in {args.f}...')
+    config = Config(args.f)
+    specs = config.build_specs.get('grading', {})
+    serial_column = specs.get('serial-column', 'serial')
+    responses = pd.read_csv(args.responses)
+    pickle_cache = Path(config.build_specs['paths']['build-dir']) / config.pickle_cache_name
+    with AnswerStore(pickle_cache / AnswerStore.name) as store:
+        # all serials, so that answers are named as in the answer set document
+        answersets = store.answersets()
+    if not answersets:
+        raise Exception(f'No answers found in {pickle_cache.as_posix()} -- cannot grade')
+    grader = Grader(AnswerSuperSet(initial=answersets),
+                    rtol=args.rtol if args.rtol is not None else specs.get('rtol', 0.01),
+                    atol=args.atol if args.atol is not None else specs.get('atol', 0.0),
+                    answers=specs.get('answers', {}))
+    scores = grader.grade(responses, serial_column=serial_column)
+    output = args.output or Path(args.responses).with_name(Path(args.responses).stem + '-scores.csv')
+    scores.to_csv(output, index=False)
+    logger.info(f'Graded {len(scores)} response(s); mean score {scores["percent"].mean():.1f}% => {Path(output).as_posix()}')
@@ -0,0 +1,102 @@
+# Author: Cameron F. Abrams, <cfa22@drexel.edu>
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+class BuildManifest:
+    """
+    A record, kept in the build directory while a build runs, of the serials
+    being built and of each serial whose documents have all been built, so
+    that a build that stops partway can be resumed.  The first line holds the
+    build's serials, scratch directory and configuration signature; each
+    completed serial then appends one line with what its build produced.  A
+    line cut short by a crash is ignored.
+
+    Attributes
+    ----------
+    path: Path
+        the manifest file
+
+    header: dict
+        signature, serials, and scratch directory of the build (empty if
+        there is no manifest)
+
+    results: dict[int, dict]
+        the build result of each completed serial, by serial
+    """
+    name: str = 'manifest.jsonl'
+
+    def __init__(self, build_path: str | Path):
+        self.path = Path(build_path) / self.name
+        self.header: dict = {}
+        self.results: dict[int, dict] = {}
+        if self.path.exists():
+            self.load()
+
+    def load(self):
+        with self.path.open('r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.debug(f'Ignoring incomplete line in {self.path.as_posix()}')
+                    continue
+                if 'serials' in record:
+                    self.header = record
+                else:
+                    self.results[record['serial']] = record
+
+    @staticmethod
+    def signature(*specs) -> str:
+        """
+        Returns a hash of specs (e.g., the document and build specs); a build
+        can only be resumed with the configuration it was started with
+        """
+        return hashlib.sha256(json.dumps(specs, sort_keys=True, default=str).encode()).hexdigest()
+
+    def start(self, signature: str, serials: list[int], scratch_root: Path):
+        """
+        Begins a new manifest, forgetting any completed serials
+        """
+        self.header = dict(signature=signature, serials=[int(s) for s in serials],
+                           scratch=Path(scratch_root).resolve().as_posix())
+        self.results = {}
+        with self.path.open('w') as f:
+            f.write(json.dumps(self.header) + '\n')
+
+    def record(self, result: dict):
+        """
+        Records that the documents of one serial have been built
+        """
+        self.results[result['serial']] = result
+        with self.path.open('a') as f:
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def completed(self, build_path: str | Path) -> dict[int, dict]:
+        """
+        Returns the results of the completed serials whose PDFs, sources, and
+        build files are all still in place
+        """
+        build_path = Path(build_path)
+        completed = {}
+        for serial, result in self.results.items():
+            files = [build_path / f'{job}.pdf' for job in result['jobs']]
+            files += [Path(f) for k in ['tex', 'buildfiles', 'solnbuildfiles'] for f in result[k]]
+            missing = [f for f in files if not f.exists()]
+            if missing:
+                logger.debug(f'Serial {serial} must be rebuilt; {missing[0].as_posix()} is missing')
+                continue
+            completed[serial] = result
+        return completed
+
+    def remove(self):
+        if self.path.exists():
+            self.path.unlink()
@@ -1,69 +1,621 @@
 # Author: Cameron F. Abrams, <cfa22@drexel.edu>
+from __future__ import annotations
+import hashlib
+import logging
+import math
 import numpy as np
 from argparse import Namespace
-from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# marks a rule with no default value
+_NO_DEFAULT = object()
+
+# names available to constraint expressions besides the picked values
+_CONSTRAINT_GLOBALS = {'np': np} | {name: getattr(np, name) for name in
+                       ['abs', 'exp', 'log', 'log10', 'sqrt', 'sin', 'cos', 'tan', 'minimum', 'maximum', 'isclose']}
 
 class Picker:
-    def __init__(self, serial=0):
+    """
+    Picks the states of a serial's pick specs.  By default each state is
+    drawn at random from a generator seeded with the serial.  If the
+    serial's ordinal (its position, from 0, among the serials of a build) is
+    given, each pick instead takes the variant of its spec's discrete space
+    (see PickPlan) that one digit of the ordinal maps to.  The ordinal is
+    read as a mixed-radix number over the picks, in the order they are
+    made, so that no two of the first ``variants()`` serials pick the same
+    states; a pick with constraints contributes a digit over only the
+    variants that meet them, where PickPlan.admissible() counts those.
+    """
+    def __init__(self, serial=0, ordinal=None):
         self.rng = np.random.default_rng(serial) if serial != 0 else None
+        self.ordinal = ordinal
+        # every state picked, in order
+        self.picks = []
+        # the number of variants of each spec picked from (None if unlimited)
+        self.spaces = []
+        # the place value of the ordinal's digit for the next pick
+        self.stride = 1
 
-    def pick_state(self, specs):
-        # given the single instance of specs, return a single randomly picked state
-        _pick_recursive(specs, self.rng)
-        return Namespace(**specs)
+    def pick_state(self, specs, constraints=[], feasible=None):
+        # given the single instance of specs (or a PickPlan compiled from it),
+        # return a single randomly picked state that meets the constraints
+        # (see PickPlan); specs are not changed
+        plan = specs if isinstance(specs, PickPlan) else PickPlan(specs, constraints=constraints, feasible=feasible)
+        if self.ordinal is not None and self.rng is not None:
+            radix = plan.size if plan.enumerated else 1
+            space = plan.variants
+            if plan.enumerated and (plan.constraints or plan.feasible):
+                # the digit indexes only the variants that meet the constraints
+                admissible = plan.admissible(key=len(self.spaces))
+                if admissible:
+                    radix = space = admissible
+            # adding the lower digits (ordinal % stride), which the digits of
+            # earlier picks determine, keeps the map one-to-one and varies
+            # every pick among the first serials, not only the first pick
+            digit = (self.ordinal // self.stride + self.ordinal % self.stride) % radix
+            values = plan.unique(digit, self.rng, key=len(self.spaces))
+            self.stride *= radix
+        else:
+            values = plan.draw(self.rng)
+            space = plan.variants
+        state = plan.state(values)
+        self.picks.append(repr(state))
+        self.spaces.append(space)
+        return Namespace(**state)
 
-class Stepper:
-    def __init__(self, specs):
-        _space_recursive(specs)
-        self.space = Namespace(**specs)
-        allv = []
-        for k in vars(self.space).values():
-            if not hasattr(k, '__len__'):
-                allv.append([k])
+    def digest(self) -> str:
+        """
+        Returns a hash of every state picked so far; two pickers that picked
+        the same states have the same digest
+        """
+        return hashlib.sha256('\n'.join(self.picks).encode()).hexdigest()
+
+    def variants(self) -> int | None:
+        """
+        Returns the number of serials that can be given different states by
+        the picks made so far, the number of combinations of their variants,
+        or None if there is no limit (e.g., a ``between`` rule has no
+        ``round``)
+        """
+        if any(n is None for n in self.spaces):
+            return None
+        return math.prod(self.spaces)
+
+class PickRule(NamedTuple):
+    path: tuple
+    kind: str  # 'between' or 'pickfrom'
+    bounds: tuple = None
+    domain: list = None
+    round: int = None
+    default: object = _NO_DEFAULT
+    where: tuple = ()
+
+class PickPlan:
+    """
+    A pick spec compiled into a flat list of rules, one for each value to be
+    picked, in the order Picker.pick_state draws them.  Each run of
+    consecutive rules of one kind is drawn with a single call to the
+    generator, and states for many serials are transformed column by column;
+    the state picked for a serial is always the one
+    ``Picker(serial).pick_state(specs)`` picks.
+
+    A state may be required to meet constraints: expressions over the picked
+    (and constant) values of the spec, given as ``'where'`` in a pick rule
+    (e.g., ``{'pick': {'between': [300, 400], 'where': 'T2 > T1 + 10'}}``)
+    or as constraints, and a feasible(state) callback returning True or
+    False.  Nested values are named as attributes (``feed.z``).  Expressions
+    are evaluated on arrays of candidates, so use ``&``, ``|`` and ``~``
+    rather than ``and``, ``or`` and ``not`` (expressions that cannot be
+    evaluated that way are evaluated for one candidate at a time); numpy is
+    available as ``np``, as are its common math functions.
+
+    The first candidate is the state that would be picked without
+    constraints.  If it is rejected, further candidates are drawn in
+    batches of growing size, constraints are evaluated on a whole batch at
+    once, and the first candidate that meets them and that feasible accepts
+    is picked.  If none is found in max_candidates, an Exception gives how
+    many candidates each constraint rejected.  States of serial 0 (the
+    defaults) are not checked.
+
+    The values of the ``pickfrom`` rules and of the ``between`` rules with a
+    ``round`` (each the values its range holds at that rounding) make up the
+    spec's discrete space of ``variants`` (None if a ``between`` rule has no
+    ``round``).  unique() maps an ordinal onto it as a permuted mixed-radix
+    index, so that ordinals below the number of variants (of those that
+    meet the constraints) get different ones.
+    """
+    batch_size: int = 16
+    max_batch_size: int = 1024
+    # discrete spaces at least this large are drawn from at random, where
+    # two serials picking the same variant is vanishingly unlikely
+    max_enumerated: int = 2**62
+    # admissible() checks every variant of spaces up to this size
+    max_counted: int = 2**16
+
+    def __init__(self, specs: dict, constraints: list[str] = [], feasible=None, max_candidates: int = 10000):
+        self.specs = specs
+        self.rules: list[PickRule] = []
+        _compile_recursive(specs, (), self.rules)
+        self.constraints = [c for rule in self.rules for c in rule.where] + list(constraints)
+        self.compiled = [compile(c, f'<pick constraint "{c}">', 'eval') for c in self.constraints]
+        self.feasible = feasible
+        self.max_candidates = max_candidates
+        # (kind, first, last + 1) of each run of rules of one kind
+        self.runs: list[tuple[str, int, int]] = []
+        for i, rule in enumerate(self.rules):
+            if self.runs and self.runs[-1][0] == rule.kind:
+                self.runs[-1] = (rule.kind, self.runs[-1][1], i + 1)
+            else:
+                self.runs.append((rule.kind, i, i + 1))
+        self.sizes = np.array([len(r.domain) if r.kind == 'pickfrom' else 0 for r in self.rules], dtype=np.int64)
+        # the number of values of each discrete rule, and the first value of
+        # each rounded 'between' rule in units of its rounding
+        self.radices: list[int] = []
+        self.starts: list[int] = []
+        for rule in self.rules:
+            if rule.kind == 'pickfrom':
+                self.radices.append(len(rule.domain))
+                self.starts.append(0)
+            elif rule.round is not None:
+                scale = 10.0 ** rule.round
+                first = math.ceil(round(rule.bounds[0] * scale, 6))
+                self.radices.append(max(math.floor(round(rule.bounds[1] * scale, 6)) - first + 1, 1))
+                self.starts.append(first)
             else:
-                allv.append(k)
-        self.T = product(*allv)
+                self.radices.append(0)
+                self.starts.append(0)
+        self.size = math.prod(n for n in self.radices if n)
+        self.variants = self.size if all(self.radices) else None
+        # whether unique() maps ordinals onto the discrete space
+        self.enumerated = any(self.radices) and self.size < self.max_enumerated
+        # admissible variants found by unique(), by permutation seed
+        self._admissible: dict[int, tuple[list[int], int]] = {}
+
+    def draw(self, rng: np.random.Generator | None) -> list:
+        """
+        Returns the picked value of each rule, drawn from rng, or each rule's
+        default if rng is None
+        """
+        if rng is None:
+            for rule in self.rules:
+                assert rule.default is not _NO_DEFAULT, f'Error: serial is 0 but no default for {rule.path[-1]} is given'
+            return [rule.default for rule in self.rules]
+        columns = self.transform(self.raw(rng)[np.newaxis, :])
+        if self.constraints or self.feasible:
+            return self.search(rng, columns, self.constraint_masks(columns))
+        return [column[0] for column in columns]
+
+    def unique(self, ordinal: int, rng: np.random.Generator, key: int = 0) -> list:
+        """
+        Returns the values of the variant that ordinal maps to: the ordinal,
+        modulo the number of variants, is permuted (by a permutation
+        particular to the spec and key) and read as a mixed-radix number
+        whose digits index the discrete rules' values.  Rules without a
+        discrete space are drawn from rng.  Without constraints, this costs
+        the same for any ordinal.  With constraints, the ordinal indexes
+        the variants that meet them, taken in permuted order, so variants
+        are checked (in batches) up to the one it maps to; the plan keeps
+        the admissible ones it has found, so that a plan used for many
+        ordinals checks each variant at most once (unless some rules have
+        no discrete space, since their random values may decide whether a
+        variant is admissible).
+        """
+        if not self.enumerated:
+            return self.draw(rng)
+        base = self.raw(rng)
+        seed = self._seed(key)
+        if not (self.constraints or self.feasible):
+            columns = self.transform(self._variant_raw(base, _permute(np.array([ordinal % self.size]), self.size, seed)))
+            return [column[0] for column in columns]
+        admissible = self._scan(base, seed, ordinal + 1)
+        if not admissible:
+            raise Exception(f'No variant of {self.size} meets the constraints')
+        if len(admissible) <= ordinal:
+            logger.debug(f'Only {len(admissible)} of {self.size} variants meet the constraints; ordinal {ordinal} repeats one')
+        index = admissible[ordinal % len(admissible)]
+        return [column[0] for column in self.transform(self._variant_raw(base, np.array([index], dtype=np.uint64)))]
+
+    def admissible(self, key: int = 0) -> int | None:
+        """
+        Returns the number of variants that meet the constraints, the ones
+        unique() maps ordinals onto for this key; all variants are checked
+        (once per plan), so this is None if the space is larger than
+        max_counted or if some rules have no discrete space
+        """
+        if not self.enumerated or self.variants is None or self.size > self.max_counted:
+            return None
+        if not (self.constraints or self.feasible):
+            return self.size
+        # every rule is discrete, so no random draws enter the variants
+        return len(self._scan(np.zeros(len(self.rules)), self._seed(key), self.size))
+
+    def _scan(self, base: np.ndarray, seed: int, count: int) -> list[int]:
+        # permuted indices of the admissible variants, checked (in batches)
+        # until count of them are found or all are checked
+        found = self._admissible.get(seed, ([], 0)) if self.variants is not None else ([], 0)
+        admissible, checked = found
+        while len(admissible) < count and checked < self.size:
+            stop = min(checked + self.max_batch_size, self.size)
+            indices = _permute(np.arange(checked, stop), self.size, seed)
+            columns = self.transform(self._variant_raw(base, indices))
+            masks = self.constraint_masks(columns)
+            passed = np.flatnonzero(np.logical_and.reduce(masks) if masks else np.ones(len(indices), dtype=bool))
+            for i in passed:
+                if self.feasible is None or self.feasible(Namespace(**self.state([column[i] for column in columns]))):
+                    admissible.append(int(indices[i]))
+                    if len(admissible) >= count:
+                        # the rest of the batch is left for a later ordinal
+                        stop = checked + i + 1
+                        break
+            checked = stop
+        if self.variants is not None:
+            self._admissible[seed] = (admissible, checked)
+        return admissible
+
+    def _variant_raw(self, base: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        # raw draws (as raw()) that transform() turns into the variants at
+        # indices, with the draws of rules without a discrete space from base
+        raw = np.tile(base, (len(indices), 1))
+        stride = 1
+        for j, (rule, radix, first) in enumerate(zip(self.rules, self.radices, self.starts)):
+            if not radix:
+                continue
+            digits = (indices // np.uint64(stride)) % np.uint64(radix)
+            if rule.kind == 'pickfrom':
+                raw[:, j] = digits
+            else:
+                lower, upper = rule.bounds
+                values = (first + digits.astype(np.int64)) / 10.0 ** rule.round
+                raw[:, j] = (values - lower) / (upper - lower) if upper != lower else 0.0
+            stride *= radix
+        return raw
+
+    def _seed(self, key: int) -> int:
+        # a permutation seed particular to the rules of the spec and to key
+        rules = repr([(r.path, r.kind, r.bounds, r.domain, r.round) for r in self.rules]) + f'/{key}'
+        return int.from_bytes(hashlib.sha256(rules.encode()).digest()[:8], 'big')
+
+    def search(self, rng: np.random.Generator, columns: list[list], masks: list[np.ndarray]) -> list:
+        """
+        Returns the values of the first candidate in columns that meets the
+        constraints (masks, as from constraint_masks()) and that feasible
+        accepts, drawing batches of further candidates from rng until there
+        is one
+        """
+        drawn = 0
+        rejected = dict.fromkeys(self.constraints, 0) | {'feasible': 0}
+        size = self.batch_size
+        while True:
+            admissible = np.logical_and.reduce(masks) if masks else np.ones(len(columns[0]), dtype=bool)
+            for i in np.flatnonzero(admissible):
+                values = [column[i] for column in columns]
+                if self.feasible is None or self.feasible(Namespace(**self.state(values))):
+                    if drawn + i > 0:
+                        logger.debug(f'Picked a feasible state from candidate {drawn + i + 1}')
+                    return values
+                rejected['feasible'] += 1
+            for c, mask in zip(self.constraints, masks):
+                rejected[c] += int(np.count_nonzero(~mask))
+            drawn += len(admissible)
+            if drawn >= self.max_candidates:
+                summary = ', '.join(f'"{c}": {n}' for c, n in rejected.items() if c != 'feasible' or self.feasible)
+                raise Exception(f'No feasible state found in {drawn} candidates; rejections: {summary}')
+            n = min(size, self.max_candidates - drawn)
+            size = min(2 * size, self.max_batch_size)
+            columns = self.transform(self.candidates(rng, n))
+            masks = self.constraint_masks(columns)
+
+    def candidates(self, rng: np.random.Generator, n: int) -> np.ndarray:
+        """
+        Returns the raw draws (as raw()) of n candidate states, one per row,
+        drawn from rng a run at a time for all candidates at once
+        """
+        raw = np.empty((n, len(self.rules)))
+        for kind, first, last in self.runs:
+            if kind == 'between':
+                raw[:, first:last] = rng.random((n, last - first))
+            else:
+                raw[:, first:last] = rng.integers(0, self.sizes[first:last], size=(n, last - first))
+        return raw
+
+    def constraint_masks(self, columns: list[list]) -> list[np.ndarray]:
+        """
+        Returns, for each constraint, whether each candidate state in columns
+        meets it
+        """
+        n = len(columns[0]) if columns else 1
+        arrays = None
+        if all(np.ndim(v) == 0 for column in columns for v in column):
+            arrays = self._names([np.asarray(column) for column in columns])
+        masks = []
+        for c, code in zip(self.constraints, self.compiled):
+            try:
+                if arrays is None:
+                    raise ValueError('not every value is a scalar')
+                masks.append(np.broadcast_to(np.asarray(eval(code, _CONSTRAINT_GLOBALS, arrays), dtype=bool), (n,)))
+            except (ValueError, TypeError):
+                # e.g., "and" between arrays; evaluated one candidate at a time
+                masks.append(np.array([bool(self._evaluate(c, code, [column[i] for column in columns]))
+                                       for i in range(n)], dtype=bool))
+            except Exception as e:
+                raise Exception(f'Pick constraint "{c}" could not be evaluated: {e!r}') from e
+        return masks
+
+    def _evaluate(self, constraint: str, code, values: list):
+        try:
+            return eval(code, _CONSTRAINT_GLOBALS, self._names(values))
+        except Exception as e:
+            raise Exception(f'Pick constraint "{constraint}" could not be evaluated: {e!r}') from e
+
+    def _names(self, values: list) -> dict:
+        # the spec's names, with each picked value (or array of values) in place
+        return {k: _namespace_recursive(v) for k, v in self.state(values).items() if isinstance(k, str)}
+
+    def raw(self, rng: np.random.Generator) -> np.ndarray:
+        """
+        Returns the uniform variate of each 'between' rule and the index
+        into the domain of each 'pickfrom' rule, drawn from rng
+        """
+        raw = np.empty(len(self.rules))
+        for kind, first, last in self.runs:
+            if kind == 'between':
+                raw[first:last] = rng.random(last - first)
+            else:
+                raw[first:last] = rng.integers(0, self.sizes[first:last])
+        return raw
+
+    def transform(self, raw: np.ndarray) -> list[list]:
+        """
+        Returns, for each rule, the values picked by the rows of raw (one row
+        per state)
+        """
+        columns = []
+        for j, rule in enumerate(self.rules):
+            if rule.kind == 'between':
+                lower, upper = rule.bounds
+                values = lower + raw[:, j] * (upper - lower)
+                if rule.round is not None:
+                    values = list(np.round(values, rule.round))
+                elif all(type(x) in (int, float) for x in rule.bounds):
+                    values = values.tolist()
+                else:
+                    values = list(values)
+            else:
+                values = np.asarray(rule.domain)[raw[:, j].astype(np.int64)]
+                if rule.round is not None:
+                    values = np.round(values, rule.round)
+                values = list(values)
+            columns.append(values)
+        return columns
+
+    def state(self, values: list) -> dict:
+        """
+        Returns a copy of the spec with each picked value in its place
+        """
+        state = _copy_recursive(self.specs)
+        for rule, value in zip(self.rules, values):
+            d = state
+            for k in rule.path[:-1]:
+                d = d[k]
+            d[rule.path[-1]] = value
+        return state
+
+    def states(self, serials: list[int], structured: bool = False) -> list[Namespace] | np.ndarray:
+        """
+        Returns the state picked for each of serials, as a Namespace each or,
+        if structured, as a structured array with one field per picked value
+        (named by its keys joined with '.')
+        """
+        raw = np.zeros((len(serials), len(self.rules)))
+        rngs = [np.random.default_rng(serial) if serial != 0 else None for serial in serials]
+        for i, rng in enumerate(rngs):
+            if rng is not None:
+                raw[i] = self.raw(rng)
+        columns = self.transform(raw)
+        # the first candidates of all serials are checked at once
+        masks = self.constraint_masks(columns) if self.constraints or self.feasible else None
+        for i, rng in enumerate(rngs):
+            if rng is None:
+                values = self.draw(None)
+            elif masks is not None:
+                values = self.search(rng, [column[i:i + 1] for column in columns], [mask[i:i + 1] for mask in masks])
+            else:
+                continue
+            for column, value in zip(columns, values):
+                column[i] = value
+        if structured:
+            return _structured(columns, [rule.path for rule in self.rules])
+        return [Namespace(**self.state([column[i] for column in columns])) for i in range(len(serials))]
+
+class Stepper:
+    """
+    Steps through the space of states a pick spec allows: each ``between``
+    range as ``intervals`` evenly spaced values (as the rule's
+    ``intervals`` says, or the intervals argument; default 10), and each
+    ``pickfrom`` domain (or any top-level list) as its values.  By default
+    (method 'grid') every combination is visited, in the order of
+    itertools.product over the spec's entries; len() gives their number.
+    With method 'lhs' (Latin hypercube) or 'sobol' (scrambled Sobol
+    sequence), ``samples`` states are drawn instead, with ``between`` values
+    continuous in their range (and rounded as ``round`` says), which covers
+    a large space with far fewer states.
+
+    Iterating yields a Namespace per state; chunks() yields the states as
+    structured arrays, and map() evaluates a function over every state in
+    a process pool.
+    """
+    def __init__(self, specs, method: str = 'grid', samples: int = None, seed: int = None, intervals: int = 10):
+        self.specs = specs
+        space = _copy_recursive(specs)
+        # paths of the entries that are stepped through
+        self.paths: list[tuple] = []
+        _space_recursive(space, (), self.paths, intervals)
+        for k, v in space.items():
+            if (k,) not in self.paths and isinstance(v, (list, tuple, np.ndarray)):
+                self.paths.append((k,))
+        self.paths.sort(key=_path_order(specs))
+        self.space = Namespace(**space)
+        self.values = [_as_1d(_get(space, path)) for path in self.paths]
+        self.shape = tuple(len(v) for v in self.values)
+        self.method = method
+        if method == 'grid':
+            self.size = int(np.prod(self.shape, dtype=np.int64))
+        elif method in ('lhs', 'sobol'):
+            if not samples:
+                raise ValueError(f'Stepper method {method} needs a number of samples')
+            self.size = samples
+            self.rules = [_get(specs, path)['pick'] if _is_rule(_get(specs, path)) else {} for path in self.paths]
+        else:
+            raise ValueError(f'Unknown Stepper method {method}; expected grid, lhs or sobol')
+        self.seed = seed
+        self._unit = None
+        self._points = self.points()
+        logger.debug(f'Stepper: {self.size} state(s) over {len(self.paths)} dimension(s) by {method}')
+
+    def __len__(self):
+        return self.size
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        try:
-            t = next(self.T)
-            resdict = {k: v for k, v in zip(vars(self.space).keys(), t)}
-            return Namespace(**resdict)
-        except:
-            raise StopIteration
-        
-def _pick_recursive(specs, rng):
+        return next(self._points)
+
+    def points(self, chunk_size: int = 10000):
+        """
+        Yields a Namespace for each state, computed a chunk at a time
+        """
+        for start in range(0, self.size, chunk_size):
+            columns = self.columns(start, min(start + chunk_size, self.size))
+            for i in range(len(columns[0]) if columns else 0):
+                state = _copy_recursive(self.specs)
+                for path, column in zip(self.paths, columns):
+                    _set(state, path, column[i])
+                yield Namespace(**state)
+        if not self.paths and self.size:
+            yield Namespace(**_copy_recursive(self.specs))
+
+    def chunks(self, chunk_size: int = 10000):
+        """
+        Yields the states, chunk_size at a time, as structured arrays with
+        one field per stepped entry (named by its keys joined with '.')
+        """
+        for start in range(0, self.size, chunk_size):
+            yield _structured(self.columns(start, min(start + chunk_size, self.size)), self.paths)
+
+    def columns(self, start: int, stop: int) -> list[np.ndarray]:
+        """
+        Returns the values of each stepped entry in states start to stop - 1
+        """
+        if self.method == 'grid':
+            indices = np.unravel_index(np.arange(start, stop), self.shape) if self.paths else []
+            return [values[index] for values, index in zip(self.values, indices)]
+        unit = self.unit()[start:stop]
+        columns = []
+        for j, (values, rule) in enumerate(zip(self.values, self.rules)):
+            if 'between' in rule:
+                lower, upper = rule['between']
+                column = lower + unit[:, j] * (upper - lower)
+                if 'round' in rule:
+                    column = np.round(column, rule['round'])
+            else:
+                column = values[np.minimum((unit[:, j] * len(values)).astype(np.int64), len(values) - 1)]
+            columns.append(column)
+        return columns
+
+    def unit(self) -> np.ndarray:
+        """
+        Returns the samples in the unit hypercube, one row per state
+        """
+        if self._unit is None:
+            from scipy.stats import qmc
+            d = max(len(self.paths), 1)
+            if self.method == 'lhs':
+                sampler = qmc.LatinHypercube(d=d, seed=self.seed)
+            else:
+                sampler = qmc.Sobol(d=d, scramble=True, seed=self.seed)
+            self._unit = sampler.random(self.size)
+        return self._unit
+
+    def map(self, func, jobs: int = None, chunk_size: int = 64) -> list:
+        """
+        Returns func(state) for every state, in order, evaluated in jobs
+        worker processes (default: one per CPU; 1 runs in this process);
+        func must be picklable, e.g., a module-level function
+        """
+        if jobs == 1:
+            return [func(state) for state in self.points()]
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(func, self.points(), chunksize=chunk_size))
+
+def _permute(indices: np.ndarray, size: int, seed: int) -> np.ndarray:
+    """
+    Returns the images of indices (each less than size) under a
+    pseudorandom permutation of range(size) determined by seed: a
+    four-round Feistel network on the smallest even number of bits that
+    holds size, applied again to any image outside the range (cycle
+    walking), so that each index costs a few hashes and nothing is stored
+    """
+    bits = max(int(size - 1).bit_length(), 2)
+    bits += bits % 2
+    half = np.uint64(bits // 2)
+    mask = np.uint64((1 << (bits // 2)) - 1)
+    keys = [np.uint64((seed * (2 * i + 1) + i) & 0xFFFFFFFFFFFFFFFF) for i in range(4)]
+    out = np.asarray(indices, dtype=np.uint64).copy()
+    todo = np.arange(len(out))
+    while len(todo):
+        left, right = out[todo] >> half, out[todo] & mask
+        for k in keys:
+            left, right = right, left ^ (_mix(right, k) & mask)
+        out[todo] = (left << half) | right
+        todo = todo[out[todo] >= np.uint64(size)]
+    return out
+
+def _mix(x: np.ndarray, key: np.uint64) -> np.ndarray:
+    # the splitmix64 finalizer of x ^ key
+    x = (x ^ key) * np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def _compile_recursive(specs, path, rules):
     if not type(specs) == dict:
         return
-    for k, v in specs.items():        
+    for k, v in specs.items():
         if type(v) == dict and 'pick' in v:
             pickrule = v['pick']
-            if rng == None:
-                assert 'default' in v, f'Error: serial is 0 but no default for {k} is given'
-                specs[k] = v['default']
+            default = v.get('default', _NO_DEFAULT)
+            where = pickrule.get('where', ())
+            where = (where,) if isinstance(where, str) else tuple(where)
+            if 'between' in pickrule:
+                rules.append(PickRule(path + (k,), 'between', bounds=tuple(pickrule['between']),
+                                      round=pickrule.get('round', None), default=default, where=where))
+            elif 'pickfrom' in pickrule or 'from' in pickrule:
+                domain = pickrule.get('pickfrom',pickrule.get('from',None))
+                if not domain:
+                    raise ValueError('Pickrule expecting from or pickfrom')
+                rules.append(PickRule(path + (k,), 'pickfrom', domain=domain,
+                                      round=pickrule.get('round', None), default=default, where=where))
             else:
-                if 'between' in pickrule:
-                    lims = pickrule['between']
-                    r = rng.random()
-                    specs[k] = lims[0] + r * (lims[1] - lims[0])
-                    if 'round' in pickrule:
-                        specs[k]=np.round(specs[k], pickrule['round'])
-                elif 'pickfrom' in pickrule or 'from' in pickrule:
-                    domain = pickrule.get('pickfrom',pickrule.get('from',None))
-                    if not domain:
-                        raise ValueError('Pickrule expecting from or pickfrom')
-                    specs[k] = rng.choice(domain)
-                    if 'round' in pickrule:
-                        specs[k] = np.round(specs[k], pickrule['round'])
-                else:
-                    raise Exception('Missing picking rule')
+                raise Exception('Missing picking rule')
         else:
-            _pick_recursive(v,rng)
-        
-def _space_recursive(specs):
+            _compile_recursive(v, path + (k,), rules)
+
+def _namespace_recursive(specs):
+    if not type(specs) == dict or not all(isinstance(k, str) for k in specs):
+        return specs
+    return Namespace(**{k: _namespace_recursive(v) for k, v in specs.items()})
+
+def _copy_recursive(specs):
+    # copies the dicts that hold picked values, so that specs are not changed
+    if not type(specs) == dict:
+        return specs
+    return {k: _copy_recursive(v) for k, v in specs.items()}
+
+def _space_recursive(specs, path=(), paths=None, intervals=10):
     if not type(specs) == dict:
         return 
     for k, v in specs.items():        
@@ -71,13 +623,60 @@ def _space_recursive(specs):
             pickrule = v['pick']
             if 'between' in pickrule:
                 lims = pickrule['between']
-                intervals = pickrule.get('intervals', 10)
-                specs[k] = np.linspace(lims[0], lims[1], intervals)
-            elif 'pickfrom' in pickrule:
-                domain = pickrule['pickfrom']
+                specs[k] = np.linspace(lims[0], lims[1], pickrule.get('intervals', intervals))
+            elif 'pickfrom' in pickrule or 'from' in pickrule:
+                domain = pickrule.get('pickfrom', pickrule.get('from', None))
                 specs[k] = domain
             else:
                 raise Exception('Missing picking rule')
+            if paths is not None:
+                paths.append(path + (k,))
         else:
-            _space_recursive(v)
+            _space_recursive(v, path + (k,), paths, intervals)
+
+def _is_rule(v):
+    return type(v) == dict and 'pick' in v
+
+def _get(specs, path):
+    for k in path:
+        specs = specs[k]
+    return specs
 
+def _set(specs, path, value):
+    _get(specs, path[:-1])[path[-1]] = value
+
+def _path_order(specs):
+    # sorts paths in the order their entries appear in specs, depth first
+    order = {}
+    def walk(d, path):
+        for k, v in d.items():
+            order[path + (k,)] = len(order)
+            if type(v) == dict:
+                walk(v, path + (k,))
+    walk(specs, ())
+    return lambda path: order[path]
+
+def _as_1d(values) -> np.ndarray:
+    # values as a 1-d array; elements of a list keep their types
+    if isinstance(values, np.ndarray) and values.ndim == 1:
+        return values
+    array = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        array[i] = v
+    return array
+
+def _structured(columns: list, paths: list[tuple]) -> np.ndarray:
+    # a structured array with a field for each column, named by its path
+    names = ['.'.join(str(k) for k in path) for path in paths]
+    arrays = []
+    for column in columns:
+        if isinstance(column, np.ndarray) and column.dtype != object:
+            arrays.append(column)
+        elif all(np.ndim(v) == 0 for v in column):
+            arrays.append(np.array(list(column)))
+        else:
+            # e.g., rows picked from a 2-d domain
+            arrays.append(np.empty(len(column), dtype=object))
+            for i, v in enumerate(column):
+                arrays[-1][i] = v
+    return np.rec.fromarrays(arrays, names=names)
@@ -0,0 +1,175 @@
+# Author: Cameron F. Abrams, <cfa22@drexel.edu>
+from __future__ import annotations
+import contextlib
+import io
+import logging
+import os
+import re
+import textwrap
+import traceback
+
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+class PycodeError(Exception):
+    pass
+
+# the pythontex commands and environments the executor understands
+_ENV_RE = re.compile(r'\\begin\{pycode\}(?:\[([^\]]*)\])?(.*?)\\end\{pycode\}', re.DOTALL)
+_INLINE_RE = re.compile(r'\\(pyc|py)(?![A-Za-z@])(?:\[([^\]]*)\])?')
+_ANY_PYTHONTEX_RE = re.compile(r'\\begin\{(py[A-Za-z]*)\}|\\(py[A-Za-z]*)(?![A-Za-z@])')
+# characters that can delimit a verbatim inline argument, as in \py|x|;
+# closing brackets, backslash, and comment/parameter characters cannot
+_VERBATIM_DELIMITERS = '!"$&\'*+,-./:;<=>?@^_`|~'
+
+class PycodeExecutor:
+    """
+    Executes the pythontex code in a LaTeX source in the current interpreter,
+    in source order, and returns the source with each ``pycode`` environment
+    replaced by what its code printed and each ``\\py{expr}`` (or
+    ``\\pyc{code}``) replaced by its value (or printed output), so that
+    pdflatex can compile it without pythontex.
+
+    Each session (the optional ``[name]`` argument) has its own namespace,
+    which lasts for one call of expand().  Code runs with the working
+    directory set to the directory the document is compiled in.  Unlike
+    pythontex, code inside conditionals TeX will skip (e.g., a hidden
+    ``\\ifshowsolutions`` branch) is run too; its output is skipped by TeX.
+    """
+    supported_environments = {'pycode'}
+    supported_commands = {'py', 'pyc'}
+
+    def __init__(self):
+        self.namespaces: dict[str, dict] = {}
+
+    @classmethod
+    def supports(cls, source: str) -> bool:
+        """
+        Returns True if every pythontex command and environment in source is
+        one the executor understands
+        """
+        for m in _ANY_PYTHONTEX_RE.finditer(source):
+            env, cmd = m.groups()
+            if env and env not in cls.supported_environments:
+                return False
+            if cmd and cmd not in cls.supported_commands:
+                return False
+        return True
+
+    def namespace(self, session: str) -> dict:
+        session = session or 'default'
+        if session not in self.namespaces:
+            self.namespaces[session] = {'__name__': f'pycode_{session}'}
+        return self.namespaces[session]
+
+    def expand(self, source: str, working_dir: str | Path = '.') -> str:
+        """
+        Runs the code in source in working_dir; returns the expanded source
+        """
+        self.namespaces = {}
+        cwd = Path.cwd()
+        os.chdir(working_dir)
+        try:
+            return self._expand(source)
+        finally:
+            os.chdir(cwd)
+
+    def execute(self, source: str, working_dir: str | Path = '.', namespaces: dict[str, dict] = None):
+        """
+        Runs only the code in source, in working_dir, for its side effects
+        (e.g., pickled answers); ``\\py{expr}`` is not evaluated and nothing
+        is expanded.  If namespaces (by session) are given, the code runs in
+        them, so code run by an earlier call can be continued
+        """
+        self.namespaces = namespaces if namespaces is not None else {}
+        cwd = Path.cwd()
+        os.chdir(working_dir)
+        try:
+            self._expand(source, display=False)
+        finally:
+            os.chdir(cwd)
+
+    def _expand(self, source: str, display: bool = True) -> str:
+        result = []
+        pos = 0
+        while True:
+            env = _ENV_RE.search(source, pos)
+            inline = _INLINE_RE.search(source, pos)
+            if env is None and inline is None:
+                break
+            if env and (inline is None or env.start() <= inline.start()):
+                if _in_comment(source, env.start()):
+                    result.append(source[pos:env.start() + 1])
+                    pos = env.start() + 1
+                    continue
+                result.append(source[pos:env.start()])
+                code = textwrap.dedent(env.group(2)).strip('\n')
+                result.append(self.run(code, env.group(1), source, env.start()))
+                pos = env.end()
+            else:
+                result.append(source[pos:inline.start()])
+                argument, end = _argument(source, inline.end())
+                if argument is None or _in_comment(source, inline.start()):
+                    # not a command invocation (e.g., \py in a macro definition)
+                    result.append(source[inline.start():inline.end()])
+                    pos = inline.end()
+                    continue
+                if inline.group(1) == 'py':
+                    if not display:
+                        pos = end
+                        continue
+                    result.append(self.evaluate(argument, inline.group(2), source, inline.start()))
+                else:
+                    result.append(self.run(argument, inline.group(2), source, inline.start()))
+                pos = end
+        result.append(source[pos:])
+        return ''.join(result)
+
+    def run(self, code: str, session: str, source: str, offset: int) -> str:
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out):
+                exec(compile(code, f'<pycode at line {_lineno(source, offset)}>', 'exec'), self.namespace(session))
+        except Exception as e:
+            raise PycodeError(f'pycode at line {_lineno(source, offset)} failed:\n{traceback.format_exc()}') from e
+        output = out.getvalue()
+        # the line end that closes the printed output stands for the one that
+        # followed the code in the source
+        return output[:-1] if output.endswith('\n') else output
+
+    def evaluate(self, expression: str, session: str, source: str, offset: int) -> str:
+        try:
+            return str(eval(compile(expression.strip(), f'<py at line {_lineno(source, offset)}>', 'eval'), self.namespace(session)))
+        except Exception as e:
+            raise PycodeError(f'\\py{{{expression}}} at line {_lineno(source, offset)} failed: {e!r}') from e
+
+def _lineno(source: str, offset: int) -> int:
+    return source.count('\n', 0, offset) + 1
+
+def _in_comment(source: str, offset: int) -> bool:
+    line = source[source.rfind('\n', 0, offset) + 1:offset]
+    return re.search(r'(?<!\\)%', line) is not None
+
+def _argument(source: str, start: int) -> tuple[str | None, int]:
+    """
+    Returns the argument of an inline command beginning at start, delimited
+    by matched braces or by a repeated verbatim delimiter (as pythontex
+    allows), and the position just past it
+    """
+    if start >= len(source) or (source[start] != '{' and source[start] not in _VERBATIM_DELIMITERS):
+        return None, start
+    if source[start] != '{':
+        end = source.find(source[start], start + 1)
+        if end < 0:
+            return None, start
+        return source[start + 1:end], end + 1
+    depth = 0
+    for i in range(start, len(source)):
+        if source[i] == '{':
+            depth += 1
+        elif source[i] == '}':
+            depth -= 1
+            if depth == 0:
+                return source[start + 1:i], i + 1
+    return None, start
@@ -0,0 +1,303 @@
+# Author: Cameron F. Abrams, <cfa22@drexel.edu>
+from __future__ import annotations
+import logging
+import numbers
+import os
+import re
+import signal
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from argparse import Namespace
+from pathlib import Path
+from shutil import rmtree
+
+from .block import LatexCompoundBlock, path_resolver
+from .pick import Picker, PickPlan, Stepper, _get
+from .pycode import PycodeExecutor
+
+logger = logging.getLogger(__name__)
+
+# statuses of points whose computation did not give valid answers
+FAILED = ('error', 'timeout', 'invalid')
+
+_KEY_RE = re.compile(r'<<<[^\S\n]*([A-Za-z0-9_-]+)[^\S\n]*>>>')
+
+class _Excluded(BaseException):
+    """
+    Raised by a SweepPicker given a state its pick's constraints reject
+    """
+
+class _Timeout(BaseException):
+    """
+    Raised when a point's computation runs too long; a BaseException, so
+    that problem code catching Exception cannot swallow it
+    """
+
+class SweepPicker(Picker):
+    """
+    A Picker that returns given states instead of random ones: the i-th
+    call of pick_state returns states[i] (a dict shaped as the spec's
+    state), or raises _Excluded if the pick's constraints would never allow
+    it.  Calls beyond the given states pick randomly, as a Picker of serial
+    does.  Every spec (or PickPlan) picked from is kept in ``plans``.
+    """
+    def __init__(self, states: list[dict] = [], serial: int = 1):
+        super().__init__(serial)
+        self.states = states
+        self.plans: list[PickPlan] = []
+
+    def pick_state(self, specs, constraints=[], feasible=None):
+        plan = specs if isinstance(specs, PickPlan) else PickPlan(specs, constraints=constraints, feasible=feasible)
+        self.plans.append(plan)
+        i = len(self.plans) - 1
+        if i >= len(self.states):
+            return super().pick_state(plan)
+        values = [_get(self.states[i], rule.path) for rule in plan.rules]
+        if plan.constraints and not all(mask[0] for mask in plan.constraint_masks([[v] for v in values])):
+            raise _Excluded()
+        state = plan.state(values)
+        if plan.feasible is not None and not plan.feasible(Namespace(**state)):
+            raise _Excluded()
+        self.picks.append(repr(state))
+        return Namespace(**state)
+
+class PointRunner:
+    """
+    Runs a problem's pycode for one state of its pick space; picklable, so
+    that points can be run in worker processes.  Calling it with a point
+    (a Namespace with one entry per pick_state call, ``pick1``, ``pick2``,
+    ...) returns the point's status ('ok', 'error', 'timeout', 'invalid'
+    for an answer that is None or not finite, or 'excluded' for a state
+    the pick's constraints reject), the error, if any, and the seconds the
+    computation took.
+    """
+    def __init__(self, prelude: str, source: str, scratch: Path, serial: int = 1, timeout: float = None):
+        self.prelude = prelude
+        self.source = source
+        self.scratch = Path(scratch)
+        self.serial = serial
+        self.timeout = timeout
+
+    def run(self, picker: SweepPicker) -> dict:
+        """
+        Runs the prelude and then the problem's code, with Pick replaced by
+        picker; returns the names the code left in the default session
+        """
+        working_dir = self.scratch / f'{os.getpid()}'
+        working_dir.mkdir(parents=True, exist_ok=True)
+        executor = PycodeExecutor()
+        namespaces = {}
+        executor.execute(self.prelude, working_dir, namespaces=namespaces)
+        executor.namespace('default')['Pick'] = picker
+        executor.execute(self.source, working_dir, namespaces=namespaces)
+        return executor.namespace('default')
+
+    def __call__(self, point: Namespace) -> dict:
+        picker = SweepPicker([vars(point)[k] for k in sorted(vars(point), key=_call_number)], serial=self.serial)
+        timed = self.timeout and hasattr(signal, 'SIGALRM')
+        if timed:
+            previous = signal.signal(signal.SIGALRM, _alarm)
+            signal.setitimer(signal.ITIMER_REAL, self.timeout)
+        start = time.perf_counter()
+        try:
+            names = self.run(picker)
+            error = _invalid_answer(names.get('AnsSet', None))
+            result = dict(status='invalid' if error else 'ok', error=error)
+        except _Excluded:
+            result = dict(status='excluded', error='')
+        except _Timeout:
+            result = dict(status='timeout', error=f'ran longer than {self.timeout} s')
+        except Exception as e:
+            # the executor's PycodeError is raised from the problem code's own
+            cause = e.__cause__ or e
+            result = dict(status='error', error=f'{type(cause).__name__}: {cause}'.strip())
+        finally:
+            seconds = time.perf_counter() - start
+            if timed:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, previous)
+        return result | dict(seconds=seconds)
+
+def _alarm(signum, frame):
+    raise _Timeout()
+
+def _call_number(name: str) -> int:
+    return int(name[len('pick'):])
+
+def _invalid_answer(answers) -> str:
+    # describes the first registered answer whose value is None or not finite
+    if answers is None:
+        return ''
+    for index, AL in answers.D.items():
+        for a in AL:
+            value = a.get('value', None)
+            if value is None:
+                return f'answer {index} ({a.get("label", "")}) is None'
+            if isinstance(value, numbers.Number) or isinstance(value, np.ndarray):
+                try:
+                    finite = np.all(np.isfinite(value))
+                except TypeError:
+                    continue
+                if not finite:
+                    return f'answer {index} ({a.get("label", "")}) is {value}'
+    return ''
+
+def problem_code(problem: str | Path, substitutions: dict) -> str:
+    """
+    Returns the LaTeX source of a problem (or, if it is a .py or .pycode
+    file, its code as a pycode environment) with its substitution slots
+    filled from substitutions
+    """
+    problem = Path(problem)
+    text = problem.read_text()
+    if problem.suffix in ('.py', '.pycode'):
+        text = f'\\begin{{pycode}}\n{text}\n\\end{{pycode}}\n'
+    missing = sorted(set(k for k in _KEY_RE.findall(text) if k not in substitutions))
+    if missing:
+        logger.warning(f'No values for substitution(s) {missing} in {problem.as_posix()}')
+    return _KEY_RE.sub(lambda m: str(substitutions.get(m.group(1), m.group(0))), text)
+
+def sweep_frame(stepper: Stepper, results: list[dict]) -> pd.DataFrame:
+    """
+    Returns one row per point of stepper: the value of each stepped entry
+    (named by its keys joined with '.', without the ``pick1.`` of a
+    problem that picks once), then the point's status, error and seconds
+    """
+    single = len(stepper.specs) == 1
+    columns = {}
+    for path, column in zip(stepper.paths, stepper.columns(0, stepper.size)):
+        columns['.'.join(str(k) for k in (path[1:] if single else path))] = list(column)
+    frame = pd.DataFrame(columns, index=range(len(results)))
+    for key in ['status', 'error', 'seconds']:
+        frame[key] = [r[key] for r in results]
+    return frame
+
+def regions(frame: pd.DataFrame, columns: list[str], bins: int = 10) -> dict[str, pd.DataFrame]:
+    """
+    Returns, for each of columns, the number of points and failed points
+    at each of its values (or, for a column of more than bins numerical
+    values, in each of bins equal ranges of them); points excluded by
+    constraints are not counted
+    """
+    considered = frame[frame['status'] != 'excluded']
+    failed = considered['status'].isin(FAILED)
+    tables = {}
+    for c in columns:
+        values = considered[c]
+        if pd.api.types.is_numeric_dtype(values) and values.nunique() > bins:
+            groups = pd.cut(values, bins)
+        elif pd.api.types.is_numeric_dtype(values):
+            groups = values
+        else:
+            groups = values.astype(str)
+        table = failed.groupby(groups, observed=True, sort=True).agg(['size', 'sum'])
+        table.columns = ['points', 'failed']
+        table['rate'] = table['failed'] / table['points']
+        tables[c] = table
+    return tables
+
+def failure_free(table: pd.DataFrame) -> tuple | None:
+    """
+    Returns the lower and upper ends of the widest run of consecutive
+    values (or ranges) of a regions() table where no point failed, or None
+    """
+    best, start = None, None
+    ok = list(table['failed'] == 0) + [False]
+    for i, free in enumerate(ok):
+        if free and start is None:
+            start = i
+        elif not free and start is not None:
+            if best is None or i - start > best[1] - best[0]:
+                best = (start, i)
+            start = None
+    if best is None:
+        return None
+    first, last = table.index[best[0]], table.index[best[1] - 1]
+    if isinstance(first, pd.Interval):
+        return first.left, last.right
+    return first, last
+
+def report(frame: pd.DataFrame, columns: list[str], bins: int = 10):
+    """
+    Logs how many points failed and how, where in the pick space they
+    failed, and how long the computation of a point takes
+    """
+    counts = frame['status'].value_counts()
+    logger.info(f'{len(frame)} point(s): ' + ', '.join(f'{counts.get(s, 0)} {s}' for s in ('ok',) + FAILED + ('excluded',)))
+    failed = frame[frame['status'].isin(FAILED)]
+    if len(failed):
+        logger.info('Most common errors:')
+        for error, n in failed['error'].value_counts().head(5).items():
+            logger.info(f'  {n:>6d}  {error}')
+        logger.info('Failures by value of each picked entry:')
+        for c, table in regions(frame, columns, bins).items():
+            if not table['failed'].any():
+                logger.info(f'  {c}: no failures')
+                continue
+            cells = ', '.join(f'{_label(value)}: {f}/{n}' for value, n, f in zip(table.index, table['points'], table['failed']))
+            logger.info(f'  {c}: {cells}')
+            if pd.api.types.is_numeric_dtype(frame[c]) and (span := failure_free(table)) is not None:
+                logger.info(f'    failure-free from {span[0]:g} to {span[1]:g}')
+    computed = frame[frame['status'] != 'excluded']
+    if len(computed):
+        seconds = computed['seconds']
+        slowest = computed.loc[seconds.idxmax()]
+        logger.info(f'Seconds per point: mean {seconds.mean():.4f}, median {seconds.median():.4f}, '
+                    f'95th percentile {seconds.quantile(0.95):.4f}, max {seconds.max():.4f} at '
+                    + ', '.join(f'{c}={_label(slowest[c])}' for c in columns))
+
+def _label(value) -> str:
+    if isinstance(value, pd.Interval):
+        return f'{"[" if value.closed_left else "("}{value.left:g}, {value.right:g}{"]" if value.closed_right else ")"}'
+    if isinstance(value, numbers.Real) and not isinstance(value, numbers.Integral):
+        return f'{value:g}'
+    return str(value)
+
+def validate(problem: str | Path, pythontex: list[str] = ['setup'], method: str = 'grid', samples: int = None,
+             seed: int = None, intervals: int = 10, jobs: int = None, timeout: float = 60.0,
+             serial: int = 1) -> pd.DataFrame:
+    """
+    Sweeps the pick space of a problem and runs its pycode at each point.
+    The problem's code is first run once, as for serial, to find the specs
+    of its pick_state calls; their entries are then stepped through by a
+    Stepper (method, samples, seed and intervals as for Stepper), and the
+    code is run again for each state, in jobs worker processes, after the
+    code of the pythontex files named in pythontex.  Returns one row per
+    point (see sweep_frame())
+    """
+    scratch = Path(tempfile.mkdtemp(prefix='pygacity-validate-'))
+    try:
+        substitutions = dict(serial=serial, pickle_cache=scratch.resolve().as_posix(), ordinal=None, idx=1, group=1, points=1)
+        prelude = ''
+        for name in pythontex:
+            ptpath = path_resolver(name, search_paths=[LatexCompoundBlock.pythontex_dir], ext='.pycode')
+            prelude += problem_code(ptpath, substitutions)
+        runner = PointRunner(prelude, problem_code(problem, substitutions), scratch, serial=serial, timeout=timeout)
+        picker = SweepPicker(serial=serial)
+        try:
+            runner.run(picker)
+        except Exception as e:
+            logger.warning(f'The code of {Path(problem).as_posix()} failed for serial {serial}: {e}')
+        if not picker.plans:
+            raise Exception(f'{Path(problem).as_posix()} picks no state; there is nothing to validate')
+        specs = {f'pick{i + 1}': plan.specs for i, plan in enumerate(picker.plans)}
+        stepper = Stepper(specs, method=method, samples=samples, seed=seed, intervals=intervals)
+        logger.info(f'Running {Path(problem).as_posix()} at {len(stepper)} point(s) over {len(stepper.paths)} picked entries')
+        # small chunks keep every worker busy when there are few points
+        chunk_size = max(1, min(64, len(stepper) // (4 * (jobs or os.cpu_count() or 1))))
+        return sweep_frame(stepper, stepper.map(runner, jobs=jobs, chunk_size=chunk_size))
+    finally:
+        rmtree(scratch, ignore_errors=True)
+
+def validate_subcommand(args):
+    frame = validate(args.problem, pythontex=args.pythontex, method=args.method, samples=args.samples,
+                     seed=args.seed, intervals=args.intervals, jobs=args.jobs, timeout=args.timeout,
+                     serial=args.serial)
+    columns = [c for c in frame.columns if c not in ('status', 'error', 'seconds')]
+    report(frame, columns, bins=args.bins)
+    output = args.output or Path(args.problem).stem + '-validation.csv'
+    frame.to_csv(output, index=False)
+    logger.info(f'Results of every point => {Path(output).as_posix()}')
@@ -2,10 +2,19 @@ import numpy as np
 from .compound import Compound
 from sandlerprops.properties import PropertiesDatabase
 
+_properties_database: PropertiesDatabase = None
+
+def properties_database() -> PropertiesDatabase:
+    """ Returns the property database, loading it on first use only """
+    global _properties_database
+    if _properties_database is None:
+        _properties_database = PropertiesDatabase()
+    return _properties_database
+
 class PureProperties:
 
     def __init__(self):
-        self.Properties = PropertiesDatabase()
+        self.Properties = properties_database()
     
     def report(self):
         self.Properties.show_properties()
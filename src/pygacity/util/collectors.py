@@ -240,6 +240,10 @@ class FileCollector(UserList):
             tgzpath = basepath.with_suffix('.tgz')
             with tarfile.open(tgzpath, 'w:gz') as tf:
                 for f in self.data:
+                    if not f.exists():
+                        # e.g., a file shared by several builds and already archived by one of them
+                        logger.debug(f'FileCollector.archive: path {f.as_posix()} does not exist.')
+                        continue
                     tf.add(f, arcname=f.name)
             logger.debug(f'generated tarball {tgzpath}')
             arcname = tgzpath
@@ -1,19 +1,102 @@
 # Author: Cameron F. Abrams, <cfa22@drexel.edu>
+from __future__ import annotations
+import asyncio
+import shlex
 import subprocess
 import logging
+import sys
+
+from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
 class Command:
-    def __init__(self, command, ignore_codes=[], **options):
-        self.command = command
+    """
+    An external command, given either as an argument list (preferred) or as a
+    single string that is split into one.  Output is streamed to the log a
+    line at a time as the command runs.
+
+    Attributes
+    ----------
+    argv: list[str]
+        the program and its arguments
+
+    ignore_codes: list[int]
+        nonzero return codes that do not count as failure
+
+    cwd, env:
+        working directory and environment of the command
+
+    timeout: float
+        seconds after which the command is killed (default: no limit)
+
+    capture: bool
+        if True, output is also collected and returned by run(), and kept
+        in stdout and stderr (even if the command fails)
+    """
+    # longest output line that can be read
+    line_limit: int = 1 << 20
+
+    def __init__(self, command: str | list, ignore_codes=[], cwd=None, env=None, timeout: float = None,
+                 capture: bool = True, **options):
+        if isinstance(command, str):
+            command = shlex.split(command, posix=not sys.platform.startswith('win'))
+        self.argv = [str(x) for x in command]
+        for k, v in options.items():
+            self.argv.extend([f'-{k}', str(v)])
         self.ignore_codes = ignore_codes
-        self.options = options
-        self.c = f'{self.command} ' + ' '.join([f'-{k} {v}' for k, v in self.options.items()])
-        
+        self.cwd = cwd
+        self.env = env
+        self.timeout = timeout
+        self.capture = capture
+        self.c = ' '.join(shlex.quote(x) for x in self.argv)
+        self.returncode: int = None
+        self.stdout: str = ''
+        self.stderr: str = ''
+
     def run(self):
-        process = subprocess.Popen(self.c, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        out, err = process.communicate()
+        """
+        Runs the command to completion; returns its (stdout, stderr)
+        """
+        return asyncio.run(self.run_async())
+
+    async def run_async(self, semaphore: asyncio.Semaphore = None):
+        """
+        Runs the command as a coroutine, waiting on semaphore (if given) for a
+        slot first; returns its (stdout, stderr)
+        """
+        if semaphore is None:
+            return await self._run()
+        async with semaphore:
+            return await self._run()
+
+    async def _run(self):
+        name = Path(self.argv[0]).stem
+        process = await asyncio.create_subprocess_exec(*self.argv, stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.PIPE,
+                                                       cwd=self.cwd, env=self.env, limit=self.line_limit)
+        out, err = [], []
+        try:
+            await asyncio.wait_for(asyncio.gather(self._stream(process.stdout, f'{name}> ', out),
+                                                  self._stream(process.stderr, f'{name}! ', err),
+                                                  process.wait()),
+                                   timeout=self.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise subprocess.TimeoutExpired(self.c, self.timeout)
+        self.returncode = process.returncode
+        self.stdout, self.stderr = ''.join(out), ''.join(err)
         if process.returncode != 0 and not process.returncode in self.ignore_codes:
             raise subprocess.SubprocessError(f'Command "{self.c}" failed with returncode {process.returncode}')
-        return out, err
\ No newline at end of file
+        return self.stdout, self.stderr
+
+    async def _stream(self, stream: asyncio.StreamReader, prefix: str, lines: list):
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            text = line.decode(errors='replace')
+            logger.debug(prefix + text.rstrip())
+            if self.capture:
+                lines.append(text)
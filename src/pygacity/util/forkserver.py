@@ -0,0 +1,183 @@
+# Author: Cameron F. Abrams, <cfa22@drexel.edu>
+"""
+A fork server for running pythontex's Python scripts in a warm interpreter.
+
+The server process imports the modules problem code uses (numpy, scipy,
+sandlersteam, the property databases, ...) once, then forks a child for
+each script it is asked to run.  pythontex is pointed at it with
+``--interpreter python:<client command>``; the client is a small process that
+passes its arguments, working directory, environment and standard streams to
+the server and exits with the script's return code.  If the server cannot be
+reached, the client runs the script in a fresh interpreter instead.
+"""
+from __future__ import annotations
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRELOAD = ['numpy', 'scipy.optimize', 'pandas', 'yaml', 'matplotlib.pyplot',
+                   'sandlersteam.state', 'sandlersteam.request', 'iapws', 'sandlerprops.properties',
+                   'pygacity.topics.chem.properties', 'pygacity.topics.chem.chemeqsystem',
+                   'pygacity.generate.answerset', 'pygacity.generate.pick', 'pygacity.util.texutils']
+
+class ForkServer:
+    """
+    Starts and stops a fork server process; use as a context manager
+
+    Attributes
+    ----------
+    socket_path: Path
+        the Unix socket the server listens on
+
+    preload: list[str]
+        modules imported by the server before it forks
+    """
+    def __init__(self, preload: list[str] = DEFAULT_PRELOAD):
+        self.preload = preload
+        self.socket_dir = Path(tempfile.mkdtemp(prefix='pygacity-fs-'))
+        self.socket_path = self.socket_dir / 'socket'
+        self.process: subprocess.Popen = None
+
+    @staticmethod
+    def available() -> bool:
+        return hasattr(os, 'fork') and hasattr(socket, 'send_fds')
+
+    def start(self):
+        self.process = subprocess.Popen([sys.executable, '-m', 'pygacity.util.forkserver', 'serve',
+                                         str(self.socket_path), str(os.getpid())] + self.preload,
+                                        stdout=subprocess.PIPE, text=True)
+        # the server says when it is listening
+        ready = self.process.stdout.readline().strip()
+        if ready != 'ready':
+            self.stop()
+            raise RuntimeError(f'Fork server failed to start')
+        logger.debug(f'Fork server (pid {self.process.pid}) listening on {self.socket_path.as_posix()}')
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+        if self.socket_dir.exists():
+            self.socket_dir.rmdir()
+
+    def interpreter_command(self) -> str:
+        """
+        Returns the command pythontex runs in place of the Python interpreter
+        """
+        return f'{sys.executable} -m pygacity.util.forkserver connect {self.socket_path.as_posix()}'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def _recv_exactly(conn: socket.socket, n: int) -> bytes:
+    data = b''
+    while len(data) < n:
+        chunk = conn.recv(n - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+def serve(socket_path: str, parent_pid: int, preload: list[str]):
+    import importlib
+    import signal
+    for name in preload:
+        try:
+            if name == 'matplotlib.pyplot':
+                import matplotlib
+                matplotlib.use('Agg')
+            importlib.import_module(name)
+        except Exception as e:
+            print(f'fork server: could not preload {name}: {e}', file=sys.stderr)
+    if 'pygacity.topics.chem.properties' in sys.modules:
+        # loads the property database once, for every child to inherit
+        sys.modules['pygacity.topics.chem.properties'].properties_database()
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen(64)
+    # if the build that started this server goes away, so does the server
+    listener.settimeout(1.0)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    print('ready', flush=True)
+    while True:
+        try:
+            conn, _ = listener.accept()
+        except socket.timeout:
+            if os.getppid() != parent_pid:
+                break
+            continue
+        if os.fork() == 0:
+            listener.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            _run_child(conn)
+        conn.close()
+    listener.close()
+
+def _run_child(conn: socket.socket):
+    import random
+    import runpy
+    import traceback
+    code = 1
+    try:
+        conn.settimeout(None)
+        msg, fds, _, _ = socket.recv_fds(conn, 8, 3)
+        request = json.loads(_recv_exactly(conn, int.from_bytes(msg, 'big')))
+        for i, fd in enumerate(fds):
+            os.dup2(fd, i)
+            os.close(fd)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.argv = request['argv']
+        sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[0])))
+        # children must not share the random state of their parent
+        random.seed()
+        if 'numpy' in sys.modules:
+            sys.modules['numpy'].random.seed()
+        try:
+            runpy.run_path(sys.argv[0], run_name='__main__')
+            code = 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                code = e.code or 0
+            else:
+                print(e.code, file=sys.stderr)
+        except BaseException:
+            traceback.print_exc()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        conn.sendall(int(code).to_bytes(4, 'big', signed=True))
+    finally:
+        os._exit(code)
+
+def connect(socket_path: str, argv: list[str]):
+    try:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(socket_path)
+    except OSError:
+        os.execv(sys.executable, [sys.executable] + argv)
+    payload = json.dumps(dict(argv=argv, cwd=os.getcwd(), env=dict(os.environ))).encode()
+    socket.send_fds(conn, [len(payload).to_bytes(8, 'big')], [0, 1, 2])
+    conn.sendall(payload)
+    status = _recv_exactly(conn, 4)
+    sys.exit(int.from_bytes(status, 'big', signed=True) if len(status) == 4 else 1)
+
+if __name__ == '__main__':
+    if sys.argv[1] == 'serve':
+        serve(sys.argv[2], int(sys.argv[3]), sys.argv[4:])
+    elif sys.argv[1] == 'connect':
+        connect(sys.argv[2], sys.argv[3:])
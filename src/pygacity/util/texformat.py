@@ -0,0 +1,137 @@
+# Author: Cameron F. Abrams, <cfa22@drexel.edu>
+from __future__ import annotations
+import hashlib
+import logging
+import os
+import re
+import subprocess
+
+from pathlib import Path
+
+from .command import Command
+from .stringthings import __pygacity_version__
+from .texlog import LatexLog
+from ..generate.document import Document
+
+logger = logging.getLogger(__name__)
+
+class PreambleFormat:
+    """
+    A pdflatex format into which a document's class, class options, and
+    preamble have been dumped (using mylatexformat), so that compiling any
+    document that shares them loads the format instead of reading the class
+    and every package it requires again.
+
+    Formats live in format_dir under a name derived from the hash of
+    everything that went into them (the header source, the class and style
+    files in the search directories, the pdflatex version and the pygacity
+    version), so a change to any of these yields a new format.
+
+    The autoprob class loads pythontex and hyperref only after the format
+    (see its pygacity@deferredpackages), so a header that uses either
+    package is not dumped, and neither is one whose dump reports errors.
+    """
+    # commands and package names of the packages autoprob loads after a format
+    DEFERRED_RE = re.compile(r'\\(?:hyper[A-Za-z]*|href|url|autoref|nameref|pdfbookmark|phantomsection|'
+                             r'(?:set|restart)?py[A-Za-z]*|pythontex[A-Za-z]*)(?![A-Za-z])|\b(?:hyperref|pythontex)\b')
+    def __init__(self, document: Document, format_dir: str | Path, pdflatex: str = 'pdflatex', searchdirs: list = []):
+        self.header = document.header_source()
+        self.format_dir = Path(format_dir)
+        self.pdflatex = pdflatex
+        self.searchdirs = searchdirs
+        self.key = self.compute_key()
+        self.name = f'pygacity-{self.key[:16]}'
+        self.path = self.format_dir / f'{self.name}.fmt'
+
+    def source(self) -> str:
+        """
+        Returns the source from which the format is dumped; the flag defined
+        first tells the autoprob class to leave out packages that cannot be
+        dumped
+        """
+        return r'\def\pygacitydumpingformat{}' + '\n' + self.header + r'\endofdump' + '\n'
+
+    def engine_version(self) -> str:
+        """
+        Returns the first line of ``pdflatex --version``; a format can only be
+        loaded by the engine that dumped it
+        """
+        try:
+            out = subprocess.run([self.pdflatex, '--version'], capture_output=True, text=True).stdout
+        except OSError:
+            return ''
+        return out.splitlines()[0] if out else ''
+
+    def compute_key(self) -> str:
+        h = hashlib.sha256()
+        h.update(__pygacity_version__.encode())
+        h.update(self.engine_version().encode())
+        h.update(self.source().encode())
+        for d in self.searchdirs:
+            for f in sorted(list(Path(d).glob('*.cls')) + list(Path(d).glob('*.sty'))):
+                h.update(f.name.encode())
+                h.update(f.read_bytes())
+        return h.hexdigest()
+
+    def deferred_use(self) -> str:
+        """
+        Returns the first use in the header (after the class line) of a
+        package autoprob loads after a format, or an empty string
+        """
+        preamble = self.header.split('\n', 1)[1] if '\n' in self.header else ''
+        m = self.DEFERRED_RE.search(preamble)
+        return m.group(0) if m else ''
+
+    def build(self) -> bool:
+        """
+        Dumps the format unless it already exists; returns True if the format
+        is available
+        """
+        deferred = self.deferred_use()
+        if deferred:
+            logger.info(f'The preamble uses {deferred}, which is loaded after a precompiled format; '
+                        f'compiling without one')
+            return False
+        if self.path.exists():
+            logger.debug(f'Using precompiled format {self.path.as_posix()}')
+            return True
+        self.format_dir.mkdir(parents=True, exist_ok=True)
+        source = self.format_dir / f'{self.name}.tex'
+        source.write_text(self.source())
+        env = os.environ.copy()
+        texinputs = [Path.cwd().as_posix()] + [str(d) for d in self.searchdirs]
+        env['TEXINPUTS'] = os.pathsep.join(texinputs + [env.get('TEXINPUTS', '')])
+        command = Command([self.pdflatex, '-ini', '-interaction=nonstopmode', '-file-line-error', f'-jobname={self.name}',
+                           '&pdflatex', 'mylatexformat.ltx', source.name],
+                          ignore_codes=[1], cwd=self.format_dir, env=env, capture=False)
+        try:
+            logger.debug(f'Running command: {command.c}')
+            command.run()
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.debug(f'{e}')
+        log = LatexLog(self.format_dir / f'{self.name}.log')
+        if self.path.exists() and (log.errors or log.fatal):
+            # nonstopmode writes a format even past errors; it is not used
+            logger.warning(f'Dumping a precompiled format for the preamble failed: '
+                           f'{log.first_error() or "fatal error"}')
+            self.path.unlink()
+        if not self.path.exists():
+            logger.warning(f'Could not dump a precompiled format for the preamble '
+                           f'(see {self.format_dir.as_posix()}/{self.name}.log); compiling without one')
+            return False
+        logger.info(f'Dumped precompiled format {self.path.as_posix()}')
+        return True
+
+    @staticmethod
+    def prune(format_dir: str | Path, keep: list[str | Path]):
+        """
+        Removes the files of formats in format_dir other than those in keep
+        """
+        format_dir = Path(format_dir)
+        if not format_dir.is_dir():
+            return
+        live = set(Path(x).stem for x in keep)
+        for f in format_dir.iterdir():
+            if f.is_file() and f.stem not in live:
+                f.unlink()
+                logger.debug(f'Removed stale format file {f.name}')
@@ -0,0 +1,120 @@
+# Author: Cameron F. Abrams, <cfa22@drexel.edu>
+from __future__ import annotations
+import hashlib
+import logging
+import re
+
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+class LatexLog:
+    """
+    Parses a pdflatex log file for the information needed to decide whether
+    another pass is needed and whether the pass failed
+
+    Attributes
+    ----------
+    rerun_messages: list[str]
+        log lines asking for another LaTeX pass
+
+    errors: list[tuple[str, int, str]]
+        (file, line, message) for each error reported in -file-line-error form
+
+    fatal: bool
+        True if TeX stopped without producing output
+    """
+    RERUN_RE = re.compile(r'(Rerun to get .*|Label\(s\) may have changed.*|'
+                          r'Table widths have changed\. Rerun LaTeX.*|'
+                          r'\(rerunfilecheck\).*has changed.*|Please rerun LaTeX.*)')
+    ERROR_RE = re.compile(r'^(.+?\.(?:tex|sty|cls|cfg|def|clo|aux|pytxmcr)):(\d+): (.*)$', re.MULTILINE)
+    FATAL_RE = re.compile(r'(Fatal error occurred|Emergency stop|==> Fatal error|no output PDF file produced)')
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.text = ''
+        if self.path.exists():
+            self.text = self.path.read_text(encoding='utf-8', errors='replace')
+        self.rerun_messages: list[str] = self.RERUN_RE.findall(self.text)
+        self.errors: list[tuple[str, int, str]] = [(f, int(l), m.strip()) for f, l, m in self.ERROR_RE.findall(self.text)]
+        self.fatal: bool = self.FATAL_RE.search(self.text) is not None
+
+    @property
+    def needs_rerun(self) -> bool:
+        return len(self.rerun_messages) > 0
+
+    def first_error(self) -> str:
+        """
+        Returns the first error in the log with its location and the log's
+        context line (``l.<n> ...``) if any, or an empty string
+        """
+        if not self.errors:
+            return ''
+        f, l, m = self.errors[0]
+        msg = f'{f}:{l}: {m}'
+        context = re.search(rf'^l\.{l} (.*)$', self.text, re.MULTILINE)
+        if context:
+            msg += f' (at "{context.group(1).strip()}")'
+        return msg
+
+# aux-file lines that record labels, table-of-contents entries and citations;
+# if these change between passes, references may not yet be resolved
+AUX_LABEL_RE = re.compile(r'^\\(?:newlabel|@writefile|bibcite|new@label).*$', re.MULTILINE)
+
+def aux_labels(path: str | Path) -> set[str]:
+    path = Path(path)
+    if not path.exists():
+        return set()
+    return set(AUX_LABEL_RE.findall(path.read_text(encoding='utf-8', errors='replace')))
+
+def tree_digest(path: str | Path) -> str:
+    """
+    Returns a hash of the names and contents of every file under path (or of
+    path itself, if it is a file); empty if path does not exist
+    """
+    path = Path(path)
+    if not path.exists():
+        return ''
+    h = hashlib.sha256()
+    files = [path] if path.is_file() else sorted(p for p in path.rglob('*') if p.is_file())
+    for f in files:
+        h.update(f.relative_to(path).as_posix().encode() if f != path else f.name.encode())
+        h.update(f.read_bytes())
+    return h.hexdigest()
+
+# header lines of a .pytxcode file end with the line of the source the code
+# came from, which says nothing about what the code does
+PYTXCODE_LINENO_RE = re.compile(r'^(=>PYTHONTEX#.*#)\d+#$', re.MULTILINE)
+
+def pytxcode_signature(path: str | Path, job_name: str) -> str:
+    """
+    Returns a hash of the code pythontex would run for the .pytxcode file at
+    path, independent of the job name and of source line numbers; two
+    documents with the same signature get the same pythontex output.  Empty
+    if path does not exist.
+    """
+    path = Path(path)
+    if not path.exists():
+        return ''
+    text = path.read_text(encoding='utf-8', errors='replace')
+    text = PYTXCODE_LINENO_RE.sub(r'\1#', text).replace(job_name, '<jobname>')
+    return hashlib.sha256(text.encode()).hexdigest()
+
+# pythontex reports each error with the line of the TeX source the failing
+# code came from, followed by the interpreter's traceback
+PYTHONTEX_ERROR_RE = re.compile(r'^\* PythonTeX stderr - error on line (\d+):\n((?:(?!\* |-{10}).*\n?)*)', re.MULTILINE)
+PYTHONTEX_SUMMARY_RE = re.compile(r'PythonTeX:\s+\S+ - (\d+) error\(s\)')
+
+def pythontex_errors(output: str) -> list[str]:
+    """
+    Returns a message for each error pythontex reported in output: the
+    source line and the last line of the traceback (the exception)
+    """
+    errors = []
+    for line, traceback in PYTHONTEX_ERROR_RE.findall(output):
+        lines = [x.strip() for x in traceback.splitlines() if x.strip()]
+        errors.append(f'line {line}: {lines[-1] if lines else "error"}')
+    summary = PYTHONTEX_SUMMARY_RE.search(output)
+    if not errors and summary and int(summary.group(1)) > 0:
+        errors.append(f'{summary.group(1)} error(s) reported')
+    return errors
@@ -1,15 +1,75 @@
 # Author: Cameron F. Abrams, <cfa22@drexel.edu>
 from __future__ import annotations
+import asyncio
 import fractions as fr
 import numpy as np
 import pandas as pd
 import logging
+import os
+
+from pathlib import Path
+from shutil import copy2, copytree
 
 from .command import Command
 from .collectors import FileCollector
+from .texlog import LatexLog, aux_labels, pytxcode_signature, tree_digest
 from ..generate.document import Document
+from ..generate.pycode import PycodeExecutor
 logger = logging.getLogger(__name__)
 
+class SharedPythontex:
+    """
+    Lets the documents of one serial (e.g., the exam and its solution) share
+    a single pythontex run.  The first builder to reach its pythontex step
+    runs pythontex; any other builder waits for it and, if the code in its own
+    .pytxcode file is the same, copies that builder's pythontex output and the
+    files its pycode wrote instead of running pythontex itself.  Documents
+    whose code differs (e.g., pythontex commands appear inside
+    \\ifshowsolutions) run pythontex as usual.
+    """
+    def __init__(self):
+        self.done = asyncio.Event()
+        self.provider: LatexBuilder = None
+        self.signature = ''
+        self.created: list[Path] = []
+
+    async def run(self, builder: LatexBuilder, semaphore: asyncio.Semaphore = None):
+        if self.provider is None:
+            self.provider = builder
+            try:
+                before = set(builder.working_dir.iterdir())
+                self.signature = pytxcode_signature(builder.working_dir / f'{builder.working_job_name}.pytxcode',
+                                                    builder.working_job_name)
+                await builder.run_async(builder.pythontex_command(), semaphore)
+                self.created = [p for p in builder.working_dir.iterdir() if p not in before]
+            finally:
+                self.done.set()
+            return
+        await self.done.wait()
+        signature = pytxcode_signature(builder.working_dir / f'{builder.working_job_name}.pytxcode',
+                                       builder.working_job_name)
+        if not self.signature or signature != self.signature:
+            logger.debug(f'{builder.working_job_name}: pythontex code differs from {self.provider.working_job_name}\'s; running pythontex')
+            await builder.run_async(builder.pythontex_command(), semaphore)
+            return
+        self.copy_output(builder)
+        builder.pythontex_output = self.provider.pythontex_output
+        logger.debug(f'{builder.working_job_name}: reused pythontex output of {self.provider.working_job_name}')
+
+    def copy_output(self, builder: LatexBuilder):
+        source_job, job = self.provider.working_job_name, builder.working_job_name
+        for p in self.created:
+            if p.name == f'pythontex-files-{source_job}':
+                dest = builder.working_dir / f'pythontex-files-{job}'
+                copytree(p, dest, dirs_exist_ok=True)
+                # pythontex names its macro and style files after the job
+                for f in list(dest.glob(f'{source_job}.*')):
+                    f.replace(dest / (job + f.name[len(source_job):]))
+            elif p.is_dir():
+                copytree(p, builder.working_dir / p.name, dirs_exist_ok=True)
+            elif p.is_file():
+                copy2(p, builder.working_dir / p.name)
+
 class LatexBuilder:
     def __init__(self, build_specs: dict, searchdirs: list = []):
         self.specs = build_specs
@@ -18,53 +78,170 @@ class LatexBuilder:
         self.searchdirs = searchdirs
         
         self.output_dir = self.specs.get('paths', {}).get('build-dir', '.')
+        self.working_dir = Path(self.output_dir)
         self.job_name = self.specs.get('job-name', 'document')
         self.working_job_name = self.job_name
         # self.output_name_stem = self.specs.get('output-name', 'document')
         self.FC = FileCollector()
+        # a precompiled format (see texformat.PreambleFormat) holding the document header, if any
+        self.format: Path = None
+        # command pythontex runs in place of the Python interpreter (e.g., a fork server client), if any
+        self.interpreter: str = None
+        # runs pycode in this process instead of pythontex, if set
+        self.executor: PycodeExecutor = None
+        # what pythontex printed the last time it ran for this builder
+        self.pythontex_output: str = ''
         # logger.debug(f'localdirs {self.localdirs}')
 
-    def build_commands(self, document: Document = None):
-        commands = []
-        serial = document.substitutions.get('serial', 0)
-        self.working_job_name = self.job_name
+    def texinputs_env(self) -> dict:
+        """
+        Returns a copy of the environment in which TeX also searches the directory
+        pygacity was launched from and the builder's search directories, since
+        compilation happens in the working directory
+        """
+        env = os.environ.copy()
+        texinputs = [Path.cwd().as_posix()] + [str(d) for d in self.searchdirs]
+        # a trailing separator tells kpathsea to append the default search path
+        env['TEXINPUTS'] = os.pathsep.join(texinputs + [env.get('TEXINPUTS', '')])
+        if self.format:
+            env['TEXFORMATS'] = os.pathsep.join([Path(self.format).parent.resolve().as_posix(), env.get('TEXFORMATS', '')])
+        return env
+
+    def working_job_name_for(self, serial) -> str:
         if isinstance(serial, int) and serial > 0:
-            self.working_job_name = self.job_name + f'-{serial}'
-        document.write_source(local_output_name=self.working_job_name)
-        includedirs = ''
-        for d in self.searchdirs:
-            includedirs = includedirs + ' -include-directory=' + str(d)
-        logger.debug(f'includedirs {includedirs}')
-        has_pycode = document.has_pycode
-        output_option = ''
-        if self.output_dir != '.':
-            output_option = f'-output-directory={self.output_dir}'
-
-        repeated_command = (f'{self.pdflatex} -interaction=nonstopmode -file-line-error '
-                                f'-jobname={self.working_job_name} {includedirs} '
-                                f'{output_option} {self.working_job_name}.tex')
-        commands.append(Command(repeated_command, ignore_codes=[1]))
-
-        self.FC.append(f'{self.output_dir}/{self.working_job_name}.aux')
-        self.FC.append(f'{self.output_dir}/{self.working_job_name}.log')
-        self.FC.append(f'{self.output_dir}/{self.working_job_name}.out')
-        self.FC.append(f'{self.output_dir}/{self.working_job_name}.pytxcode')
-        if has_pycode:
-            self.FC.append(f'{self.output_dir}/pythontex-files-{self.working_job_name}')
-            self.FC.append(f'{self.output_dir}/pythontex-{serial}.log')
-            # don't know if this will work
-            commands.append(Command(f'{self.pythontex} {self.output_dir}/{self.working_job_name}'))
-
-        commands.append(Command(repeated_command, ignore_codes=[1]))
-        return commands
-
-    def build_document(self, document=None, cleanup=False):
-        commands = self.build_commands(document)
-        for c in commands:
-            logger.debug(f'Running command: {c.c}')
-            out, err = c.run()
-            logger.debug(f'Command output:\n{out}\n\n')
-            logger.debug(f'Command error:\n{err}\n\n')
+            return self.job_name + f'-{serial}'
+        return self.job_name
+
+    def prepare(self, document: Document = None, working_dir: str | Path = None):
+        """
+        Writes the source of document into working_dir (default: the build
+        directory) and registers the files its compilation will generate
+        """
+        serial = document.substitutions.get('serial', 0)
+        self.working_job_name = self.working_job_name_for(serial)
+        self.working_dir = Path(working_dir) if working_dir else Path(self.output_dir)
+        self.working_dir.mkdir(parents=True, exist_ok=True)
+        self.has_pycode = document.has_pycode
+        source = document.source(precompiled=self.format is not None)
+        if self.has_pycode and self.executor:
+            if self.executor.supports(source):
+                # pdflatex gets a source with the code already run, so pythontex is not needed
+                source = self.executor.expand(source, working_dir=self.working_dir)
+                self.has_pycode = False
+            else:
+                logger.info(f'{self.working_job_name} uses pythontex features the pycode executor does not support; using pythontex')
+        with open(self.working_dir / f'{self.working_job_name}.tex', 'w') as f:
+            f.write(source)
+        self.env = self.texinputs_env()
+
+        self.FC.append(self.working_dir / f'{self.working_job_name}.aux')
+        self.FC.append(self.working_dir / f'{self.working_job_name}.log')
+        self.FC.append(self.working_dir / f'{self.working_job_name}.out')
+        self.FC.append(self.working_dir / f'{self.working_job_name}.pytxcode')
+        if self.has_pycode:
+            self.FC.append(self.working_dir / f'pythontex-files-{self.working_job_name}')
+            self.FC.append(self.working_dir / f'pythontex-{serial}.log')
+
+    def pdflatex_command(self, draft: bool = False) -> Command:
+        """
+        Returns the pdflatex command for one pass; a draft pass writes the aux
+        and pytxcode files but no PDF
+        """
+        includedirs = [f'-include-directory={d}' for d in self.searchdirs]
+        draftmode = ['-draftmode'] if draft else []
+        fmt = [f'-fmt={Path(self.format).stem}'] if self.format else []
+        # all commands run inside the working directory, so every file TeX and
+        # pythontex generate lands there rather than in the current directory
+        argv = ([self.pdflatex, '-interaction=nonstopmode', '-file-line-error'] + draftmode + fmt +
+                [f'-jobname={self.working_job_name}'] + includedirs + [f'{self.working_job_name}.tex'])
+        return Command(argv, ignore_codes=[1], cwd=self.working_dir, env=self.env,
+                       timeout=self.specs.get('command-timeout', None), capture=False)
+
+    def pythontex_command(self) -> Command:
+        interpreter = ['--interpreter', f'python:{self.interpreter}'] if self.interpreter else []
+        return Command([self.pythontex] + interpreter + [self.working_job_name], cwd=self.working_dir, env=self.env,
+                       timeout=self.specs.get('command-timeout', None))
+
+    def run(self, command: Command):
+        logger.debug(f'Running command: {command.c}')
+        command.run()
+
+    async def run_async(self, command: Command, semaphore: asyncio.Semaphore = None):
+        logger.debug(f'Running command: {command.c}')
+        try:
+            await command.run_async(semaphore=semaphore)
+        finally:
+            if command.argv[0] == self.pythontex:
+                self.pythontex_output = command.stdout + command.stderr
+
+    def build_document(self, document=None, working_dir: str | Path = None, cleanup=False):
+        """
+        Compiles document; see build_document_async
+        """
+        asyncio.run(self.build_document_async(document, working_dir=working_dir, cleanup=cleanup))
+
+    async def build_document_async(self, document=None, working_dir: str | Path = None, cleanup=False,
+                                   semaphore: asyncio.Semaphore = None, shared_pythontex: SharedPythontex = None):
+        """
+        Compiles document in working_dir (default: the build directory); if
+        that is a separate scratch directory, the resulting PDF is copied
+        back to the build directory.
+
+        Passes are planned from the log and aux files rather than fixed: a
+        first pass whose PDF will be replaced once pythontex has run is made
+        in draft mode, and further passes are made only while pythontex
+        output, labels, or rerun warnings say the document has changed.
+
+        Each command waits on semaphore (if given), so that builders sharing
+        it can compile concurrently with a bounded number of processes.  If
+        shared_pythontex is given, this document may reuse the pythontex
+        output of another document built with the same SharedPythontex.
+        """
+        self.prepare(document, working_dir=working_dir)
+        self.pythontex_output = ''
+        job = self.working_dir / self.working_job_name
+        pythontex_dir = self.working_dir / f'pythontex-files-{self.working_job_name}'
+        max_passes = self.specs.get('max-passes', 5)
+        # pythontex output left by an earlier build means the first pass may already be the last
+        warm = self.has_pycode and pythontex_dir.exists()
+        draft = self.has_pycode and not warm and self.specs.get('draftmode', True)
+        labels = aux_labels(job.with_suffix('.aux'))
+        await self.run_async(self.pdflatex_command(draft=draft), semaphore)
+        passes = 1
+        stale = draft or (self.has_pycode and not warm)
+        if self.has_pycode:
+            before = tree_digest(pythontex_dir)
+            if shared_pythontex:
+                await shared_pythontex.run(self, semaphore)
+            else:
+                await self.run_async(self.pythontex_command(), semaphore)
+            stale = stale or tree_digest(pythontex_dir) != before
+        while True:
+            new_labels = aux_labels(job.with_suffix('.aux'))
+            log = LatexLog(job.with_suffix('.log'))
+            reasons = []
+            if stale:
+                reasons.append('pythontex output or draft pass')
+            if new_labels != labels:
+                reasons.append('labels changed')
+            if log.needs_rerun:
+                reasons.append(log.rerun_messages[0])
+            if not reasons:
+                break
+            if passes >= max_passes:
+                logger.warning(f'{self.working_job_name}: still changing after {passes} passes ({", ".join(reasons)})')
+                break
+            logger.debug(f'{self.working_job_name}: pass {passes + 1} needed ({", ".join(reasons)})')
+            labels = new_labels
+            stale = False
+            await self.run_async(self.pdflatex_command(), semaphore)
+            passes += 1
+        logger.debug(f'{self.working_job_name}: {passes} pdflatex pass(es)')
+        pdf = job.with_suffix('.pdf')
+        output_dir = Path(self.output_dir)
+        if pdf.exists() and self.working_dir.resolve() != output_dir.resolve():
+            output_dir.mkdir(parents=True, exist_ok=True)
+            copy2(pdf, output_dir / pdf.name)
         if cleanup:            
             self.FC.flush()
 
@@ -1,3 +1,4 @@
+import io
 import unittest
 import os
 import random
@@ -87,3 +88,38 @@ class AnswerSuperSetTests(unittest.TestCase):
             os.remove(f)
         self.assertEqual(len(S), 10)
         logger.debug(S.to_latex())
+
+    def test_superset_columns(self):
+        sets = []
+        for s in [30, 10, 20]:
+            A = AnswerSet(s)
+            A.register('q1', label='a', value='T', group=1)
+            A.register('q2', label='E', units='kJ', value=s / 10, formatter='{:.1f}', group=2)
+            A.register('q2', label='n', value=s, group=2)
+            sets.append(A)
+        S = AnswerSuperSet(sets)
+        self.assertEqual(list(S.groups.keys()), [1, 2])
+        df = S.groups[2]['df']
+        self.assertEqual(list(df.columns), ['serials', '2-E (kJ)', '2-n'])
+        self.assertEqual(list(df['serials']), [10, 20, 30])
+        self.assertEqual(list(df['2-n']), [10, 20, 30])
+        self.assertEqual(df['2-E (kJ)'].dtype.kind, 'f')
+        self.assertEqual(S.groups[2]['formatters']['2-E (kJ)'], '{:.1f}')
+        B = AnswerSet(40)
+        B.register('q1', label='a', value='F', group=1)
+        self.assertNotEqual(AnswerSuperSet.structure(B), AnswerSuperSet.structure(sets[0]))
+
+    def test_superset_write_latex(self):
+        sets = []
+        for s in range(100, 125):
+            A = AnswerSet(s)
+            A.register(1, label='x', value=float(s), formatter='{:.1f}')
+            A.register(2, label='y', value=s)
+            sets.append(A)
+        S = AnswerSuperSet(sets)
+        f = io.StringIO()
+        S.write_latex(f, rows_per_table=10)
+        self.assertEqual(f.getvalue().count(r'\begin{longtable}'), 3)
+        self.assertEqual(S.to_latex().count(r'\begin{longtable}'), 1)
+        for s in range(100, 125):
+            self.assertIn(f'{s} & {s}.0 & {s}', f.getvalue())
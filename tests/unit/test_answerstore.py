@@ -0,0 +1,110 @@
+import pickle
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from shutil import rmtree
+
+from pygacity.generate.answerset import AnswerSet
+from pygacity.generate.answerstore import AnswerStore
+from pygacity.generate.build import _answers_serial
+
+def make_answerset(serial):
+    A = AnswerSet(serial)
+    A.register(3.1, label='$V$', units='m$^3$', value=serial / 10, formatter='{:.2f}', group=1)
+    A.register(3.1, label='TF', value=bool(serial % 2), group=1)
+    A.register('2a', label='X', value=[serial, 'x'])
+    return A
+
+def put_answerset(path, serial):
+    with AnswerStore(path) as store:
+        store.put(make_answerset(serial))
+
+class AnswerStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = Path('answerstore_test')
+        self.dir.mkdir(exist_ok=True)
+        self.path = self.dir / AnswerStore.name
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def test_put_get(self):
+        with AnswerStore(self.path) as store:
+            store.put(make_answerset(7))
+            A = store.get(7)
+            self.assertEqual(A.D, make_answerset(7).D)
+            self.assertEqual(list(A.D.keys()), [3.1, '2a'])
+            self.assertIsNone(store.get(8))
+            # a serial's answers are replaced whole
+            B = AnswerSet(7)
+            B.register(1, label='Y', value=1.0)
+            store.put(B)
+            self.assertEqual(store.get(7).D, B.D)
+
+    def test_concurrent_put(self):
+        serials = list(range(100, 140))
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            list(executor.map(put_answerset, [self.path] * len(serials), serials))
+        with AnswerStore(self.path) as store:
+            self.assertEqual(store.serials(), serials)
+            subset = store.answersets([139, 101])
+            self.assertEqual([A.serial for A in subset], [101, 139])
+            self.assertEqual(subset[1].D, make_answerset(139).D)
+            store.retain(serials[:10])
+            self.assertEqual(store.serials(), serials[:10])
+
+    def test_remove(self):
+        with AnswerStore(self.path) as store:
+            for serial in [1, 2, 3]:
+                store.put(make_answerset(serial))
+            store.remove([1, 3])
+            self.assertEqual(store.serials(), [2])
+            self.assertEqual(list(store.variants()), [2])
+
+    def test_rebuild_without_answers(self):
+        # a serial whose pycode no longer pickles answers keeps none from an earlier build
+        with AnswerStore(self.path) as store:
+            store.put(make_answerset(5))
+        specs = {'class': {'classname': 'autoprob', 'options': []},
+                 'structure': [{'text': r'\begin{document}'}, {'text': r'\end{document}'}]}
+        _answers_serial(specs, 5, self.dir / 'scratch', self.dir)
+        with AnswerStore(self.path) as store:
+            self.assertIsNone(store.get(5))
+            self.assertEqual(store.serials(), [])
+
+    def test_ingest(self):
+        pfile = self.dir / 'answers-5.pkl'
+        pfile.write_bytes(pickle.dumps(make_answerset(5)))
+        with AnswerStore(self.path) as store:
+            self.assertEqual(store.ingest(pfile), 5)
+            self.assertFalse(pfile.exists())
+            self.assertEqual(store.get(5).D, make_answerset(5).D)
+
+    def test_digests(self):
+        with AnswerStore(self.path) as store:
+            for serial in [1, 2, 3]:
+                A = AnswerSet(serial)
+                A.register(1, label='x', value=1.0 if serial < 3 else 2.0)
+                A.picks = 'p' if serial != 2 else 'q'
+                store.put(A)
+            self.assertEqual(store.get(2).picks, 'q')
+            digests = store.digests()
+            self.assertEqual(len(set(digests.values())), 3)
+            B = AnswerSet(2)
+            B.register(1, label='x', value=1.0)
+            B.picks = 'p'
+            store.put(B)
+            digests = store.digests()
+            self.assertEqual(digests[1], digests[2])
+            self.assertNotEqual(digests[1], digests[3])
+
+    def test_variants(self):
+        with AnswerStore(self.path) as store:
+            for serial, variants in [(1, 12), (2, None), (3, 10**30)]:
+                A = make_answerset(serial)
+                A.variants = variants
+                store.put(A)
+            self.assertEqual(store.variants(), {1: 12, 2: None, 3: 10**30})
+            self.assertEqual(store.variants([1]), {1: 12})
+            self.assertEqual(store.get(3).variants, 10**30)
@@ -0,0 +1,74 @@
+import unittest
+from pathlib import Path
+from shutil import rmtree
+
+from pygacity.generate.buildcache import BuildCache, visible_source
+
+class VisibleSourceTest(unittest.TestCase):
+
+    def test_visible_source_strips_hidden_branch(self):
+        src = r'A \ifshowsolutions SOL \ifnum1=1 x\else y\fi\else NOSOL\fi B'
+        self.assertEqual(visible_source(src, showsolutions=False), r'A  NOSOL B')
+        self.assertEqual(visible_source(src, showsolutions=True), r'A  SOL \ifnum1=1 x\else y\fi B')
+
+    def test_visible_source_keeps_pycode(self):
+        src = r'\begin{pycode}' + '\n' + r"print(r'\ifshowsolutions')" + '\n' + r'\end{pycode}\ifshowsolutions S\fi'
+        self.assertIn(r"print(r'\ifshowsolutions')", visible_source(src, showsolutions=False))
+        self.assertNotIn(' S', visible_source(src, showsolutions=False))
+
+    def test_visible_source_unbalanced(self):
+        src = r'$a \iff b$ \ifshowsolutions x'
+        self.assertEqual(visible_source(src, showsolutions=False), src)
+
+class BuildCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = Path('buildcache_test')
+        if self.root.exists():
+            rmtree(self.root)
+        self.root.mkdir()
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def test_key(self):
+        self.assertEqual(BuildCache.key('abc'), BuildCache.key('abc'))
+        self.assertNotEqual(BuildCache.key('abc'), BuildCache.key('abd'))
+
+    def test_store_lookup_restore(self):
+        pdf = self.root / 'doc.pdf'
+        pdf.write_text('pdf')
+        C = BuildCache(self.root / '.cache')
+        key = BuildCache.key('source')
+        self.assertIsNone(C.lookup('base', 1234, key))
+        C.store(key, {'document.pdf': pdf, 'answers.pkl': self.root / 'missing.pkl'})
+        C.record('base', 1234, key, ['document.pdf'])
+        C.save()
+        C = BuildCache(self.root / '.cache')
+        entry_dir = C.lookup('base', 1234, key)
+        self.assertIsNotNone(entry_dir)
+        self.assertIsNone(C.lookup('base', 1234, BuildCache.key('other source')))
+        restored = BuildCache.restore(entry_dir, {'document.pdf': self.root / 'restored.pdf',
+                                                  'answers.pkl': self.root / 'answers.pkl'})
+        self.assertEqual(restored, [self.root / 'restored.pdf'])
+        self.assertEqual((self.root / 'restored.pdf').read_text(), 'pdf')
+
+    def test_pythontex_save_restore(self):
+        work = self.root / 'work'
+        (work / 'pythontex-files-ExamI-1').mkdir(parents=True)
+        (work / 'pythontex-files-ExamI-1' / 'ExamI-1.pytxmcr').write_text('macros')
+        (work / 'plot-1.png').write_text('png')
+        pickles = self.root / 'pickles'
+        pickles.mkdir()
+        (pickles / 'answers-1.pkl').write_text('answers')
+        C = BuildCache(self.root / '.cache')
+        self.assertFalse(C.restore_pythontex('ExamI-1', self.root / 'new', pickles))
+        C.save_pythontex('ExamI-1', work, ['plot-1.png'], [pickles / 'answers-1.pkl', pickles / 'pythontex-1.pkl'])
+        (pickles / 'answers-1.pkl').unlink()
+        self.assertTrue(C.restore_pythontex('ExamI-1', self.root / 'new', pickles))
+        self.assertEqual((self.root / 'new' / 'pythontex-files-ExamI-1' / 'ExamI-1.pytxmcr').read_text(), 'macros')
+        self.assertEqual((self.root / 'new' / 'plot-1.png').read_text(), 'png')
+        self.assertEqual((pickles / 'answers-1.pkl').read_text(), 'answers')
+        self.assertFalse((pickles / 'pythontex-1.pkl').exists())
+        C.prune_pythontex(['ExamI-2'])
+        self.assertFalse(C.restore_pythontex('ExamI-1', self.root / 'new', pickles))
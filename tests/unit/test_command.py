@@ -0,0 +1,44 @@
+import asyncio
+import subprocess
+import sys
+import unittest
+
+from pygacity.util.command import Command
+
+class CommandTest(unittest.TestCase):
+
+    def test_run_argv(self):
+        C = Command([sys.executable, '-c', 'import sys; print("one"); print("two"); print("err", file=sys.stderr)'])
+        with self.assertLogs('pygacity.util.command', level='DEBUG') as cm:
+            out, err = C.run()
+        self.assertEqual(out, 'one\ntwo\n')
+        self.assertEqual(err, 'err\n')
+        self.assertEqual(C.returncode, 0)
+        self.assertEqual(sum('one' in line for line in cm.output), 1)
+
+    def test_run_string(self):
+        C = Command(f'"{sys.executable}" -c "print(42)"')
+        out, err = C.run()
+        self.assertEqual(out.strip(), '42')
+
+    def test_returncodes(self):
+        script = 'import sys; sys.exit(1)'
+        out, err = Command([sys.executable, '-c', script], ignore_codes=[1]).run()
+        self.assertEqual(out, '')
+        C = Command([sys.executable, '-c', 'import sys; print("oops", file=sys.stderr); sys.exit(1)'])
+        with self.assertRaises(subprocess.SubprocessError):
+            C.run()
+        self.assertEqual(C.returncode, 1)
+        self.assertEqual(C.stderr.strip(), 'oops')
+
+    def test_timeout(self):
+        with self.assertRaises(subprocess.TimeoutExpired):
+            Command([sys.executable, '-c', 'import time; time.sleep(10)'], timeout=0.5).run()
+
+    def test_concurrent(self):
+        async def run_all():
+            semaphore = asyncio.Semaphore(2)
+            commands = [Command([sys.executable, '-c', f'print({i})']) for i in range(4)]
+            return await asyncio.gather(*[c.run_async(semaphore=semaphore) for c in commands])
+        results = asyncio.run(run_all())
+        self.assertEqual([out.strip() for out, err in results], ['0', '1', '2', '3'])
@@ -1,7 +1,9 @@
+import os
 import unittest
 import yaml
 
 from importlib.resources import files
+from pathlib import Path
 
 from pygacity.generate.document import Document
 
@@ -36,3 +38,61 @@ class DocumentTest(unittest.TestCase):
             specs = yaml.safe_load(f)
         D = Document(specs)
         
+
+    def test_document_substitutions(self):
+        specs = {'substitutions': {'course': 'CHE 101'},
+                 'structure': [{'text': r'<<<course>>>: serial <<<serial>>> <<<unknown>>>'},
+                               {'enumerate': [{'text': r'<<<course>>> (<<<points>>> points) <<<serial>>>', 'points': 5,
+                                               'substitutions': {'course': 'CHE 102'}}]}]}
+        D = Document(specs)
+        for serial in [1, 22]:
+            D.make_substitutions(dict(serial=serial))
+            self.assertEqual(D.blocks[0].processedcontents, f'CHE 101: serial {serial} <<<unknown>>>')
+            self.assertEqual(D.blocks[1].children[0].processedcontents, f'CHE 102 (5 points) {serial}')
+        D.substitutions['course'] = None
+        with self.assertRaises(KeyError):
+            D.make_substitutions(dict(serial=3))
+
+    def test_document_stray_delimiter(self):
+        D = Document({'structure': [{'text': r'$a <<< b$, <<<<serial>>>> and <<<serial>>>'}]})
+        D.make_substitutions(dict(serial=7))
+        self.assertEqual(D.blocks[0].processedcontents, r'$a <<< b$, <7> and 7')
+
+    def test_document_shared_sources(self):
+        source = Path('shared_source_test.tex')
+        source.write_text('<<<serial>>> \\includegraphics[width=2in]{fig1}\n')
+        try:
+            specs = {'structure': [{'source': source.name}]}
+            D1, D2 = Document(specs), Document(specs)
+            self.assertIs(D1.blocks[0].template, D2.blocks[0].template)
+            self.assertEqual(D1.embedded_graphics, ['fig1'])
+            self.assertIn('serial', D2.blocks[0].substitution_map)
+            # a source that changes is read again
+            source.write_text('<<<idx>>> changed\n')
+            mtime = source.stat().st_mtime_ns + 1000000000
+            os.utime(source, ns=(mtime, mtime))
+            D3 = Document(specs)
+            self.assertEqual(D3.embedded_graphics, [])
+            self.assertNotIn('serial', D3.blocks[0].substitution_map)
+        finally:
+            source.unlink()
+
+    def test_document_fragment_hashes(self):
+        specs = {'structure': [{'text': 'static'}, {'text': 'serial <<<serial>>>'}]}
+        D = Document(specs)
+        hashes = []
+        for serial in [1, 2]:
+            D.make_substitutions(dict(serial=serial))
+            hashes.append(D.fragment_hashes())
+        self.assertEqual(hashes[0][0], hashes[1][0])
+        self.assertNotEqual(hashes[0][1], hashes[1][1])
+
+    def test_document_block_at(self):
+        specs = {'structure': [{'text': 'one\ntwo'}, {'text': 'three'}]}
+        D = Document(specs)
+        D.make_substitutions(dict(serial=1))
+        lines = D.source().splitlines()
+        for block, text in zip(D.blocks, ['two', 'three']):
+            self.assertIs(D.block_at(lines.index(text) + 1), block)
+        self.assertIsNone(D.block_at(1))
+        self.assertIs(D.block_at(lines.index('three') + 2, precompiled=True), D.blocks[1])
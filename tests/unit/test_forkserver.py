@@ -0,0 +1,36 @@
+import shlex
+import subprocess
+import unittest
+from pathlib import Path
+
+from pygacity.util.forkserver import ForkServer
+
+SCRIPT = """import sys, os
+print('json' in sys.modules, sys.argv[1:])
+print('to stderr', file=sys.stderr)
+sys.exit(3)
+"""
+
+@unittest.skipUnless(ForkServer.available(), 'fork server needs os.fork and socket.send_fds')
+class ForkServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.script = Path('forkserver_test.py')
+        self.script.write_text(SCRIPT)
+
+    def tearDown(self):
+        self.script.unlink()
+
+    def test_run_script(self):
+        with ForkServer(preload=['json']) as F:
+            command = shlex.split(F.interpreter_command()) + [self.script.name, 'x']
+            for i in range(2):
+                result = subprocess.run(command, capture_output=True, text=True)
+                self.assertEqual(result.returncode, 3)
+                self.assertEqual(result.stdout, "True ['x']\n")
+                self.assertEqual(result.stderr, 'to stderr\n')
+        self.assertFalse(F.socket_path.exists())
+        # without a server, the client runs the script itself
+        result = subprocess.run(command, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 3)
+        self.assertIn("['x']", result.stdout)
@@ -0,0 +1,54 @@
+import unittest
+import pandas as pd
+
+from pygacity.generate.answerset import AnswerSet, AnswerSuperSet
+from pygacity.generate.grade import Grader
+
+class GraderTest(unittest.TestCase):
+
+    def make_superset(self):
+        sets = []
+        for s in [101, 102, 103]:
+            A = AnswerSet(s)
+            A.register(1, label='V', units='m$^3$', value=10.0 * s, group=1)
+            A.register(1, label='n', value=s, group=1)
+            A.register(2, label='TF', value='T' if s % 2 else 'F', group=2)
+            sets.append(A)
+        return AnswerSuperSet(sets)
+
+    def test_grade(self):
+        G = Grader(self.make_superset(), rtol=0.01, answers={'n': {'atol': 0.5, 'rtol': 0.0, 'points': 2}})
+        responses = pd.DataFrame({'student': ['a', 'b', 'c', 'd'],
+                                  'serial': [103, 101, 102, 999],
+                                  '1-V (m$^3$)': [1035.0, 1011.0, 'x', 1020.0],
+                                  '1-n': [103.4, 100, 102, 102],
+                                  '2-TF': [' t', 'T', 'T', 'F']})
+        result = G.grade(responses)
+        self.assertEqual(list(result['1-V (m$^3$)']), [1, 1, 0, 0])
+        self.assertEqual(list(result['1-n']), [1, 0, 1, 0])
+        self.assertEqual(list(result['2-TF']), [1, 1, 0, 0])
+        self.assertEqual(list(result['score']), [4, 2, 2, 0])
+        self.assertEqual(list(result['possible']), [4, 4, 4, 4])
+        self.assertEqual(list(result['student']), ['a', 'b', 'c', 'd'])
+
+    def test_missing_columns(self):
+        G = Grader(self.make_superset())
+        responses = pd.DataFrame({'serial': [102], '1-n': [102]})
+        with self.assertLogs('pygacity.generate.grade', level='WARNING'):
+            result = G.grade(responses)
+        self.assertEqual(result['percent'][0], 100.0)
+        with self.assertRaises(KeyError):
+            G.grade(pd.DataFrame({'serial': [102], 'other': [1]}))
+
+    def test_first_value_missing(self):
+        # the first serial's missing value does not make the column textual
+        sets = []
+        for s in [101, 102]:
+            A = AnswerSet(s)
+            A.register(1, label='V', value=None if s == 101 else 2.0, group=1)
+            sets.append(A)
+        G = Grader(AnswerSuperSet(sets), rtol=0.01)
+        self.assertTrue(G.numeric[0])
+        key = G.keys[0]
+        result = G.grade(pd.DataFrame({'serial': [102, 102, 101], key: ['2.01', 3.0, 1.0]}))
+        self.assertEqual(list(result[key]), [1, 0, 0])
@@ -0,0 +1,45 @@
+import unittest
+from pathlib import Path
+from shutil import rmtree
+
+from pygacity.generate.manifest import BuildManifest
+
+def make_result(serial, build_path):
+    tex = build_path / f'doc-{serial}.tex'
+    tex.write_text('source')
+    (build_path / f'doc-{serial}.pdf').write_text('pdf')
+    return dict(serial=serial, tex=[str(tex)], jobs=[f'doc-{serial}'], cached=[], cache_entries=[['base', 'key', ['document.pdf']]],
+                buildfiles=[], solnbuildfiles=[], fragments=['a', 'b'])
+
+class BuildManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = Path('manifest_test')
+        self.dir.mkdir(exist_ok=True)
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def test_record_and_resume(self):
+        M = BuildManifest(self.dir)
+        signature = BuildManifest.signature({'structure': []}, {'copies': 3}, True)
+        M.start(signature, [1, 2, 3], self.dir / 'scratch')
+        M.record(make_result(1, self.dir))
+        M.record(make_result(2, self.dir))
+        # a line cut short by a crash
+        with M.path.open('a') as f:
+            f.write('{"serial": 3, "te')
+        R = BuildManifest(self.dir)
+        self.assertEqual(R.header['serials'], [1, 2, 3])
+        self.assertEqual(R.header['signature'], signature)
+        self.assertEqual(sorted(R.results), [1, 2])
+        self.assertEqual(R.results[1]['cache_entries'], [['base', 'key', ['document.pdf']]])
+        # a serial whose products are gone is not complete
+        (self.dir / 'doc-2.pdf').unlink()
+        self.assertEqual(list(R.completed(self.dir)), [1])
+        R.remove()
+        self.assertEqual(BuildManifest(self.dir).header, {})
+
+    def test_signature(self):
+        self.assertEqual(BuildManifest.signature({'a': 1, 'b': 2}), BuildManifest.signature({'b': 2, 'a': 1}))
+        self.assertNotEqual(BuildManifest.signature({'a': 1}, True), BuildManifest.signature({'a': 1}, False))
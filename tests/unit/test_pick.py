@@ -1,9 +1,13 @@
 import unittest
-from pygacity.generate.pick import Picker, Stepper
+from pygacity.generate.build import report_variants
+from pygacity.generate.pick import Picker, PickPlan, Stepper
 import numpy as np
 from itertools import product
 from argparse import Namespace
 
+def product_of(state):
+    return state.a * state.b
+
 class PickTest(unittest.TestCase):
 
     def test_picker1(self):
@@ -25,6 +29,136 @@ class PickTest(unittest.TestCase):
                             'mdot': {'pick':{'between':[10,50],'round':0}}})
         self.assertTrue(state.P1 in [2.9,3.1,3.3,3.5,3.7,3.9])
     
+    def test_picker_digest(self):
+        specs = lambda: {'a': {'pick': {'pickfrom': [1, 2]}}}
+        digests = {}
+        for serial in range(1, 20):
+            P = Picker(serial)
+            state = P.pick_state(specs())
+            digests.setdefault(state.a, set()).add(P.digest())
+        self.assertEqual(sorted(digests.keys()), [1, 2])
+        self.assertTrue(all(len(d) == 1 for d in digests.values()))
+
+    def test_pickplan(self):
+        specs = lambda: {'P1': {'pick': {'between': [2.9, 3.9], 'round': 1}},
+                         'T1C': {'pick': {'between': [340, 360]}},
+                         'sub': {'x': {'default': 2, 'pick': {'pickfrom': [1, 2, 3]}}, 'y': 5},
+                         'name': {'pick': {'from': ['a', 'b']}},
+                         'mdot': 100.0}
+        spec = specs()
+        P = Picker(12345678)
+        state = P.pick_state(spec)
+        # specs are not changed
+        self.assertEqual(spec, specs())
+        plan = PickPlan(specs())
+        self.assertEqual([r.path for r in plan.rules], [('P1',), ('T1C',), ('sub', 'x'), ('name',)])
+        serials = [12345678, 7, 8]
+        states = plan.states(serials)
+        for serial, S in zip(serials, states):
+            self.assertEqual(repr(vars(S)), repr(vars(Picker(serial).pick_state(specs()))))
+        self.assertEqual(states[1].mdot, 100.0)
+        A = plan.states(serials, structured=True)
+        self.assertEqual(A.dtype.names, ('P1', 'T1C', 'sub.x', 'name'))
+        self.assertEqual(A['T1C'][0], state.T1C)
+        self.assertEqual(A['name'][2], states[2].name)
+        # a compiled plan picks as its spec does, from the same stream
+        P2 = Picker(12345678)
+        self.assertEqual(repr(vars(P2.pick_state(plan))), repr(vars(state)))
+        self.assertEqual(P2.digest(), P.digest())
+        # serial 0 takes the defaults, which every picked value must have
+        with self.assertRaises(AssertionError):
+            plan.states([0])
+        self.assertEqual(PickPlan({'sub': specs()['sub']}).states([0])[0].sub, {'x': 2, 'y': 5})
+
+    def test_picker_constraints(self):
+        specs = lambda: {'T1': {'pick': {'between': [300, 400], 'round': 0}},
+                         'T2': {'pick': {'between': [300, 400], 'round': 0, 'where': 'T2 > T1 + 50'}},
+                         'feed': {'z': {'pick': {'pickfrom': [0.2, 0.4, 0.6]}}, 'F': 100.0}}
+        constraints = ['feed.z * feed.F > 30']
+        plan = PickPlan(specs(), constraints=constraints)
+        serials = list(range(1, 50))
+        for serial, S in zip(serials, plan.states(serials)):
+            self.assertGreater(S.T2, S.T1 + 50)
+            self.assertGreater(S.feed['z'], 0.3)
+            self.assertEqual(vars(S), vars(Picker(serial).pick_state(specs(), constraints=constraints)))
+        # a state that meets the constraints is the one picked without them
+        unconstrained = [Picker(serial).pick_state(specs()) for serial in serials]
+        for serial, S in zip(serials, unconstrained):
+            if S.T2 > S.T1 + 50 and S.feed['z'] > 0.3:
+                self.assertEqual(vars(S), vars(Picker(serial).pick_state(specs(), constraints=constraints)))
+        S = Picker(3).pick_state(specs(), feasible=lambda state: state.T1 % 7 == 0)
+        self.assertEqual(S.T1 % 7, 0)
+        # expressions that are not vectorized are evaluated one state at a time
+        S = Picker(3).pick_state(specs(), constraints=['T1 < 350 and feed.z == 0.6'])
+        self.assertTrue(S.T1 < 350 and S.feed['z'] == 0.6)
+        with self.assertRaisesRegex(Exception, '"T1 > 500": 100'):
+            Picker(3).pick_state(PickPlan(specs(), constraints=['T1 > 500'], max_candidates=100))
+        with self.assertRaisesRegex(Exception, 'could not be evaluated'):
+            Picker(3).pick_state(specs(), constraints=['T9 > 0'])
+
+    def test_picker_unique(self):
+        specs = lambda: {'P': {'default': 1.0, 'pick': {'between': [1, 2], 'round': 1}},
+                         'z': {'default': 0.2, 'pick': {'pickfrom': [0.2, 0.4, 0.6]}},
+                         'F': 100.0}
+        plan = PickPlan(specs())
+        self.assertEqual(plan.radices, [11, 3])
+        self.assertEqual(plan.variants, 33)
+        self.assertIsNone(PickPlan({'P': {'pick': {'between': [1, 2]}}}).variants)
+        # ordinals below the number of variants pick every variant once
+        states = [vars(Picker(1000 + k, ordinal=k).pick_state(specs())) for k in range(33)]
+        self.assertEqual(len(set((S['P'], S['z']) for S in states)), 33)
+        self.assertTrue(all(1 <= S['P'] <= 2 and S['z'] in [0.2, 0.4, 0.6] and S['F'] == 100.0 for S in states))
+        # then they repeat, whatever the serial
+        self.assertEqual(vars(Picker(5, ordinal=33).pick_state(specs())), states[0])
+        # with constraints, only the variants that meet them are used
+        picked = set()
+        for k in range(15):
+            S = Picker(1000 + k, ordinal=k).pick_state(specs(), constraints=['P * z > 0.5'])
+            self.assertGreater(S.P * S.z, 0.5)
+            picked.add((S.P, S.z))
+        self.assertEqual(len(picked), 15)
+        # a plan used for many ordinals checks each variant at most once
+        checked = []
+        plan = PickPlan(specs(), constraints=['P * z > 0.5'], feasible=lambda S: checked.append(S) or True)
+        reused = [vars(Picker(1000 + k, ordinal=k).pick_state(plan)) for k in range(15)]
+        self.assertEqual(set((S['P'], S['z']) for S in reused), picked)
+        # (all of them, since the picker counts those that meet the constraints)
+        self.assertEqual(len(checked), 19)
+        self.assertEqual(plan.admissible(), 19)
+        self.assertEqual(len(checked), 19)
+        # so a constrained pick allows only that many variants
+        variants, picked = {}, []
+        for k in range(25):
+            P = Picker(1000 + k, ordinal=k)
+            S = P.pick_state(specs(), constraints=['P * z > 0.5'])
+            variants[1000 + k] = P.variants()
+            picked.append((S.P, S.z))
+        self.assertEqual(set(variants.values()), {19})
+        self.assertEqual(len(set(picked[:19])), 19)
+        with self.assertLogs('pygacity.generate.build', level='WARNING'):
+            self.assertEqual(report_variants(len(variants), variants, unique=True), 19)
+        self.assertEqual(Picker(0, ordinal=4).pick_state(specs()).P, 1.0)
+        P = Picker(1, ordinal=0)
+        P.pick_state(specs())
+        P.pick_state({'k': {'pick': {'pickfrom': [1, 2]}}})
+        self.assertEqual(P.variants(), 66)
+        # separate picks of equal size combine into one index over all of them
+        documents = []
+        for k in range(27):
+            P = Picker(1000 + k, ordinal=k)
+            documents.append(tuple(P.pick_state({'k': {'pick': {'pickfrom': [1, 2, 3]}}}).k for _ in range(3)))
+            self.assertEqual(P.variants(), 27)
+        for n in [3, 9, 27]:
+            self.assertEqual(len(set(documents[:n])), n)
+        # the later picks vary among the first serials too
+        self.assertEqual(len(set(d[2] for d in documents[:3])), 3)
+        P = Picker(1)
+        P.pick_state(specs())
+        P.pick_state({'k': {'pick': {'pickfrom': [1, 2, 3]}}})
+        self.assertEqual(P.variants(), 99)
+        P.pick_state({'x': {'pick': {'between': [1, 2]}}})
+        self.assertIsNone(P.variants())
+
     def test_picker_defaults(self):
         P=Picker(0)
         state=P.pick_state(dict(P={'default':10.0,'pick':{'between':[9,11],'round':2}}))
@@ -78,4 +212,33 @@ class PickTest(unittest.TestCase):
         for i,N in enumerate(S):
             # if i>9: break
             # self.assertEqual(N.P1,2.9)
-            self.assertEqual(N.mdot,100.0)
\ No newline at end of file
+            self.assertEqual(N.mdot,100.0)
+
+    def test_stepper_chunks(self):
+        specs = lambda: {'a': {'pick': {'between': [0, 1], 'intervals': 3}}, 'c': 5.0,
+                         'b': {'pick': {'pickfrom': [1, 2]}}, 'd': [7, 8]}
+        S = Stepper(specs())
+        self.assertEqual(len(S), 12)
+        expected = list(product(np.linspace(0, 1, 3), [1, 2], [7, 8]))
+        self.assertEqual([(N.a, N.b, N.c, N.d) for N in S], [(a, b, 5.0, d) for a, b, d in expected])
+        chunks = list(Stepper(specs()).chunks(chunk_size=5))
+        self.assertEqual([len(c) for c in chunks], [5, 5, 2])
+        self.assertEqual(chunks[0].dtype.names, ('a', 'b', 'd'))
+        self.assertEqual([tuple(r) for c in chunks for r in c], expected)
+        self.assertEqual(Stepper(specs()).map(product_of, jobs=2), [a * b for a, b, d in expected])
+        self.assertEqual(Stepper(specs()).map(product_of, jobs=1), [a * b for a, b, d in expected])
+
+    def test_stepper_sampling(self):
+        specs = {'a': {'pick': {'between': [2, 4], 'round': 2}}, 'b': {'pick': {'pickfrom': ['x', 'y', 'z']}}}
+        for method in ['lhs', 'sobol']:
+            S = Stepper(specs, method=method, samples=16, seed=1)
+            self.assertEqual(len(S), 16)
+            A = next(S.chunks())
+            self.assertTrue(np.all((A['a'] >= 2) & (A['a'] <= 4)))
+            self.assertEqual(set(A['b']), {'x', 'y', 'z'})
+            self.assertTrue(np.array_equal(A['a'], next(Stepper(specs, method=method, samples=16, seed=1).chunks())['a']))
+        # each of the 16 equal strata of the range holds one Latin hypercube sample
+        A = next(Stepper({'a': {'pick': {'between': [0, 1]}}}, method='lhs', samples=16, seed=2).chunks())
+        self.assertEqual(sorted((A['a'] * 16).astype(int)), list(range(16)))
+        with self.assertRaises(ValueError):
+            Stepper(specs, method='lhs')
@@ -0,0 +1,58 @@
+import unittest
+from pathlib import Path
+from shutil import rmtree
+
+from pygacity.generate.pycode import PycodeExecutor, PycodeError
+
+SOURCE = r"""\begin{pycode}
+x = 3
+print(r'\textbf{x}')
+\end{pycode}
+Twice $x$ is \py{2*x}, or \py{f'{2*x:.2f}'}; \pyc{print(x + 1)} and \py|x|.
+% \py{undefined}
+\begin{pycode}[other]
+x = 'other'
+\end{pycode}\py[other]{x} \py{x}
+"""
+
+class PycodeExecutorTest(unittest.TestCase):
+
+    def test_expand(self):
+        expanded = PycodeExecutor().expand(SOURCE)
+        self.assertEqual(expanded, "\\textbf{x}\nTwice $x$ is 6, or 6.00; 4 and 3.\n% \\py{undefined}\nother 3\n")
+
+    def test_not_invoked(self):
+        # \py without an argument, as in a macro definition, is left alone
+        source = '\\pyc{x = 1}\\def\\foo{\\py}\\py{ x } and (\\py) [\\py]\\py\\relax'
+        self.assertEqual(PycodeExecutor().expand(source), '\\def\\foo{\\py}1 and (\\py) [\\py]\\py\\relax')
+
+    def test_supports(self):
+        self.assertTrue(PycodeExecutor.supports(SOURCE))
+        self.assertFalse(PycodeExecutor.supports(r'\begin{pyconsole}x\end{pyconsole}'))
+        self.assertFalse(PycodeExecutor.supports(r'\pys{!{x}}'))
+
+    def test_error(self):
+        with self.assertRaises(PycodeError) as cm:
+            PycodeExecutor().expand('line 1\n\\py{undefined_name}')
+        self.assertIn('line 2', str(cm.exception))
+
+    def test_working_dir(self):
+        d = Path('pycode_test')
+        d.mkdir(exist_ok=True)
+        try:
+            PycodeExecutor().expand("\\begin{pycode}\nopen('out.txt', 'w').write('x')\n\\end{pycode}", working_dir=d)
+            self.assertTrue((d / 'out.txt').exists())
+            self.assertFalse(Path('out.txt').exists())
+        finally:
+            rmtree(d)
+
+    def test_execute(self):
+        d = Path('pycode_test')
+        d.mkdir(exist_ok=True)
+        try:
+            source = "\\begin{pycode}\nopen('out.txt', 'w').write('x')\n\\end{pycode}\n\\py{undefined_name} \\pyc{open('c.txt', 'w')}"
+            self.assertIsNone(PycodeExecutor().execute(source, working_dir=d))
+            self.assertTrue((d / 'out.txt').exists())
+            self.assertTrue((d / 'c.txt').exists())
+        finally:
+            rmtree(d)
@@ -0,0 +1,73 @@
+import unittest
+from pathlib import Path
+from shutil import rmtree
+from tempfile import TemporaryDirectory
+
+from pygacity.generate.document import Document
+from pygacity.util.texformat import PreambleFormat
+
+# stands in for pdflatex: dumps a "format" but logs an error, as nonstopmode does
+errored_engine = '''#!/bin/sh
+for a in "$@"; do case $a in -jobname=*) job=${a#-jobname=};; esac; done
+[ -n "$job" ] || exit 0
+echo fmt > $job.fmt
+echo "./$job.tex:3: Undefined control sequence." > $job.log
+exit 1
+'''
+
+def specs(options=['11pt'], preamble=r'\usepackage{tgheros}'):
+    return {'class': {'classname': 'autoprob', 'options': list(options)},
+            'preamble': preamble,
+            'structure': [{'text': r'\begin{document}'}, {'text': r'\end{document}'}]}
+
+class PreambleFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.format_dir = Path('texformat_test')
+
+    def tearDown(self):
+        if self.format_dir.exists():
+            rmtree(self.format_dir)
+
+    def test_key(self):
+        F = PreambleFormat(Document(specs()), self.format_dir)
+        self.assertEqual(F.key, PreambleFormat(Document(specs()), self.format_dir).key)
+        self.assertNotEqual(F.key, PreambleFormat(Document(specs(preamble='')), self.format_dir).key)
+        self.assertNotEqual(F.key, PreambleFormat(Document(specs(options=['11pt', 'solutions'])), self.format_dir).key)
+        self.assertTrue(F.path.name.startswith('pygacity-'))
+
+    def test_source(self):
+        D = Document(specs())
+        F = PreambleFormat(D, self.format_dir)
+        self.assertIn(r'\documentclass[11pt]{autoprob}', F.source())
+        self.assertTrue(F.source().rstrip().endswith(r'\endofdump'))
+        self.assertNotIn(r'\endofdump', D.source())
+        self.assertIn(r'\endofdump', D.source(precompiled=True))
+        self.assertLess(D.source(precompiled=True).index(r'\endofdump'),
+                        D.source(precompiled=True).index(r'\begin{document}'))
+
+    def test_prune(self):
+        self.format_dir.mkdir()
+        for name in ['pygacity-a.fmt', 'pygacity-a.log', 'pygacity-b.fmt']:
+            (self.format_dir / name).write_text('')
+        PreambleFormat.prune(self.format_dir, keep=[self.format_dir / 'pygacity-a.fmt'])
+        self.assertEqual(sorted(f.name for f in self.format_dir.iterdir()), ['pygacity-a.fmt', 'pygacity-a.log'])
+
+    def test_deferred_use(self):
+        self.assertEqual(PreambleFormat(Document(specs()), self.format_dir).deferred_use(), '')
+        F = PreambleFormat(Document(specs(preamble=r'\hypersetup{colorlinks=true}')), self.format_dir, pdflatex='no-such-pdflatex')
+        self.assertEqual(F.deferred_use(), r'\hypersetup')
+        self.assertFalse(F.build())
+        self.assertFalse(self.format_dir.exists())
+        self.assertEqual(PreambleFormat(Document(specs(preamble=r'\setpythontexoutputdir{.}')), self.format_dir).deferred_use(),
+                         r'\setpythontexoutputdir')
+
+    def test_build_errors(self):
+        with TemporaryDirectory() as d:
+            engine = Path(d) / 'pdflatex'
+            engine.write_text(errored_engine)
+            engine.chmod(0o755)
+            F = PreambleFormat(Document(specs()), self.format_dir, pdflatex=str(engine))
+            self.assertFalse(F.build())
+            self.assertFalse(F.path.exists())
+            self.assertTrue((self.format_dir / f'{F.name}.log').exists())
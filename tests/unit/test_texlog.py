@@ -0,0 +1,86 @@
+import unittest
+from pathlib import Path
+
+from pygacity.util.texlog import LatexLog, aux_labels, pythontex_errors, pytxcode_signature, tree_digest
+
+LOG = r"""This is pdfTeX, Version 3.141592653-2.6-1.40.25 (TeX Live 2023) (preloaded format=pdflatex)
+(./ExamI-1234.tex
+LaTeX2e <2022-11-01> patch level 1
+./ExamI-1234.tex:42: Undefined control sequence.
+l.42 \foo
+         {bar}
+LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.
+Output written on ExamI-1234.pdf (3 pages, 61234 bytes).
+"""
+
+PYTXCODE = """=>PYTHONTEX#py#default#default#0#c#####{line}#
+x = 1
+=>PYTHONTEX#py#default#default#0#i#####{line2}#
+x
+=>PYTHONTEX:SETTINGS#
+outputdir=pythontex-files-{job}
+"""
+
+class LatexLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.logfile = Path('texlog_test.log')
+        self.logfile.write_text(LOG)
+        self.auxfile = Path('texlog_test.aux')
+
+    def tearDown(self):
+        self.logfile.unlink()
+        if self.auxfile.exists():
+            self.auxfile.unlink()
+
+    def test_log_parse(self):
+        L = LatexLog(self.logfile)
+        self.assertTrue(L.needs_rerun)
+        self.assertEqual(len(L.errors), 1)
+        self.assertEqual(L.errors[0], ('./ExamI-1234.tex', 42, 'Undefined control sequence.'))
+        self.assertEqual(L.first_error(), r'./ExamI-1234.tex:42: Undefined control sequence. (at "\foo")')
+        self.assertFalse(L.fatal)
+
+    def test_log_missing(self):
+        L = LatexLog('no-such-file.log')
+        self.assertFalse(L.needs_rerun)
+        self.assertEqual(L.first_error(), '')
+
+    def test_aux_labels(self):
+        self.assertEqual(aux_labels(self.auxfile), set())
+        self.auxfile.write_text('\\relax\n\\newlabel{eq:1}{{1}{1}}\n')
+        self.assertEqual(aux_labels(self.auxfile), {'\\newlabel{eq:1}{{1}{1}}'})
+
+    def test_tree_digest(self):
+        self.assertEqual(tree_digest('no-such-dir'), '')
+        d = tree_digest(self.logfile)
+        self.assertEqual(d, tree_digest(self.logfile))
+        self.logfile.write_text(LOG + 'more')
+        self.assertNotEqual(d, tree_digest(self.logfile))
+
+    def test_pytxcode_signature(self):
+        a, b = Path('texlog_test_a.pytxcode'), Path('texlog_test_b.pytxcode')
+        try:
+            a.write_text(PYTXCODE.format(line=10, line2=12, job='ExamI-1'))
+            b.write_text(PYTXCODE.format(line=11, line2=14, job='ExamI_soln-1'))
+            self.assertEqual(pytxcode_signature(a, 'ExamI-1'), pytxcode_signature(b, 'ExamI_soln-1'))
+            b.write_text(PYTXCODE.format(line=11, line2=14, job='ExamI_soln-1').replace('x = 1', 'x = 2'))
+            self.assertNotEqual(pytxcode_signature(a, 'ExamI-1'), pytxcode_signature(b, 'ExamI_soln-1'))
+            self.assertEqual(pytxcode_signature('no-such-file.pytxcode', 'x'), '')
+        finally:
+            a.unlink()
+            b.unlink()
+
+    def test_pythontex_errors(self):
+        output = """This is PythonTeX 0.18
+----  Errors and Warnings for ExamI-1234.tex  ----
+* PythonTeX stderr - error on line 57:
+  File "<outputdir>/py_default_default.py", line 40, in <module>
+    nosuchname + 1
+NameError: name 'nosuchname' is not defined
+
+--------------------------------------------------
+PythonTeX:  ExamI-1234 - 1 error(s), 0 warning(s)
+"""
+        self.assertEqual(pythontex_errors(output), ["line 57: NameError: name 'nosuchname' is not defined"])
+        self.assertEqual(pythontex_errors('PythonTeX:  ExamI-1234 - 0 error(s), 0 warning(s)\n'), [])
@@ -0,0 +1,50 @@
+import unittest
+import pandas as pd
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from pygacity.generate.validate import SweepPicker, _Excluded, failure_free, regions, validate
+
+problem = """
+S = Pick.pick_state(dict(
+    x={'pick': {'between': [-1.0, 1.0], 'intervals': 5}},
+    k={'pick': {'pickfrom': [1, 2], 'where': 'k + x > 0'}},
+    c=3))
+import math
+y = math.sqrt(S.x) * S.k * S.c
+"""
+
+class ValidateTest(unittest.TestCase):
+
+    def test_sweep_picker(self):
+        specs = dict(x={'pick': {'between': [0, 1], 'where': 'x < 0.5'}}, c=1)
+        P = SweepPicker([dict(x=0.25, c=1), dict(x=0.75, c=1)])
+        self.assertEqual(P.pick_state(specs).x, 0.25)
+        with self.assertRaises(_Excluded):
+            P.pick_state(specs)
+        # beyond the given states, picks are random but still meet the constraints
+        self.assertLess(P.pick_state(specs).x, 0.5)
+        self.assertEqual(len(P.plans), 3)
+
+    def test_validate(self):
+        with TemporaryDirectory() as d:
+            source = Path(d) / 'problem.py'
+            source.write_text(problem)
+            frame = validate(source, pythontex=[], jobs=1)
+        self.assertEqual(list(frame.columns), ['x', 'k', 'status', 'error', 'seconds'])
+        self.assertEqual(len(frame), 10)
+        status = dict(zip(zip(frame['x'], frame['k']), frame['status']))
+        self.assertEqual(status[(-1.0, 1)], 'excluded')
+        self.assertEqual(status[(-1.0, 2)], 'error')
+        self.assertEqual(status[(0.5, 1)], 'ok')
+        self.assertIn('math domain error', frame.loc[frame['status'] == 'error', 'error'].iloc[0])
+        tables = regions(frame, ['x', 'k'])
+        self.assertEqual(list(tables['x']['failed']), [1, 2, 0, 0, 0])
+        self.assertEqual(list(tables['x']['points']), [1, 2, 2, 2, 2])
+        self.assertEqual(failure_free(tables['x']), (0.0, 1.0))
+
+    def test_failure_free(self):
+        table = pd.DataFrame({'failed': [0, 1, 0, 0, 2, 0]}, index=[1, 2, 3, 4, 5, 6])
+        self.assertEqual(failure_free(table), (3, 4))
+        self.assertIsNone(failure_free(pd.DataFrame({'failed': [1]}, index=[1])))